@@ -0,0 +1,33 @@
+import logging
+import sys
+import time
+
+import pandas as pd
+
+from tests.datafiles_stub import DatafilesStub, build_datafiles, build_files_in_scope
+from tests.test_datafiles_loader import download
+
+# Benchmark of the concurrent downloads of DatafilesLoader against the sequential downloads (max_workers=1),
+# on datafiles served by a local stub answering each request after a fixed latency (as a remote publisher would)
+# Usage: python -m benchmarks.bench_datafiles_download [number of files] [latency in seconds]
+
+def main(count=64, latency=0.1):
+    logging.disable(logging.CRITICAL)
+    files = build_datafiles(count)
+    with DatafilesStub(files, latency=latency) as stub:
+        files_in_scope = build_files_in_scope(stub)
+        timings = {}
+        corpora = {}
+        for max_workers in (1, 4, 8, 16):
+            start = time.perf_counter()
+            corpora[max_workers] = download(files_in_scope, max_workers).corpus
+            timings[max_workers] = time.perf_counter() - start
+
+    for corpus in corpora.values():
+        for reference_df, df in zip(corpora[1], corpus):
+            pd.testing.assert_frame_equal(reference_df, df)
+    print(f"{len(files_in_scope)} files, {latency}s latency per request")
+    print(" | ".join(f"max_workers={max_workers}: {timing:.2f}s" for max_workers, timing in timings.items()) + " | same corpus")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 64, float(sys.argv[2]) if len(sys.argv) > 2 else 0.1)
@@ -0,0 +1,71 @@
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import openpyxl
+import pandas as pd
+import requests
+
+from scripts.loaders import excel_loader
+from scripts.loaders.excel_loader import ExcelLoader
+from scripts.utils.dataframe_operation import detect_skiprows, detect_skipcolumns
+
+# Benchmark of ExcelLoader against the former read of the whole sheet (pd.read_excel with header=None, then detection of
+# the table position on the whole frame), on a subsidies XLSX file whose table starts after a title and an empty column
+# ExcelLoader is run with python-calamine (when installed) and with its openpyxl fallback
+# Usage: python -m benchmarks.bench_excel_loader [number of rows]
+
+# Function to read the sheet as the former ExcelLoader did (reference output)
+def read_excel_whole_sheet(file_path):
+    df = pd.read_excel(file_path, header=None)
+    df = df.iloc[detect_skiprows(df):, detect_skipcolumns(df):]
+    df.columns = df.iloc[0]
+    return df.drop(df.index[0]).reset_index(drop=True)
+
+def build_workbook(file_path, rows):
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append([None, "Subventions versées aux associations"])
+    sheet.append([])
+    sheet.append([None, "siren", "nomBeneficiaire", "objet", "montant", "dateConvention"])
+    for i in range(rows):
+        sheet.append([None, 200000000 + i, f"Association {i % 997}", f"Subvention de fonctionnement {i % 13}", 150.5 * (i % 400), pd.Timestamp("2023-01-01") + pd.Timedelta(days=i % 365)])
+    workbook.save(file_path)
+
+# Function to load the file with ExcelLoader, from a response reading the body on disk
+def load(file_path):
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = open(file_path, "rb")
+    response.body_path = file_path
+    try:
+        return ExcelLoader(file_path).process_data(response)
+    finally:
+        response.raw.close()
+
+def main(rows=50000):
+    with tempfile.NamedTemporaryFile(suffix=".xlsx") as tmp_file:
+        build_workbook(tmp_file.name, rows)
+
+        start = time.perf_counter()
+        reference = read_excel_whole_sheet(tmp_file.name)
+        timings = {"read_excel (whole sheet)": time.perf_counter() - start}
+
+        outputs = {}
+        readers = {"ExcelLoader openpyxl": None}
+        if excel_loader.CalamineWorkbook is not None:
+            readers["ExcelLoader calamine"] = excel_loader.CalamineWorkbook
+        for name, calamine_workbook in readers.items():
+            with mock.patch.object(excel_loader, "CalamineWorkbook", calamine_workbook):
+                start = time.perf_counter()
+                outputs[name] = load(tmp_file.name)
+                timings[name] = time.perf_counter() - start
+
+    for output in outputs.values():
+        pd.testing.assert_frame_equal(output, reference)
+    print(f"{rows} rows x {reference.shape[1]} columns")
+    print(" | ".join(f"{name}: {timing:.2f}s" for name, timing in timings.items()) + " | same output")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,59 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from scripts.utils.config import get_project_base_path
+from scripts.utils.keyword_matcher import KeywordMatcher
+
+# Micro-benchmark of KeywordMatcher against the former keyword filtering of DataGouvSearcher:
+# - top down: one str.contains pass per filter over the catalog column (case insensitive, accents not folded)
+# - bottom up: any(word in text.lower() for word in words) per API result
+# The filters are the 'search.subventions' filters of config.yaml, the texts are synthetic catalog titles
+# Usage: python -m benchmarks.bench_keyword_matcher [number of titles]
+
+WORDS = (
+    "subvention subventions association associations versées conseil régional budget voirie aide aux écoles "
+    "interventions région des pays de la loire marchés conventions"
+).split()
+
+def build_titles(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    pool = [" ".join(rng.choice(WORDS, rng.integers(2, 9))) for _ in range(60000)]
+    titles = pd.Series(rng.choice(pool, rows).astype(object))
+    titles[rng.random(rows) < 0.02] = np.nan
+    return titles
+
+def main(rows=400000):
+    with open(get_project_base_path() / "config.yaml") as config_file:
+        search_config = yaml.safe_load(config_file)["search"]["subventions"]
+    titles = build_titles(rows)
+
+    # Top down: regex filter over a whole column
+    start = time.perf_counter()
+    former_mask = titles.str.contains(search_config["title_filter"], case=False, na=False)
+    former_time = time.perf_counter() - start
+    start = time.perf_counter()
+    mask = KeywordMatcher(search_config["title_filter"]).mask(titles)
+    matcher_time = time.perf_counter() - start
+    differing_titles = titles[former_mask != mask].unique()
+    print(f"title_filter over {rows} titles: str.contains {former_time:.2f}s | KeywordMatcher.mask {matcher_time:.2f}s")
+    print(f"  {former_mask.sum()} / {mask.sum()} matches, {len(differing_titles)} differing titles (accents folded by KeywordMatcher): {list(differing_titles[:3])}")
+
+    # Bottom up: word lists over single texts, as the API results are streamed
+    texts = titles.dropna().head(100000).tolist()
+    words = search_config["api"]["title"]
+    start = time.perf_counter()
+    former_matches = [any(word in text.lower() for word in words) for text in texts]
+    former_time = time.perf_counter() - start
+    matcher = KeywordMatcher(words, regex=False)
+    start = time.perf_counter()
+    matches = [matcher.search(text) for text in texts]
+    matcher_time = time.perf_counter() - start
+    print(f"api title words over {len(texts)} texts: any(word in text.lower()) {former_time:.2f}s | KeywordMatcher.search {matcher_time:.2f}s")
+    print(f"  {sum(former_matches)} / {sum(matches)} matches")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 400000)
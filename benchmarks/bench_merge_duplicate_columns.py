@@ -0,0 +1,54 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts.utils.dataframe_operation import merge_duplicate_columns
+
+# Micro-benchmark of merge_duplicate_columns on a wide synthetic frame, against the former row-wise join
+# (' / '.join of the non null values, with one Python call per row), applied to the exact duplicates selected by position
+# Usage: python -m benchmarks.bench_merge_duplicate_columns [number of rows]
+
+# Function to merge the duplicate columns row by row, as the former implementation joined them (reference output)
+def merge_duplicate_columns_rowwise(df):
+    merged_columns = {}
+    for col in dict.fromkeys(df.columns):
+        positions = [position for position, name in enumerate(df.columns) if name == col]
+        if len(positions) == 1:
+            merged_columns[col] = df.iloc[:, positions[0]]
+        else:
+            merged_columns[col] = df.iloc[:, positions].apply(lambda x: ' / '.join(x.dropna().astype(str)), axis=1)
+    return pd.DataFrame(merged_columns)
+
+# Function to build a wide frame: 3 exact 'montant' duplicates, near duplicates ('montant_3'...) which must not be merged,
+# and 6 names duplicated twice, with float & object columns holding nulls
+def build_wide_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    names = ["montant" if i < 3 else f"montant_{i}" if i < 8 else f"col{i % 6}" for i in range(20)]
+    columns = [
+        pd.Series(rng.choice(np.array(["a", "b", None], dtype=object), rows)) if i % 3
+        else pd.Series(np.where(rng.random(rows) < 0.3, np.nan, rng.random(rows)))
+        for i in range(len(names))
+    ]
+    df = pd.concat(columns, axis=1)
+    df.columns = names
+    return df
+
+def main(rows=100000):
+    df = build_wide_frame(rows)
+
+    start = time.perf_counter()
+    vectorized = merge_duplicate_columns(df.copy())
+    vectorized_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rowwise = merge_duplicate_columns_rowwise(df.copy())
+    rowwise_time = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(vectorized, rowwise)
+    print(f"{rows} rows x {df.shape[1]} columns -> {vectorized.shape[1]} columns")
+    print(f"row-wise join: {rowwise_time:.2f}s | merge_duplicate_columns: {vectorized_time:.3f}s | same output")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,38 @@
+import os
+import sys
+import time
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from scripts.utils.psql_connector import PSQLConnector
+from tests.test_psql_connector import build_typed_frame
+
+# Benchmark of the bulk save of PSQLConnector (COPY into a staging table, swapped with the table) against the former
+# to_sql path (save_df_to_sql: batches of 1000 INSERTs), on a frame with the types & null values of the normalized data
+# The tables are written to the (disposable) database of TEST_DATABASE_URL, then read back and compared
+# Usage: TEST_DATABASE_URL=postgresql://... python -m benchmarks.bench_psql_copy [number of rows]
+
+def main(rows=200000):
+    connector = PSQLConnector()
+    connector.engine = create_engine(os.environ["TEST_DATABASE_URL"])
+    df = build_typed_frame(rows)
+
+    start = time.perf_counter()
+    connector.save_df_to_sql(df, "bench_to_sql")
+    to_sql_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    connector.bulk_save_df(df, "bench_copy")
+    copy_time = time.perf_counter() - start
+
+    to_sql_table = pd.read_sql_query("SELECT * FROM bench_to_sql ORDER BY siren", connector.engine)
+    copy_table = pd.read_sql_query("SELECT * FROM bench_copy ORDER BY siren", connector.engine)
+    pd.testing.assert_frame_equal(to_sql_table, copy_table)
+    for table_name in ["bench_to_sql", "bench_copy"]:
+        connector.drop_table_if_exists(table_name)
+    print(f"{rows} rows x {df.shape[1]} columns")
+    print(f"to_sql: {to_sql_time:.2f}s | COPY: {copy_time:.2f}s | same table")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
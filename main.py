@@ -1,6 +1,7 @@
 from scripts.utils.argument_parser import ArgumentParser
 from scripts.utils.config_manager import ConfigManager
 from scripts.utils.logger_manager import LoggerManager
+from scripts.loaders.http_cache import HttpCache
 from scripts.workflow.workflow_manager import WorkflowManager
 
 if __name__ == "__main__":
@@ -8,6 +9,7 @@ if __name__ == "__main__":
     args = ArgumentParser.parse_args("Gestionnaire du projet LocalOuvert")
     config = ConfigManager.load_config(args.filename)        
     LoggerManager.configure_logger(config)
+    HttpCache.configure(config.get("http_cache"))
 
     # Run workflow
     workflow_manager = WorkflowManager(args, config)
@@ -48,24 +48,18 @@ class CommunitiesSelector():
         # Load data from OFGL, ODF, and Sirene datasets
         ofgl = OfglLoader(config["ofgl"])
         odf = OdfLoader(config["odf"])
-        sirene = SireneLoader(config["sirene"])
         ofgl_data = ofgl.get()
         odf_data = odf.get()
 
-        # Prepare & Merge OFGL and ODF data on 'siren' column
-        # TODO : If you cast to Int, it breaks
-        # TODO : casting seems redundant, check if it's necessary
+        # Merge OFGL and ODF data on 'siren' column (typed as int by the loaders)
         # TODO Manage columns outside of classes (configs ?)
-        ofgl_data["siren"] = pd.to_numeric(ofgl_data["siren"], errors="coerce")
-        ofgl_data["siren"] = ofgl_data["siren"].fillna(0).astype(int) 
-        odf_data["siren"] = pd.to_numeric(odf_data["siren"], errors="coerce")
-        odf_data["siren"] = odf_data["siren"].fillna(0).astype(int)
         all_data = ofgl_data.merge(odf_data[['siren', 'url_ptf', 'url_datagouv', 'id_datagouv', 'merge', 'ptf']], on='siren', how='left')
         all_data = all_data[['nom', 'siren', 'type', 'cog', 'cog_3digits', 'code_departement', 'code_departement_3digits', 'code_region', 'population', 'epci', 'url_ptf', 'url_datagouv', 'id_datagouv', 'merge', 'ptf']]
         
-        # Merge Sirene data on 'siren' column
+        # Merge Sirene data on 'siren' column (only the SIRENs of all_data are extracted from the Sirene file)
         all_data['siren'] = pd.to_numeric(all_data['siren'], errors='coerce')
         all_data["siren"] = all_data["siren"].fillna(0).astype(int)
+        sirene = SireneLoader(config["sirene"], all_data["siren"])
         all_data = all_data.merge(sirene.get(), on='siren', how='left')
         
         # Conversion of the 'trancheEffectifsUniteLegale' and 'population' columns to numeric type
@@ -103,7 +97,16 @@ class CommunitiesSelector():
 
         self._init_done = True
 
-     
+
+    # Function to build a selector from the selected data of a previous run (checkpoint), without loading the datasets again
+    # Only selected_data is set: it is the only data used after the communities scope stage
+    @classmethod
+    def from_selected_data(cls, selected_data):
+        communities_selector = object.__new__(cls)
+        communities_selector.logger = logging.getLogger(__name__)
+        communities_selector.selected_data = selected_data
+        return communities_selector
+
     def get_datagouv_ids(self):
         """
         Retrieve rows with non-null 'id_datagouv', returning a DataFrame with 'siren' and 'id_datagouv' columns.
@@ -1,13 +1,14 @@
 from pathlib import Path
 import pandas as pd
 
-from scripts.utils.files_operation import save_csv
+from scripts.utils.files_operation import normalize_column_names
+from scripts.utils.parquet_cache import ParquetCache
 from scripts.loaders.base_loader import BaseLoader
 from scripts.utils.config import get_project_base_path
 
 class OdfLoader():
     """
-    OdfLoader loads data from the ODF dataset and saves it to a CSV file.
+    OdfLoader loads data from the ODF dataset and caches it as a typed Parquet file (rebuilt when the URL or dtypes change).
     Data from OpenDataFrance, data.gouv.fr, 2022. 
     This dataset lists the platforms and organizations that contribute to the development of open data in the territories, identified during the 2022 edition (as of December 31).
 
@@ -16,17 +17,15 @@ class OdfLoader():
 
     def __init__(self,config):
         data_folder = Path(get_project_base_path()) / config["processed_data"]["path"]
-        data_file = data_folder / config["processed_data"]["filename"]
-        if data_file.exists():
-            self.data = pd.read_csv(data_file, sep=";")
-        else:
+        cache = ParquetCache(data_folder / config["processed_data"]["filename"], {"url": config["url"], "dtype": config["dtype"]})
+        self.data = cache.load()
+        if self.data is None:
             odf_data_loader = BaseLoader.loader_factory(config["url"], dtype=config["dtype"])
             odf_data = odf_data_loader.load()
-            self.data = odf_data
-            self.save(Path(config["processed_data"]["path"]),config["processed_data"]["filename"])
+            # Normalize the column names & type the siren column (missing sirens are set to 0)
+            odf_data.columns = normalize_column_names(odf_data.columns)
+            odf_data["siren"] = pd.to_numeric(odf_data["siren"], errors="coerce").fillna(0).astype(int)
+            self.data = cache.save(odf_data)
 
     def get(self):
         return self.data
-    
-    def save(self,path,filename):
-        save_csv(self.data,path,filename, sep=";", index=True)
@@ -1,51 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
 import numpy as np
 
-from scripts.utils.files_operation import save_csv
+from scripts.utils.files_operation import normalize_column_names
+from scripts.utils.parquet_cache import ParquetCache
 from scripts.loaders.base_loader import BaseLoader
 from scripts.utils.config import get_project_base_path
 
 class OfglLoader():
+    """
+    OfglLoader loads the regions, departements, communes and interco data from the OFGL datasets.
+    The four extracts are downloaded & processed concurrently, then concatenated once.
+    The processed data is cached as a typed Parquet file, rebuilt when the OFGL URLs, dtypes or the EPCI mapping file change.
+    The EPCI mapping (read from an Excel file) is cached the same way.
+    """
     def __init__(self,config):
-        # Load data from OFGL dataset if it was already processed
-        data_folder = Path(get_project_base_path()) / config["processed_data"]["path"]
-        data_file = data_folder / config["processed_data"]["filename"]
-        if data_file.exists():
-            self.data = pd.read_csv(data_file, sep=";")
-        else:
-            base_path = get_project_base_path()
-
+        # Load data from OFGL dataset if it was already processed (with the same sources)
+        base_path = get_project_base_path()
+        data_folder = Path(base_path) / config["processed_data"]["path"]
+        epci_communes_path = base_path / config["epci"]["file"]
+        cache = ParquetCache(data_folder / config["processed_data"]["filename"], {
+            "url": config["url"],
+            "dtype": config["dtype"],
+            "epci": ParquetCache.file_source(epci_communes_path),
+        })
+        self.data = cache.load()
+        if self.data is None:
             # Load the mapping between EPCI and communes, downloaded from the OFGL website
-            epci_communes_path = base_path / config["epci"]["file"]
-            epci_communes_mapping = pd.read_excel(epci_communes_path, dtype=config["epci"]["dtype"])
-            infos_coll = pd.DataFrame()
-
-            # Loop over the different collectivities type (regions, departements, communes, interco)
-            for key, url in config["url"].items():
-                # Download the data from the OFGL website
-                df_loader = BaseLoader.loader_factory(url, dtype=config["dtype"])
-                df = df_loader.load()
-                # Process the data: keep only the relevant columns and rename them
-                if key == 'communes':
-                    df = self.process_data(df, key, epci_communes_mapping)
-                else:
-                    df = self.process_data(df, key)
+            epci_communes_mapping = self._load_epci_communes_mapping(config["epci"])
 
-                # Concatenate the dataframes
-                infos_coll = pd.concat([infos_coll, df], axis=0, ignore_index=True)
+            # Download & process the different collectivities types (regions, departements, communes, interco) concurrently
+            # executor.map yields the results in the config order, they are concatenated once
+            max_workers = config.get("max_workers", len(config["url"]))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                dfs = list(executor.map(
+                    lambda item: self._load_collectivities(item[0], item[1], config["dtype"], epci_communes_mapping),
+                    config["url"].items(),
+                ))
+            infos_coll = pd.concat(dfs, axis=0, ignore_index=True)
 
             # Fill NaN values with np.nan
             infos_coll.fillna(np.nan, inplace=True)
-            # Save the processed data to the instance & a CSV file
-            self.data = infos_coll
-            self.save(Path(config["processed_data"]["path"]),config["processed_data"]["filename"])
+            # Normalize the column names & type the siren column (missing sirens are set to 0)
+            infos_coll.columns = normalize_column_names(infos_coll.columns)
+            infos_coll["siren"] = pd.to_numeric(infos_coll["siren"], errors="coerce").fillna(0).astype(int)
+            # Save the processed data to the instance & the cache
+            self.data = cache.save(infos_coll)
     
     def get(self):
         return self.data
-    
-    def save(self,path,filename):
-        save_csv(self.data,path,filename, sep=";", index=True)
+
+    # Internal function to download the data of a collectivities type from the OFGL website and process it (run in a worker thread)
+    def _load_collectivities(self, key, url, dtype, epci_communes_mapping):
+        df_loader = BaseLoader.loader_factory(url, dtype=dtype)
+        df = df_loader.load()
+        # Process the data: keep only the relevant columns and rename them
+        if key == 'communes':
+            return self.process_data(df, key, epci_communes_mapping)
+        return self.process_data(df, key)
+
+    # Internal function to load the mapping between EPCI and communes, from its Parquet cache or from the Excel file
+    def _load_epci_communes_mapping(self, epci_config):
+        base_path = get_project_base_path()
+        epci_communes_path = base_path / epci_config["file"]
+        cache = ParquetCache(
+            Path(base_path) / epci_config["processed_data_folder"] / "epci_communes_mapping.parquet",
+            {"file": ParquetCache.file_source(epci_communes_path), "dtype": epci_config["dtype"]},
+        )
+        epci_communes_mapping = cache.load()
+        if epci_communes_mapping is None:
+            epci_communes_mapping = cache.save(pd.read_excel(epci_communes_path, dtype=epci_config["dtype"]))
+        return epci_communes_mapping
 
     def process_data(self, df, key, epci_communes_mapping=None):
         # Process the data: keep only the relevant columns and rename them
@@ -1,20 +1,85 @@
+import json
+import logging
+import os
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
 from scripts.utils.config import get_project_base_path
+from scripts.utils.parquet_cache import ParquetCache
 
 class SireneLoader():
     """
     SireneLoader loads data from the Sirene dataset, 2023.
     Needed to download the dataset from the INSEE website.
     This dataset lists the companies and their characteristics in France.
-    
+
+    Only the SIRENs given to the loader are needed: the Sirene stock is scanned by chunks, keeping only these SIRENs,
+    and the result is written to a compact extract (sorted SIREN array & effectifs tranches, .npy) memory-mapped by later runs.
+    The extract is rebuilt when the Sirene file changes, or when SIRENs it does not cover are requested.
+
     TODO : Refactor using loaders_factory?
     """
-    def __init__(self,config):
+    def __init__(self, config, sirens):
+        self.logger = logging.getLogger(__name__)
         base_path = get_project_base_path()
         data_folder = Path(base_path / config["path"])
-        self.data = pd.read_csv( data_folder / config["filename"], usecols=config["columns"])
-    
+        self.source_file = data_folder / config["filename"]
+        self.extract_file = data_folder / config.get("extract_filename", "processed_data/sirene_extract.npy")
+        self.metadata_file = self.extract_file.with_suffix(".json")
+        self.columns = config["columns"]
+        self.chunksize = config.get("chunksize", 1000000)
+
+        sirens = np.unique(pd.to_numeric(pd.Series(sirens), errors="coerce").dropna().astype(np.int64))
+        extract = self._load_extract()
+        if extract is None or not np.isin(sirens, extract["siren"]).all():
+            # Scan the SIRENs already covered too, so that the extract only grows
+            covered_sirens = sirens if extract is None else np.union1d(sirens, extract["siren"])
+            extract = self._build_extract(covered_sirens)
+
+        # Lookup of the requested SIRENs in the sorted extract
+        siren_column, tranche_column = self.columns
+        positions = np.searchsorted(extract["siren"], sirens)
+        self.data = pd.DataFrame({siren_column: sirens, tranche_column: extract["tranche"][positions]})
+
     def get(self):
         return self.data
+
+    # Internal function to memory-map the extract, returns None if there is no extract of the current Sirene file
+    def _load_extract(self):
+        if not (self.extract_file.exists() and self.metadata_file.exists()):
+            return None
+        with open(self.metadata_file, "r") as f:
+            metadata = json.load(f)
+        if metadata.get("source") != ParquetCache.file_source(self.source_file) or metadata.get("columns") != self.columns:
+            self.logger.info(f"Le fichier Sirene a changé, l'extrait sera reconstruit : {self.extract_file}")
+            return None
+        return np.load(self.extract_file, mmap_mode="r")
+
+    # Internal function to scan the Sirene file by chunks, keeping only the given SIRENs (sorted), and to save the extract
+    # The SIRENs absent from the Sirene file are kept in the extract, with a NaN tranche, so that they are not scanned again
+    def _build_extract(self, sirens):
+        self.logger.info(f"Extraction de {len(sirens)} SIREN du fichier Sirene : {self.source_file}")
+        siren_column, tranche_column = self.columns
+        kept_chunks = []
+        with pd.read_csv(self.source_file, usecols=self.columns, dtype={tranche_column: str}, chunksize=self.chunksize) as reader:
+            for chunk in reader:
+                chunk_sirens = pd.to_numeric(chunk[siren_column], errors="coerce")
+                is_kept = chunk_sirens.isin(sirens)
+                kept_chunks.append(pd.DataFrame({
+                    "siren": chunk_sirens[is_kept].astype(np.int64),
+                    "tranche": pd.to_numeric(chunk.loc[is_kept, tranche_column], errors="coerce"),
+                }))
+        found = pd.concat(kept_chunks, ignore_index=True).drop_duplicates(subset="siren").set_index("siren")["tranche"]
+
+        extract = np.empty(len(sirens), dtype=[("siren", np.int64), ("tranche", np.float64)])
+        extract["siren"] = sirens
+        extract["tranche"] = found.reindex(sirens).values
+        self.extract_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.extract_file.with_suffix(".tmp.npy")
+        np.save(tmp_file, extract)
+        os.replace(tmp_file, self.extract_file)
+        with open(self.metadata_file, "w") as f:
+            json.dump({"source": ParquetCache.file_source(self.source_file), "columns": self.columns}, f)
+        self.logger.info(f"Extrait Sirene enregistré : {self.extract_file} ({len(found)} SIREN trouvés sur {len(sirens)})")
+        return extract
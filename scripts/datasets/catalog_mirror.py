@@ -0,0 +1,97 @@
+import logging
+import time
+from pathlib import Path
+
+import pandas as pd
+import requests
+
+from scripts.loaders.csv_loader import CSVLoader
+from scripts.loaders.session_manager import SessionManager
+from scripts.utils.config import get_project_base_path
+from scripts.utils.parquet_cache import ParquetCache
+
+class CatalogMirror:
+    '''
+    Local mirror of the data.gouv.fr catalogs (datasets & datafiles), one Parquet file per catalog.
+    Rows are sorted by organization_id and written in small row groups: loading the rows of some organizations
+    only reads the row groups whose statistics may contain them, instead of parsing the national catalog.
+    A catalog is downloaded again (bypassing the HTTP cache) only when the upstream file changes (ETag, Last-Modified & size, checked with a HEAD request).
+    '''
+
+    catalog_chunksize = 100000 # Number of catalog rows parsed at once when the mirror is refreshed
+    row_group_size = 20000
+    validator_headers = ("ETag", "Last-Modified", "Content-Length")
+
+    def __init__(self, datagouv_config):
+        self.logger = logging.getLogger(__name__)
+        self.datagouv_config = datagouv_config
+        self.mirror_folder = Path(get_project_base_path()) / datagouv_config.get("mirror_path", "data/cache/datagouv_catalogs")
+
+    # Function to load the rows of the organizations from a catalog ('datasets' or 'datafiles'), in the order of the upstream file
+    def load(self, catalog, organization_ids):
+        catalog_config = self.datagouv_config[catalog]
+        organization_ids = list(organization_ids)
+        if not organization_ids:
+            # No organization in scope (pyarrow rejects an empty 'in' filter): empty catalog, with its columns
+            columns = ["organization_id" if col == "dataset.organization_id" else col for col in catalog_config.get("columns") or []]
+            return pd.DataFrame(columns=columns)
+
+        mirror_file = self.mirror_folder / f"{catalog}.parquet"
+        stored_source = ParquetCache(mirror_file, None).stored_source()
+        validators = self._get_upstream_validators(catalog_config["url"], stored_source)
+        catalog_df = ParquetCache(mirror_file, self._get_source(catalog_config, validators)).load(filters=[("organization_id", "in", organization_ids)])
+        if catalog_df is None:
+            self.logger.info(f"Mise à jour du miroir local du catalogue {catalog}")
+            catalog_df, validators = self._download(catalog_config)
+            # The mirror records the validators of the downloaded body, so that it is refreshed again when this body changes
+            cache = ParquetCache(mirror_file, self._get_source(catalog_config, validators))
+            catalog_df = cache.save(catalog_df, row_group_size=self.row_group_size)
+            catalog_df = catalog_df[catalog_df["organization_id"].isin(organization_ids)]
+        return catalog_df.sort_values("catalog_row").drop(columns=["catalog_row"]).reset_index(drop=True)
+
+    # Internal function to describe the source of a catalog mirror: its URL, its columns & the validators of the upstream file
+    @staticmethod
+    def _get_source(catalog_config, validators):
+        return {"url": catalog_config["url"], "columns": catalog_config.get("columns"), "validators": validators}
+
+    # Internal function to get the validators of the upstream file
+    # If the upstream file cannot be checked, the mirror (if any) is kept as is. Without any validator, the mirror is refreshed at each run
+    def _get_upstream_validators(self, url, stored_source):
+        try:
+            response = SessionManager.get_session(url).head(url, allow_redirects=True, timeout=10)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            if stored_source is not None:
+                self.logger.warning(f"Impossible de vérifier le catalogue {url} ({e}), le miroir local est utilisé")
+                return stored_source["validators"]
+            return {"checked_at": time.time()}
+        return self._read_validators(response)
+
+    def _read_validators(self, response):
+        validators = {key: response.headers[key] for key in self.validator_headers if key in response.headers}
+        return validators or {"checked_at": time.time()}
+
+    # Internal function to download a catalog chunk by chunk, keeping the configured columns, sorted by organization
+    # The catalog is requested directly, not through the HTTP cache (whose TTL could serve a body older than the upstream validators)
+    # Returns the catalog and the validators of the downloaded body
+    def _download(self, catalog_config):
+        response = SessionManager.get(catalog_config["url"], stream=True, timeout=60)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+        validators = self._read_validators(response)
+
+        columns = catalog_config.get("columns")
+        catalog_loader = CSVLoader(catalog_config["url"], columns_to_keep=columns, chunksize=self.catalog_chunksize, response=response)
+        chunks = []
+        row_offset = 0
+        for chunk in catalog_loader.load():
+            chunk = chunk.rename(columns={"dataset.organization_id": "organization_id"})
+            chunk["catalog_row"] = range(row_offset, row_offset + len(chunk))
+            row_offset += len(chunk)
+            chunks.append(chunk[chunk["organization_id"].notna()])
+        catalog_df = pd.concat(chunks, ignore_index=True)
+        catalog_df["organization_id"] = catalog_df["organization_id"].astype(str)
+        return catalog_df.sort_values(["organization_id", "catalog_row"]).reset_index(drop=True), validators
@@ -6,8 +6,8 @@ import logging
 import unidecode
 
 from scripts.communities.communities_selector import CommunitiesSelector
-from scripts.utils.json_operation import flatten_json_schema, flatten_data
-from scripts.utils.dataframe_operation import cast_data
+from scripts.utils.json_operation import flatten_json_schema, iter_flattened_chunks, SchemaFlattener
+from scripts.utils.dataframe_operation import cast_data, join_columns
 from scripts.loaders.base_loader import BaseLoader
 from scripts.loaders.json_loader import JSONLoader
 
@@ -24,18 +24,15 @@ class DatafileLoader():
 
         # Load topic schema from URL
         self.schema = self._load_schema(topic_config["schema"])
-        # Load data from URL
-        self.loaded_data, self.modifications_data = self._load_data(topic_config) # TODO : modifications_data seems empty & useless
-        # Clean data by keeping only columns present in the schema
-        self.cleaned_data = self._clean_data()
-        # Select data based on communities IDs
         self.communities_scope = communities_selector
         self.communities_ids = self.communities_scope.get_selected_ids()
-        self.selected_data = self._select_data()
+        # Load data from URL by batches: each batch is cleaned (only columns present in the schema)
+        # and selected (based on communities IDs) before the next one is parsed, so the full dataset is never held in memory
+        self.selected_data, self.modifications_data = self._load_data(topic_config) # TODO : modifications_data seems empty & useless
         # Remove secondary columns from the selected data (modifications columns, titulaires2+ columns, too many columns for POC)
         self.primary_data = self._remove_secondary_columns()
         # Drop duplicates and cast data to schema types
-        self.normalized_data = self._normalize_data()
+        self.normalized_data, self.coercion_report = self._normalize_data()
 
     # Internal function to load JSON schema from URL
     def _load_schema(self, schema_topic_config):
@@ -51,31 +48,40 @@ class DatafileLoader():
         schema_df['type'].fillna('string', inplace=True)
         return schema_df
     
-    # Load data from URL and flatten it to DataFrame
+    # Load data from URL, streaming the items of the root array, then flatten, clean and select them by batches
     def _load_data(self, topic_config):
-        # Load data from URL
-        data_loader = JSONLoader(topic_config["unified_dataset"]["url"])
-        data = data_loader.load()
-        # Flatten JSON data to DataFrame, with main and modifications data (potentially empty)
-        root = topic_config["unified_dataset"]["root"]
-        main_df, modifications_df = flatten_data(data[root])
-        self.logger.info(f"Le fichier au format JSON a été téléchargé avec succès à l'URL : {topic_config['unified_dataset']['url']}")
-        return main_df, modifications_df
+        unified_dataset_config = topic_config["unified_dataset"]
+        data_loader = JSONLoader(unified_dataset_config["url"], key=unified_dataset_config["root"], stream=True)
+        items = data_loader.load()
+        # Flattener compiled once from the schema: only the schema columns are built
+        flattener = SchemaFlattener(self.schema.to_dict("records"))
+        selected_batches = []
+        for loaded_batch in iter_flattened_chunks(items, unified_dataset_config.get("batch_size", 10000), flattener):
+            cleaned_batch = self._clean_data(loaded_batch)
+            selected_batches.append(self._select_data(cleaned_batch))
+        if not selected_batches:
+            # No item in the stream: empty selection, with the columns of a selected batch
+            self.logger.warning(f"Aucune donnée dans le fichier JSON à l'URL : {unified_dataset_config['url']}")
+            selected_batches.append(self._select_data(pd.DataFrame()))
+        self.logger.info(f"Le fichier au format JSON a été téléchargé avec succès à l'URL : {unified_dataset_config['url']}")
+        # Main data and modifications data (empty, modifications are not flattened separately)
+        return pd.concat(selected_batches, ignore_index=True), pd.DataFrame()
     
-    def _clean_data(self):
+    # Internal function to clean a batch of loaded data
+    def _clean_data(self, loaded_data):
         # Build a mapping of original column names to cleaned column names
         original_to_cleaned_names = {
-            col: self.clean_column_name_for_comparison(col) for col in self.loaded_data.columns
+            col: self.clean_column_name_for_comparison(col) for col in loaded_data.columns
         }
         # Get the set of cleaned column names from the schema
         schema_columns = set(self.schema['property'])
-        # Find columns to keep depending on the schema
-        columns_to_keep = set()
+        # Find columns to keep depending on the schema, in the loaded data order (batches must give the same columns order)
+        columns_to_keep = []
         for original_name, cleaned_name in original_to_cleaned_names.items():
             if cleaned_name in schema_columns:
-                columns_to_keep.add(original_name)
+                columns_to_keep.append(original_name)
         # Keep only the columns that are in the schema
-        cleaned_data = self.loaded_data.filter(columns_to_keep)
+        cleaned_data = loaded_data.filter(columns_to_keep)
 
         self.logger.info(f"Nettoyage des colonnes terminé, {len(columns_to_keep)} colonnes conservées.")
 
@@ -85,10 +91,12 @@ class DatafileLoader():
         nature_values = self._get_schema_values('nature', 'enum')
         type_pattern = self._get_schema_value('_type', 'pattern')
         
+        # A batch may not contain all the columns: missing ones are considered empty
+        empty_col = pd.Series(index=cleaned_data.index, dtype=object)
         cleaned_data = cleaned_data[
-            cleaned_data['procedure'].apply(self._matches_values, args=(procedure_values,)) |
-            cleaned_data['nature'].apply(self._matches_values, args=(nature_values,)) |
-            cleaned_data['_type'].str.match(type_pattern)
+            self._matches_values_mask(cleaned_data.get('procedure', empty_col), procedure_values) |
+            self._matches_values_mask(cleaned_data.get('nature', empty_col), nature_values) |
+            cleaned_data.get('_type', empty_col).str.match(type_pattern, na=False)
         ]
 
         return cleaned_data
@@ -117,13 +125,19 @@ class DatafileLoader():
             return False
         cleaned_value = self._clean_value(value)
         return cleaned_value in values
+
+    # Internal function to check which values of a column match a list of values: each distinct value is cleaned & checked once
+    def _matches_values_mask(self, col, values):
+        matching_values = [value for value in col.dropna().unique() if self._matches_values(value, values)]
+        return col.isin(matching_values)
     
-    # Internal function to select data based on communities IDs
-    def _select_data(self):
-        cleaned_data = self.cleaned_data.copy()
+    # Internal function to select a batch of cleaned data based on communities IDs
+    def _select_data(self, cleaned_data):
+        cleaned_data = cleaned_data.copy()
         communities_data = self.communities_ids.copy()
-        # Add 'siren' column to cleaned_data
-        cleaned_data['siren'] = cleaned_data['acheteur.id'].str[:9].astype(str)
+        # Add 'siren' column to cleaned_data (a batch may have no 'acheteur.id' column, or only missing values)
+        empty_col = pd.Series(index=cleaned_data.index, dtype=object)
+        cleaned_data['siren'] = cleaned_data.get('acheteur.id', empty_col).astype('string').str[:9].astype(str)
         communities_data['siren'] = communities_data['siren'].astype(str)
         # Merge cleaned_data with communities_data on 'siren' column, filtering out rows with NaN values
         selected_data = pd.merge(cleaned_data, communities_data, on='siren', how='left', validate="many_to_one")
@@ -140,7 +154,7 @@ class DatafileLoader():
         # Select columns with 'titulaires.' and 'denominationSociale' in their names
         titulaires_cols = primary_data.filter(regex=r'^titulaires\.\d+\.denominationSociale')
         # Concatenate 'titulaires.*.denominationSociale' columns into a single 'titulaires' column
-        primary_data['titulaires'] = titulaires_cols.apply(lambda row: ', '.join(row.dropna().astype(str).replace(r"[\[\]']", "")), axis=1)
+        primary_data['titulaires'] = join_columns([titulaires_cols[col] for col in titulaires_cols.columns], ', ', index=primary_data.index)
         # Drop 'titulaires.*.denominationSociale' columns
         primary_data = primary_data.drop(columns=titulaires_cols.columns)
 
@@ -148,12 +162,17 @@ class DatafileLoader():
     
     # Internal function to normalize data
     def _normalize_data(self):
+        # Lists (e.g. considerationsSociales) are joined as strings: only the list cells of object columns are converted
+        normalized_data = self.primary_data.copy()
+        for col in normalized_data.columns[normalized_data.dtypes == object]:
+            is_list = normalized_data[col].map(type, na_action='ignore') == list
+            if is_list.any():
+                normalized_data.loc[is_list, col] = normalized_data.loc[is_list, col].map(lambda x: ','.join(map(str, x)))
         # Drop cleaned_data duplicates
-        normalized_data = self.primary_data.applymap(lambda x: ','.join(map(str, x)) if isinstance(x, list) else x)
         normalized_data = normalized_data.drop_duplicates()
 
         # Cast data to schema types
         schema_selected = self.schema.loc[:, ['property', 'type']]        
-        normalized_data = cast_data(normalized_data, schema_selected, "property", clean_column_name_for_comparison=self.clean_column_name_for_comparison)
-        return normalized_data
+        normalized_data, coercion_report = cast_data(normalized_data, schema_selected, "property", clean_column_name_for_comparison=self.clean_column_name_for_comparison)
+        return normalized_data, coercion_report
     
@@ -2,9 +2,11 @@ import collections
 import logging
 import pandas as pd
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 from scripts.utils.config import get_project_base_path
 
+from scripts.loaders.archive_loader import ArchiveLoader
 from scripts.loaders.csv_loader import CSVLoader
 from scripts.loaders.excel_loader import ExcelLoader
 from scripts.loaders.json_loader import JSONLoader
@@ -14,11 +16,16 @@ from scripts.utils.dataframe_operation import merge_duplicate_columns, safe_rena
 class DatafilesLoader():
     '''
     This class is responsible for loading the datafiles from the files_in_scope dataframe.
-    It loads the schema of the topic, filters the readable files, loads the datafiles into dataframes, and normalizes the data according to the schema.
-    TODO: Everything is done in the __init__ method, it should be refactored to be more readable and maintainable (or using external libraries).
+    It loads the schema of the topic, then runs in two steps (checkpointed separately by the WorkflowManager):
+    download() filters the readable files and loads the datafiles into dataframes,
+    normalize() normalizes the loaded data according to the schema.
+    The output of download() (get_downloaded_data) is checkpointed, from_downloaded_data() builds the loader normalizing it.
     '''
-    def __init__(self,files_in_scope, topic, topic_config, datafile_loader_config):
+    def __init__(self,files_in_scope, topic, topic_config, datafile_loader_config, schema=None):
         self.logger = logging.getLogger(__name__)
+        self.topic = topic
+        self.topic_config = topic_config
+        self.datafile_loader_config = datafile_loader_config
 
         self.loader_classes = {
             'csv': CSVLoader,
@@ -26,19 +33,47 @@ class DatafilesLoader():
             'xlsx': ExcelLoader,
             'excel': ExcelLoader,
             'json': JSONLoader,
+            'zip': ArchiveLoader,
+            'gz': ArchiveLoader,
+            'csv.gz': ArchiveLoader,
+            'bz2': ArchiveLoader,
         }
 
         # Load filtered datafiles list to explore 
         self.files_in_scope = files_in_scope
-        # Load normalized data output schema
-        self.schema = self._load_schema(topic_config["schema"])
-        # Separate readable and unreadable files based on their format
+        # Load normalized data output schema (unless already loaded, e.g. by the download of a previous run)
+        self.schema = schema if schema is not None else self._load_schema(topic_config["schema"])
         self.datafiles_out = pd.DataFrame()
+
+    # Function to download the readable datafiles into the corpus of dataframes
+    def download(self):
+        # Separate readable and unreadable files based on their format
         readable_files, self.datafiles_out = self._keep_readable_datafiles()
         # Load the readable files into dataframes
-        self.corpus = self._load_datafiles(readable_files, datafile_loader_config)
-        # Normalize the loaded data according to the defined schema
-        self.normalized_data, self.datacolumns_out = self._normalize_data(topic, topic_config, datafile_loader_config)
+        self.corpus = self._load_datafiles(readable_files, self.datafile_loader_config)
+        return self
+
+    # Function to get the downloaded data: the schema, the corpus and the files out (output of the download stage)
+    def get_downloaded_data(self):
+        return {"schema": self.schema, "corpus": self.corpus, "datafiles_out": self.datafiles_out}
+
+    # Function to build a loader from downloaded data (output of get_downloaded_data), ready to be normalized
+    @classmethod
+    def from_downloaded_data(cls, downloaded_data, topic, topic_config, datafile_loader_config):
+        datafiles_loader = cls(None, topic, topic_config, datafile_loader_config, schema=downloaded_data["schema"])
+        datafiles_loader.corpus = downloaded_data["corpus"]
+        datafiles_loader.datafiles_out = downloaded_data["datafiles_out"]
+        return datafiles_loader
+
+    # Function to get the schema dictionary file of a topic (original column names -> schema names)
+    @staticmethod
+    def get_schema_dict_file(topic, topic_config):
+        return Path(get_project_base_path()) / "data" / "datasets" / topic / "inputs" / topic_config["schema_dict_file"]
+
+    # Function to normalize the downloaded corpus according to the defined schema
+    def normalize(self):
+        self.normalized_data, self.datacolumns_out, self.coercion_report = self._normalize_data(self.topic, self.topic_config, self.datafile_loader_config)
+        return self
 
     # Internal function to load the offical schema of the topic normalized data
     def _load_schema(self, schema_topic_config):
@@ -49,7 +84,7 @@ class DatafilesLoader():
 
     # Internal function to keep only the readable files
     def _keep_readable_datafiles(self):
-        preferred_formats = ["csv", "xls", "xlsx", "json", "zip"]     # TODO: Preferred formats should be defined in the config
+        preferred_formats = ["csv", "xls", "xlsx", "json", "zip", "gz", "csv.gz", "bz2"]     # TODO: Preferred formats should be defined in the config
 
         readable_files = self.files_in_scope[self.files_in_scope["format"].isin(preferred_formats)]
         datafiles_out = self.files_in_scope[~self.files_in_scope["format"].isin(preferred_formats)]
@@ -57,13 +92,14 @@ class DatafilesLoader():
         return readable_files, datafiles_out
 
     # Internal function to load the data from a single file, depending on its format
+    # Returns None if the file could not be loaded: datafiles_out bookkeeping is done by the caller, in files order
     def _load_file_data(self, file_info, datafile_loader_config):
         loader_class = self.loader_classes.get(file_info["format"].lower())
         if loader_class:
             loader = loader_class(file_info["url"])
             try:
                 df = loader.load()
-                if not df.empty:
+                if df is not None and not df.empty:
                     for col in datafile_loader_config["file_info_columns"]:
                         if col in file_info:
                             df[col] = file_info[col]
@@ -73,21 +109,29 @@ class DatafilesLoader():
                 self.logger.error(f"Failed to load data from {file_info['url']} - {e}")
         else:
             self.logger.warning(f"Loader not found for format {file_info['format']}")
-        
-        # Add the file to the list of files that could not be loaded
-        file_info_df = pd.DataFrame(file_info).transpose()
-        self.datafiles_out = pd.concat([self.datafiles_out, file_info_df], ignore_index=True)
         return None
 
     # Internal function to load the datafiles into a dataframes list
+    # Files are downloaded concurrently (bounded by max_workers), results are collected in the readable_files order
     def _load_datafiles(self, readable_files, datafile_loader_config):
         len_out = len(self.datafiles_out)
+        max_workers = datafile_loader_config.get("max_workers", 1)
+        files_info = [file_info for _, file_info in readable_files.iterrows()]
         data = []
+        files_out = []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # executor.map yields the results in submission order, whatever the completion order
+            results = executor.map(lambda file_info: self._load_file_data(file_info, datafile_loader_config), files_info)
+            for file_info, df in zip(files_info, results):
+                if df is not None:
+                    data.append(df)
+                else:
+                    # Add the file to the list of files that could not be loaded
+                    files_out.append(pd.DataFrame(file_info).transpose())
 
-        for i, file_info in readable_files.iterrows():
-            df = self._load_file_data(file_info, datafile_loader_config)
-            if df is not None:
-                data.append(df)
+        if files_out:
+            self.datafiles_out = pd.concat([self.datafiles_out, *files_out], ignore_index=True)
 
         self.logger.info("Number of dataframes loaded: %s", len(data))
         self.logger.info("Number of elements in data that are not dataframes: %s", sum([not isinstance(df, pd.DataFrame) for df in data]))
@@ -111,51 +155,57 @@ class DatafilesLoader():
         schema_mapping = dict(zip(schema_lower, self.schema["name"].values))
 
         # Load the schema dictionary to rename the columns
-        schema_dict_file = Path(get_project_base_path())  / "data" / "datasets" / topic / "inputs" / topic_config["schema_dict_file"]
+        schema_dict_file = self.get_schema_dict_file(topic, topic_config)
         schema_dict = pd.read_csv(schema_dict_file, sep=";").set_index('original_name')['official_name'].to_dict()
         
-        # Initialize the output dataframe for columns not in the schema
-        datacolumns_out = pd.DataFrame(columns=["filename", "column_name", "column_type", "nb_non_null_values"])
+        # Column plans, cached by file header: files of a same publisher often share their header
+        column_plans = {}
+        normalized_frames = [] # Normalized dataframes, concatenated once
+        datacolumns_out_records = [] # Columns not in the schema, one record per column
+        files_out = [] # Files without any column in common with the schema
+        nb_datapoints = 0
 
         for df in self.corpus:
             # Merge columns with the same name
             df = merge_duplicate_columns(df)
+            header = tuple(df.columns)
+            if header not in column_plans:
+                column_plans[header] = self._get_column_plan(header, schema_dict, schema_lower, schema_mapping, file_info_columns)
+            column_plan = column_plans[header]
             # Rename columns using the schema dictionary
-            safe_rename(df, schema_dict)
-            # Lower case columns names
-            df.columns = df.columns.astype(str)
-            columns_lower = [col.lower() for col in df.columns]
+            df.columns = column_plan["renamed_columns"]
             # Check if the dataframe has at least 1 column in common with the schema
-            if len(set(columns_lower).intersection(set(schema_lower))) > 0:
-                common_columns = [] # Initialize the list of common columns with the schema
-                for col, col_lower in zip(df.columns, columns_lower):
-                    if col_lower in schema_lower or col in file_info_columns:
-                        common_columns.append(col)
-                    else:
-                        # Add the column to the output dataframe for columns not in the schema
-                        out_col_df = pd.DataFrame({"filename":df["url"].iloc[0], "column_name":col, "column_type":df[col].dtype, "nb_non_null_values":df[col].count()}, index=[0])
-                        datacolumns_out = pd.concat([datacolumns_out, out_col_df], ignore_index=True)
-                
-                # Filter the dataframe to keep only the common columns with the schema
-                df_filtered = df[common_columns]
-                # Rename the columns in df_filtered using the schema_mapping
-                df_filtered.columns = [schema_mapping[col.lower()] if col.lower() in schema_mapping else col for col in df_filtered.columns]
-                # Append df_filtered to normalized_data
-                normalized_data = pd.concat([normalized_data, df_filtered], ignore_index=True)
+            if column_plan["has_schema_columns"]:
+                for col in column_plan["out_of_schema_columns"]:
+                    # Add the column to the output records for columns not in the schema
+                    datacolumns_out_records.append({"filename":df["url"].iloc[0], "column_name":col, "column_type":df[col].dtype, "nb_non_null_values":df[col].count()})
+
+                # Filter the dataframe to keep only the common columns with the schema, renamed using the schema_mapping
+                df_filtered = df[column_plan["common_columns"]]
+                df_filtered.columns = column_plan["normalized_columns"]
+                normalized_frames.append(df_filtered)
+                nb_datapoints += len(df_filtered)
 
                 self.logger.info("Normalized dataframe %s", df["url"].iloc[0])
-                self.logger.info("Number of datapoints in normalized_data: %s", len(normalized_data))
-                self.logger.info("Number of columns in schema: %s", len(common_columns) - len(file_info_columns))
-                self.logger.info("Number of columns not in schema: %s", len(df.columns)-len(common_columns) + len(file_info_columns))
+                self.logger.info("Number of datapoints in normalized_data: %s", nb_datapoints)
+                self.logger.info("Number of columns in schema: %s", len(column_plan["common_columns"]) - len(file_info_columns))
+                self.logger.info("Number of columns not in schema: %s", len(df.columns)-len(column_plan["common_columns"]) + len(file_info_columns))
             # If the dataframe has no column in common with the schema, add the dataframe to the output dataframe for files not in final data
             else:
-                out_df = pd.DataFrame(df.iloc[0]).transpose()
-                self.datafiles_out = pd.concat([self.datafiles_out, out_df], ignore_index=True)
+                files_out.append(pd.DataFrame(df.iloc[0]).transpose())
                 self.logger.warning("No column in common with schema for file %s", df["url"].iloc[0])
-        
+        self.logger.info("Number of distinct column plans: %s", len(column_plans))
+        if files_out:
+            self.datafiles_out = pd.concat([self.datafiles_out, *files_out], ignore_index=True)
+
+        # Append the normalized dataframes to the schema columns at once
+        normalized_data = pd.concat([normalized_data, *normalized_frames], ignore_index=True)
+        # Output dataframe for columns not in the schema
+        datacolumns_out = pd.concat([pd.DataFrame(columns=["filename", "column_name", "column_type", "nb_non_null_values"]), pd.DataFrame(datacolumns_out_records)], ignore_index=True)
+
         # Cast data to schema types
         schema_selected = self.schema.loc[:, ['name', 'type']]        
-        normalized_data = cast_data(normalized_data, schema_selected, 'name')
+        normalized_data, coercion_report = cast_data(normalized_data, schema_selected, 'name')
 
         self.logger.info("Data types per column after casting in normalized data: %s", normalized_data.dtypes)
         self.logger.info("Percentage of NaN values after casting, per column: %s", (normalized_data.isna().sum() / len(normalized_data)) * 100)
@@ -171,4 +221,27 @@ class DatafilesLoader():
         self.logger.info("Number of columns in datacolumns_out: %s", len(datacolumns_out))
         self.logger.info("Number of NaN values in normalized_data, per column: %s", normalized_data.isna().sum())
 
-        return normalized_data, datacolumns_out
\ No newline at end of file
+        return normalized_data, datacolumns_out, coercion_report
+
+    # Internal function to build the column plan of a file header: columns renamed with the schema dictionary,
+    # columns kept (in common with the schema, or file info columns) with their schema names, and columns not in the schema
+    def _get_column_plan(self, header, schema_dict, schema_lower, schema_mapping, file_info_columns):
+        header_df = pd.DataFrame(columns=list(header))
+        safe_rename(header_df, schema_dict)
+        renamed_columns = header_df.columns.astype(str)
+        columns_lower = [col.lower() for col in renamed_columns]
+
+        common_columns = []
+        out_of_schema_columns = []
+        for col, col_lower in zip(renamed_columns, columns_lower):
+            if col_lower in schema_lower or col in file_info_columns:
+                common_columns.append(col)
+            else:
+                out_of_schema_columns.append(col)
+        return {
+            "renamed_columns": renamed_columns,
+            "has_schema_columns": len(set(columns_lower).intersection(schema_lower)) > 0,
+            "common_columns": common_columns,
+            "normalized_columns": [schema_mapping[col.lower()] if col.lower() in schema_mapping else col for col in common_columns],
+            "out_of_schema_columns": out_of_schema_columns,
+        }
\ No newline at end of file
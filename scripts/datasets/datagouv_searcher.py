@@ -1,10 +1,14 @@
 import json
-import requests
 import pandas as pd
 import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor
 
 from scripts.communities.communities_selector import CommunitiesSelector
-from scripts.loaders.csv_loader import CSVLoader
+from scripts.datasets.catalog_mirror import CatalogMirror
+from scripts.loaders.rate_limiter import RateLimiter
+from scripts.loaders.session_manager import SessionManager
+from scripts.utils.keyword_matcher import KeywordMatcher
 
 
 class DataGouvSearcher():
@@ -12,47 +16,38 @@ class DataGouvSearcher():
     This class is responsible for searching datafiles on the data.gouv.fr API and datasets catalog.
     It initializes from a CommunitiesSelector object and a datagouv_config dictionary, to load the datasets and datafiles catalogs.
     It provides one public method get_datafiles(search_config, method) to build a list of datafiles based on title and description filters and column names filters.
+    The bottom up search crawls the datasets API of the organizations concurrently (datagouv_config["api"]: max_workers, page_size,
+    global & per host rate limits, retries), the results are gathered in the order of the organizations, as a sequential crawl would.
     '''
 
     def __init__(self, communities_selector, datagouv_config):
         self.logger = logging.getLogger(__name__)
 
         self.scope = communities_selector
+        self.api_config = datagouv_config.get("api", {})
+        self.rate_limiter = RateLimiter(self.api_config.get("requests_per_second"), self.api_config.get("requests_per_second_per_host"))
         self.datagouv_ids = self.scope.get_datagouv_ids() # dataframe with siren and id_datagouv columns
         self.datagouv_ids_list = self.datagouv_ids["id_datagouv"].to_list()
 
-        # Load datagouv datasets and datafiles catalogs
-        dataset_catalog_loader = CSVLoader(datagouv_config["datasets"]["url"], columns_to_keep=datagouv_config["datasets"]["columns"])
-        self.dataset_catalog_df = dataset_catalog_loader.load()
-        self.dataset_catalog_df = self._filter_by(self.dataset_catalog_df, "organization_id", self.datagouv_ids_list)
+        # Load the rows of the organizations in scope from the local mirror of the datagouv datasets and datafiles catalogs
+        catalog_mirror = CatalogMirror(datagouv_config)
+        self.dataset_catalog_df = catalog_mirror.load("datasets", self.datagouv_ids_list)
         # join siren to dataset_catalog_df based on organization_id
         self.dataset_catalog_df = self.dataset_catalog_df.merge(self.datagouv_ids, left_on="organization_id", right_on="id_datagouv", how="left")
         self.dataset_catalog_df.drop(columns=['id_datagouv'], inplace=True)
 
-        datafile_catalog_loader = CSVLoader(datagouv_config["datafiles"]["url"])
-        self.datafile_catalog_df = datafile_catalog_loader.load()
-        self.datafile_catalog_df.columns=list(map(lambda x: x.replace("dataset.organization_id","organization_id"), self.datafile_catalog_df.columns.to_list()))
-        self.datafile_catalog_df = self._filter_by(self.datafile_catalog_df, "organization_id", self.datagouv_ids_list)
+        self.datafile_catalog_df = catalog_mirror.load("datafiles", self.datagouv_ids_list)
         # join siren to datafile_catalog_df based on organization_id
         self.datafile_catalog_df = self.datafile_catalog_df.merge(self.datagouv_ids, left_on="organization_id", right_on="id_datagouv", how="left")
         self.datafile_catalog_df.drop(columns=['id_datagouv'], inplace=True)
-        
-    # Internal function to filter a dataframe by a column and one or multiple values
-    def _filter_by(self, df, column, value, return_mask=False):
-        # value can be a list of values or a string
-        if isinstance(value, str):
-            mask = df[column].str.contains(value, case=False, na=False)
-        else:
-            mask = df[column].isin(value)
-        return mask if return_mask else df[mask]
-    
-    # Internal function to filter a dataframe by a column and one or multiple values
+
+    # Internal function to get the datafiles of the datasets whose title or description matches the filters (regexes, accents & case ignored)
     def _get_datafiles_by_title_and_desc(self,title_filter,description_filter):
         # Get the datasets that match the title and description filters
-        mask_desc = self._filter_by(self.dataset_catalog_df, "description", description_filter, return_mask=True)
+        mask_desc = KeywordMatcher(description_filter).mask(self.dataset_catalog_df["description"])
         self.logger.info(f"Nombre de datasets correspondant au filtre de description : {mask_desc.sum()}")
 
-        mask_titles = self._filter_by(self.dataset_catalog_df, "title", title_filter, return_mask=True)
+        mask_titles = KeywordMatcher(title_filter).mask(self.dataset_catalog_df["title"])
         self.logger.info(f"Nombre de datasets correspondant au filtre de titre : {mask_titles.sum()}")
 
         # Merge the two masks and get the filtered datasets catalog
@@ -80,14 +75,15 @@ class DataGouvSearcher():
 
 
     # Internal function to create a list of dictionaries, one for each file with the specified filters of one organization
-    def _get_files_by_org_from_api(self,url,organization_id,title_filter,description_filter, column_filter):
-        params = {"organization": organization_id}
+    def _get_files_by_org_from_api(self,url,organization_id,title_matcher,description_matcher,column_matcher):
+        params = {"organization": organization_id, "page_size": self.api_config.get("page_size", 20)}
         scoped_files = []
         while True:
-            response = requests.get(url, params=params)
             try:
+                response = SessionManager.get_with_retries(url, rate_limiter=self.rate_limiter, max_retries=self.api_config.get("max_retries", 5), params=params)
                 response.raise_for_status()
-            except:
+            except requests.RequestException as e:
+                self.logger.warning(f"Error while requesting {url} for organization {organization_id} : {e}")
                 break
             try:
                 data = response.json()
@@ -98,26 +94,16 @@ class DataGouvSearcher():
             # Loop through the files list to filter them by title and description
             for result in data["data"]:
                 files = []
-                # Check if the title contains the title_filter words
-                if any(word in result["title"].lower() for word in title_filter):
-                    keyword_in_title = True
-                else:
-                    keyword_in_title = False
-
-                # Check if the description contains the description_filter words
-                if any(word in result["description"].lower() for word in description_filter):
-                    keyword_in_description = True
-                else:
-                    keyword_in_description = False
+                # Check if the title and the description contain the filter words
+                keyword_in_title = title_matcher.search(result["title"])
+                keyword_in_description = description_matcher.search(result["description"])
                 montant_col = None
                 # Loop through the resources list to filter them by column names
                 for resource in result["resources"]:
                     if resource["description"] is None:
                         montant_col = None
-                    elif any(word in resource["description"].lower() for word in column_filter):
-                        montant_col = True
                     else:
-                        montant_col = False
+                        montant_col = column_matcher.search(resource["description"])
 
                     # Add the file info to the files list if it matches the filters
                     files.append({"organization_id":result["organization"]["id"], "organization":result["organization"]["name"],"title":result["title"],"description":result["description"],"id":result["id"],"frequency":result["frequency"],"format":resource["format"],"url":resource["url"],"created_at":resource["created_at"],'montant_col':montant_col,"keyword_in_description":keyword_in_description,"keyword_in_title":keyword_in_title})
@@ -136,11 +122,16 @@ class DataGouvSearcher():
     # Internal function to get a list of dictionaries with the files that match the filters
     def _get_datafiles_by_content(self,url,title_filter,description_filter,column_filter):
         all_files = []
-
-        # Loop through the organizations to get a list of dictionaries with the files that match the filters
-        for orga in self.datagouv_ids_list:
-            cur_files = self._get_files_by_org_from_api(url,orga,title_filter,description_filter,column_filter)
-            all_files = all_files + cur_files
+        # Words matchers compiled once, shared by the crawling threads
+        title_matcher = KeywordMatcher(title_filter, regex=False)
+        description_matcher = KeywordMatcher(description_filter, regex=False)
+        column_matcher = KeywordMatcher(column_filter, regex=False)
+
+        # Crawl the organizations concurrently to get a list of dictionaries with the files that match the filters (map keeps the organizations order)
+        with ThreadPoolExecutor(max_workers=self.api_config.get("max_workers", 1)) as executor:
+            files_by_org = executor.map(lambda orga: self._get_files_by_org_from_api(url,orga,title_matcher,description_matcher,column_matcher), self.datagouv_ids_list)
+            for cur_files in files_by_org:
+                all_files.extend(cur_files)
 
         bottom_up_files_df = pd.DataFrame(all_files)
         # Join with siren based on organization
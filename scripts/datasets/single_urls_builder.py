@@ -15,9 +15,14 @@ class SingleUrlsBuilder():
         self.logger = logging.getLogger(__name__)
         self.scope = communities_selector
 
+    # Function to get the single_urls file of a topic config
+    @staticmethod
+    def get_source_file(search_config):
+        return Path(get_project_base_path()) / "data" / "datasets" / "subventions" / "inputs" / search_config["single_urls_file"]
+
     # Function to build list of dictionaries of datafiles
     def get_datafiles(self,search_config):
-        single_urls_source_file = Path(get_project_base_path()) / "data" / "datasets" / "subventions" / "inputs" / search_config["single_urls_file"]
+        single_urls_source_file = self.get_source_file(search_config)
         single_urls_files_in_scope = pd.read_csv(single_urls_source_file, sep=";")
         selected_data = self.scope.selected_data
         # Add 'nom' & 'type' columns to single_urls_files_in_scope from selected_data based on siren
@@ -0,0 +1,153 @@
+import bz2
+import gzip
+import itertools
+import shutil
+import tempfile
+import zipfile
+from pathlib import PurePosixPath
+from urllib.parse import urlparse
+
+import pandas as pd
+import requests
+
+from .base_loader import BaseLoader
+from .csv_loader import CSVLoader
+from .excel_loader import ExcelLoader
+from .json_loader import JSONLoader
+
+class ArchiveLoader(BaseLoader):
+    '''
+    Loader for compressed files: ZIP archives, gzip & bzip2 bodies (e.g. .csv.gz resources).
+    The archive is read from the body on disk, its members are decompressed as streams, one at a time:
+    the format of each member is sniffed from its first bytes, then the member is handed to the CSV, Excel or JSON loader.
+    CSV & JSON members are parsed directly from the decompressed stream (the items of a JSON array are streamed by batches),
+    Excel members and nested archives (which need random access) are first decompressed to a temporary file.
+    The rows are tagged with the name of their member.
+    With a chunksize, process_data returns an iterator of the chunks (CSV chunks, batches of JSON items) instead of a single DataFrame.
+    '''
+
+    member_column = "archive_member" # Column tagging the rows with the name of their member
+    json_batch_size = 100000 # Number of items of a JSON array member per DataFrame, without chunksize
+
+    def __init__(self, file_url, dtype=None, columns_to_keep=None, chunksize=None, **kwargs):
+        super().__init__(file_url, **kwargs)
+        self.dtype = dtype
+        self.columns_to_keep = columns_to_keep
+        self.chunksize = chunksize
+
+    def process_data(self, response):
+        if self.chunksize is not None:
+            return self._iter_members_data(response)
+
+        dfs = [df for df in self._iter_members_data(response) if df is not None and not df.empty]
+        if not dfs:
+            self.logger.warning(f"Aucun fichier lisible dans l'archive à l'URL : {self.file_url}")
+            return None
+        self.logger.info(f"Archive Data from {self.file_url} loaded ({len(dfs)} files).")
+        return pd.concat(dfs, ignore_index=True)
+
+    # Internal generator yielding the data of each member (or each chunk of the members), tagged with the member name
+    # The archive (and the response body) is kept open until the last member
+    def _iter_members_data(self, response):
+        for name, stream in self._iter_members(self.get_body_file(response), self._get_file_name()):
+            try:
+                for df in self._iter_member_data(name, stream):
+                    # Rows of a nested archive are tagged with the path of their member, e.g. outer.zip/inner.csv
+                    df[self.member_column] = name + "/" + df[self.member_column] if self.member_column in df.columns else name
+                    yield df
+            except Exception as e:
+                self.logger.error(f"Failed to load data from {self.file_url}#{name} - {e}")
+
+    # Internal generator yielding the (name, stream) of the members of an archive, depending on its sniffed container format
+    # Each member stream is closed once the next member is requested
+    # A body which is not compressed (e.g. a CSV file published with the zip format) is its own single member
+    @staticmethod
+    def _iter_members(body_file, name):
+        container_format = BaseLoader.sniff_format(body_file.read(65536))
+        body_file.seek(0)
+        if container_format == "zip":
+            with zipfile.ZipFile(body_file) as archive:
+                for member in archive.infolist():
+                    if member.is_dir() or _is_hidden_member(member.filename):
+                        continue
+                    with archive.open(member) as stream:
+                        yield member.filename, stream
+        elif container_format == "gz":
+            with gzip.GzipFile(fileobj=body_file) as stream:
+                yield _strip_suffix(name, (".gz", ".gzip")), stream
+        elif container_format == "bz2":
+            with bz2.BZ2File(body_file) as stream:
+                yield _strip_suffix(name, (".bz2",)), stream
+        else:
+            yield name, body_file
+
+    # Internal generator yielding the DataFrames of a member (a single one, or its chunks), loaded with the loader of its sniffed format
+    # Nothing is yielded if the member is not readable
+    def _iter_member_data(self, name, stream):
+        head = stream.read(65536)
+        stream.seek(0)
+        member_format = self.sniff_format(head, file_url=name)
+        member_url = f"{self.file_url}#{name}"
+        if member_format == "csv":
+            yield from _iter_frames(CSVLoader(member_url, self.dtype, self.columns_to_keep, chunksize=self.chunksize).process_data(_member_response(member_url, stream)))
+        elif member_format == "json":
+            yield from self._iter_json_member(member_url, stream, head)
+        elif member_format in ("xls", "xlsx", "zip", "gz", "bz2"):
+            if member_format in ("xls", "xlsx"):
+                loader = ExcelLoader(member_url, self.dtype, self.columns_to_keep)
+            else:
+                loader = ArchiveLoader(member_url, self.dtype, self.columns_to_keep, chunksize=self.chunksize)
+            # Random access formats: the member is decompressed to a temporary file, removed once its data (or its last chunk) is read
+            with tempfile.NamedTemporaryFile() as member_file:
+                shutil.copyfileobj(stream, member_file, 1024 * 1024)
+                member_file.seek(0)
+                yield from _iter_frames(loader.process_data(_member_response(member_url, member_file)))
+        else:
+            self.logger.warning(f"Type de fichier non pris en charge dans l'archive : {member_url}")
+
+    # Internal generator yielding the DataFrames of a JSON member
+    # The items of a top level array are streamed by batches (chunksize, else json_batch_size items),
+    # another document (e.g. an object of columns) is loaded whole, as JSONLoader does
+    def _iter_json_member(self, member_url, stream, head):
+        if not head.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"["):
+            yield from _iter_frames(JSONLoader(member_url).process_data(_member_response(member_url, stream)))
+            return
+        items = JSONLoader(member_url, stream=True).process_data(_member_response(member_url, stream))
+        batch_size = self.chunksize or self.json_batch_size
+        while True:
+            batch = list(itertools.islice(items, batch_size))
+            if not batch:
+                break
+            yield pd.DataFrame(batch)
+
+    # Internal function to get the file name of the archive, from its URL (or from its member name, for a nested archive)
+    def _get_file_name(self):
+        parsed_url = urlparse(self.file_url)
+        return PurePosixPath(parsed_url.fragment or parsed_url.path).name or "data"
+
+# Internal function to build a response whose body file is a member stream (get_body_file reads it in place)
+def _member_response(member_url, stream):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = member_url
+    response.raw = stream
+    response.body_file = stream
+    return response
+
+# Internal generator yielding the DataFrames of loaded data: a DataFrame, an iterator of chunks, or None
+def _iter_frames(data):
+    if isinstance(data, pd.DataFrame):
+        yield data
+    elif data is not None:
+        yield from data
+
+# Internal function to skip the metadata members added by some archivers (e.g. __MACOSX/, .DS_Store)
+def _is_hidden_member(filename):
+    return any(part.startswith((".", "__MACOSX")) for part in PurePosixPath(filename).parts)
+
+# Internal function to get the name of the decompressed file of a gzip or bzip2 body
+def _strip_suffix(name, suffixes):
+    for suffix in suffixes:
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return name
@@ -2,30 +2,71 @@ import time
 import requests
 import logging
 import re
+import tempfile
+import types
+
+from .http_cache import HttpCache
+from .session_manager import SessionManager
 
 class BaseLoader:
     '''
     Base class for data loaders.
     '''
 
-    def __init__(self, file_url, num_retries=3, delay_between_retries=5):
+    def __init__(self, file_url, num_retries=3, delay_between_retries=5, response=None):
         # file_url : URL of the file to load
         # num_retries : Number of retries in case of failure
         # delay_between_retries : Delay between retries in seconds
+        # response : Response already fetched (e.g. by loader_factory), processed by the next load() instead of a new GET
         self.file_url = file_url
         self.num_retries = num_retries
         self.delay_between_retries = delay_between_retries
+        self.response = response
         self.logger = logging.getLogger(__name__)
 
     def load(self):
+        response = self.response if self.response is not None else self.fetch()
+        self.response = None
+        if response is None:
+            return None
+        try:
+            data = self.process_data(response)
+        except Exception:
+            self.close_response(response)
+            raise
+        # Iterators (chunks, streamed items) read the body lazily: the response is closed once they are exhausted or dropped
+        if isinstance(data, types.GeneratorType):
+            return self._close_after(data, response)
+        self.close_response(response)
+        return data
+
+    # Internal generator yielding the items of an iterator, then closing the response it reads from
+    def _close_after(self, data, response):
+        try:
+            yield from data
+        finally:
+            self.close_response(response)
+
+    # Function to release a response: its connection, and its body file (HTTP cache body or temporary file)
+    @staticmethod
+    def close_response(response):
+        response.close()
+        body_file = getattr(response, "body_file", None)
+        if body_file is not None:
+            body_file.close()
+
+    # Function to GET the file with retries, returns None if every attempt failed
+    def fetch(self):
         attempt = 0
         while attempt < self.num_retries:
             try:
-                response = requests.get(self.file_url)
+                response = self._get(self.file_url)
                 if response.status_code == 200:
-                    return self.process_data(response)
+                    return response
                 else:
-                    self.logger.error(f"Failed to load data from {self.file_url}")
+                    # Release the streamed response, so that its connection goes back to the pool
+                    response.close()
+                    self.logger.error(f"Failed to load data from {self.file_url} ({response.status_code})")
                     attempt += 1
             except requests.exceptions.RequestException as e:
                 self.logger.error(f"RequestException: {e}")
@@ -34,31 +75,100 @@ class BaseLoader:
 
         return None
 
+    # Internal function to send the GET request, through the persistent HTTP cache when it is configured
+    @staticmethod
+    def _get(file_url):
+        http_cache = HttpCache.get_instance()
+        if http_cache is not None:
+            return http_cache.get(file_url)
+        return SessionManager.get(file_url, stream=True)
+
     def process_data(self, response):
         raise NotImplementedError("This method should be implemented by subclasses.")
-    
+
+    # Function to get the body of a response as a seekable local file, positioned at its start
+    # The file is kept in the body_file attribute of the response: the open body of the HTTP cache (read in place),
+    # else a temporary file the body is streamed to on the first call (removed when closed with the response)
+    @staticmethod
+    def get_body_file(response):
+        if getattr(response, "body_file", None) is None:
+            body_file = tempfile.NamedTemporaryFile()
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                body_file.write(chunk)
+            response.body_file = body_file
+        response.body_file.seek(0)
+        return response.body_file
+
+    # Function to read the first bytes of a response body, without consuming it
+    @staticmethod
+    def read_head(response, size=65536):
+        body_file = BaseLoader.get_body_file(response)
+        head = body_file.read(size)
+        body_file.seek(0)
+        return head
+
+    # Function to detect the format of a file from the first bytes of its body (magic numbers, then text heuristics)
+    # The content type and the URL extension are only used when the body is not conclusive
+    @staticmethod
+    def sniff_format(head, content_type=None, file_url=""):
+        from .csv_loader import CSVLoader
+
+        stripped_head = head.lstrip(b"\xef\xbb\xbf \t\r\n")
+        if head.startswith(b"PK\x03\x04"):
+            # XLSX files are ZIP archives whose first members are the OOXML descriptors
+            return "xlsx" if (b"[Content_Types].xml" in head or b"xl/" in head) else "zip"
+        if head.startswith(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):
+            return "xls"
+        if head.startswith(b"\x1f\x8b"):
+            return "gz"
+        if head.startswith(b"BZh") and head[4:10] == b"1AY&SY":
+            return "bz2"
+        if stripped_head.startswith((b"{", b"[")):
+            return "json"
+        if not stripped_head.startswith(b"<") and b"\x00" not in head:
+            try:
+                CSVLoader.detect_delimiter(head.decode("latin1"))
+                return "csv"
+            except ValueError:
+                pass # No delimiter found: fall back on the content type
+
+        content_type = content_type or ""
+        if 'json' in content_type:
+            return "json"
+        elif 'csv' in content_type:
+            return "csv"
+        elif re.search(r'(excel|spreadsheet|xls|xlsx)', content_type, re.IGNORECASE) or file_url.endswith(('.xls', '.xlsx')):
+            return "xlsx"
+        return None
+
     @staticmethod
     def loader_factory(file_url, dtype=None, columns_to_keep=None):
         # Factory method to create the appropriate loader based on the file URL
         from .json_loader import JSONLoader
         from .csv_loader import CSVLoader
         from .excel_loader import ExcelLoader
+        from .archive_loader import ArchiveLoader
 
         logger = logging.getLogger(__name__)
 
-        # Get the content type of the file from the headers
-        response = requests.head(file_url)
-        content_type = response.headers.get('content-type')
-        # logger.info(f"Content type : {content_type}")
+        # GET the file once: its format is sniffed from the first bytes of the body, then the response is handed to the loader
+        response = BaseLoader(file_url).fetch()
+        if response is None:
+            logger.warning(f"Impossible de télécharger le fichier à l'URL : {file_url}")
+            return None
+        file_format = BaseLoader.sniff_format(BaseLoader.read_head(response), response.headers.get('content-type'), file_url)
+        # logger.info(f"Format détecté : {file_format}")
 
-        # Determine the loader based on the content type
-        if 'json' in content_type:
-            return JSONLoader(file_url)
-        elif 'csv' in content_type:
-            return CSVLoader(file_url, dtype, columns_to_keep)
-        elif re.search(r'(excel|spreadsheet|xls|xlsx)', content_type, re.IGNORECASE) or file_url.endswith(('.xls', '.xlsx')):
-            return ExcelLoader(file_url, dtype, columns_to_keep)
+        # Determine the loader based on the detected format
+        if file_format == "json":
+            return JSONLoader(file_url, response=response)
+        elif file_format == "csv":
+            return CSVLoader(file_url, dtype, columns_to_keep, response=response)
+        elif file_format in ("xls", "xlsx"):
+            return ExcelLoader(file_url, dtype, columns_to_keep, response=response)
+        elif file_format in ("zip", "gz", "bz2"):
+            return ArchiveLoader(file_url, dtype, columns_to_keep, response=response)
         else:
-            logger = logging.getLogger(__name__)
             logger.warning(f"Type de fichier non pris en charge pour l'URL : {file_url}")
+            BaseLoader.close_response(response)
             return None
@@ -1,3 +1,4 @@
+import codecs
 import csv
 import pandas as pd
 import requests
@@ -9,41 +10,78 @@ from .base_loader import BaseLoader
 class CSVLoader(BaseLoader):
     '''
     Loader for CSV files.
+    The body is parsed from disk (HTTP cache or temporary file): encoding and delimiter are detected on a bounded sample,
+    then pandas reads the bytes directly with the detected encoding.
+    With a chunksize, process_data returns an iterator of DataFrames instead of a single DataFrame.
     '''
-    
-    def __init__(self, file_url, dtype=None, columns_to_keep=None, **kwargs):
+
+    encodings_to_try = ['utf-8', 'windows-1252', 'latin1']
+    sample_size = 1024 * 1024 # Number of bytes used to detect the encoding and the delimiter
+
+    def __init__(self, file_url, dtype=None, columns_to_keep=None, chunksize=None, **kwargs):
         super().__init__(file_url, **kwargs)
         self.dtype = dtype
         self.columns_to_keep = columns_to_keep
+        self.chunksize = chunksize
 
     def process_data(self, response):
-        # Manage the encoding of the CSV file
-        encodings_to_try = ['utf-8', 'windows-1252', 'latin1']
-        decoded_content = None
-        data = response.content
+        body_file = self.get_body_file(response)
+        sample = body_file.read(self.sample_size)
+        is_complete_sample = len(sample) < self.sample_size
+        body_file.seek(0)
 
-        for encoding in encodings_to_try:
-            try:
-                decoded_content = data.decode(encoding)
-                break
-            except Exception:
-                pass
-
-        if decoded_content is None:
+        # Manage the encoding of the CSV file, detected on the sample
+        encodings = self.detect_encodings(sample, is_complete_sample)
+        if not encodings:
             self.logger.error(f"Impossible de décoder le contenu du fichier CSV à l'URL : {self.file_url}")
             return None
+        encoding, decoded_sample = encodings[0]
 
         # Detect the delimiter used in the CSV file
-        delimiter = self.detect_delimiter(decoded_content)
+        delimiter = self.detect_delimiter(decoded_sample)
         # Load only the columns specified in columns_to_keep, and skip bad lines
+        read_csv_kwargs = {"delimiter": delimiter, "dtype": self.dtype, "on_bad_lines": 'skip', "quoting": csv.QUOTE_MINIMAL, "low_memory": False}
         if self.columns_to_keep is not None:
-            df = pd.read_csv(StringIO(decoded_content), delimiter=delimiter, dtype=self.dtype, usecols=lambda c: c in self.columns_to_keep, on_bad_lines='skip', quoting=csv.QUOTE_MINIMAL, low_memory=False)
+            read_csv_kwargs["usecols"] = lambda c: c in self.columns_to_keep
+
+        if self.chunksize is not None:
+            return self._iter_chunks(response, encoding, read_csv_kwargs)
+
+        # The sample may be decodable while the rest of the file is not: fall back on the next candidate encodings
+        for encoding, _ in encodings:
+            try:
+                df = pd.read_csv(self.get_body_file(response), encoding=encoding, **read_csv_kwargs)
+                break
+            except UnicodeDecodeError:
+                self.logger.warning(f"Encodage {encoding} invalide au-delà de l'échantillon pour l'URL : {self.file_url}")
         else:
-            df = pd.read_csv(StringIO(decoded_content), delimiter=delimiter, dtype=self.dtype, on_bad_lines='skip', quoting=csv.QUOTE_MINIMAL, low_memory=False)
-        
+            self.logger.error(f"Impossible de décoder le contenu du fichier CSV à l'URL : {self.file_url}")
+            return None
+
         self.logger.info(f"CSV Data from {self.file_url} loaded.")
         return df
 
+    # Internal generator yielding the data chunk by chunk, the response (and its body file) is kept alive until the last chunk
+    # Undecodable bytes beyond the sample are replaced, as already yielded chunks cannot be read again with another encoding
+    def _iter_chunks(self, response, encoding, read_csv_kwargs):
+        with pd.read_csv(self.get_body_file(response), encoding=encoding, encoding_errors="replace", chunksize=self.chunksize, **read_csv_kwargs) as reader:
+            for chunk in reader:
+                yield chunk
+        self.logger.info(f"CSV Data from {self.file_url} loaded by chunks.")
+
+    # Function to list the encodings able to decode a sample, with the decoded sample
+    # A multi-byte character may be cut at the end of a partial sample, so it is decoded incrementally
+    @classmethod
+    def detect_encodings(cls, sample, is_complete_sample=True):
+        encodings = []
+        for encoding in cls.encodings_to_try:
+            try:
+                decoder = codecs.getincrementaldecoder(encoding)()
+                encodings.append((encoding, decoder.decode(sample, final=is_complete_sample)))
+            except UnicodeDecodeError:
+                pass
+        return encodings
+
     @staticmethod
     def detect_delimiter(text, num_lines=5, delimiters=[',', ';', '\t', '|']):
         # This function detects the delimiter used in a CSV file
@@ -1,36 +1,108 @@
+import datetime
+import numpy as np
+import openpyxl
 import pandas as pd
-from io import BytesIO
 import logging
 
 from .base_loader import BaseLoader
 from scripts.utils.dataframe_operation import detect_skiprows, detect_skipcolumns
 
+# python-calamine (Rust reader of XLSX & XLS files, see requirements.txt) is the supported reader
+# Without it (e.g. a platform without wheels), openpyxl (XLSX) or pandas (XLS) are used
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
 class ExcelLoader(BaseLoader):
     '''
-    Loader for Excel files.
+    Loader for Excel files (XLSX & XLS), read from the body on disk.
+    The first sheet is read with python-calamine, else with openpyxl in read-only mode (XLSX) or pandas (XLS).
+    The position of the table (header row & first column) is detected on the first header_detection_rows rows only,
+    then only the data region is converted to a DataFrame (openpyxl only reads the cells of the data region),
+    with the header row as columns and the requested dtypes.
     '''
 
+    header_detection_rows = 100 # Number of rows used to detect where the table starts
+
     def __init__(self, file_url, dtype=None, columns_to_keep=None, **kwargs):
         super().__init__(file_url, **kwargs)
         self.dtype = dtype
         self.columns_to_keep = columns_to_keep
 
     def process_data(self, response):
-        data = response.content
-
-        df = pd.read_excel(BytesIO(data), header=None, dtype=self.dtype)
+        body_file = self.get_body_file(response)
+        if CalamineWorkbook is not None:
+            rows = CalamineWorkbook.from_filelike(body_file).get_sheet_by_index(0).to_python(skip_empty_area=False)
+            skiprows, skipcols = self._detect_data_region(_rows_to_df(rows[:self.header_detection_rows]))
+            df = _rows_to_df((row[skipcols:] for row in rows[skiprows:]), skiprows, skipcols)
+        elif self.sniff_format(self.read_head(response)) == "xlsx":
+            df = self._read_data_region_openpyxl(body_file)
+        else:
+            df = pd.read_excel(body_file, header=None)
+            skiprows, skipcols = self._detect_data_region(df.head(self.header_detection_rows))
+            df = df.iloc[skiprows:, skipcols:]
 
-        # Detect and skip rows and columns with missing values
-        skiprows = detect_skiprows(df)
-        skipcols = detect_skipcolumns(df)
-
-        # Load only the columns specified in columns_to_keep
-        df = df.iloc[skiprows:, skipcols:]
+        # The first row of the data region is the header
+        # dtype is applied to the data region only: a single dtype to all its cells (header included, as read_excel does),
+        # a dict to the named columns present
+        if self.dtype is not None and not isinstance(self.dtype, dict):
+            df = df.apply(lambda column: _astype_keep_na(column, self.dtype))
         df.columns = df.iloc[0]
         df = df.drop(df.index[0]).reset_index(drop=True)
+        if isinstance(self.dtype, dict):
+            for position, col in enumerate(df.columns):
+                if col in self.dtype:
+                    df.isetitem(position, _astype_keep_na(df.iloc[:, position], self.dtype[col]))
 
+        # Load only the columns specified in columns_to_keep
         if self.columns_to_keep is not None:
             df = df.loc[:, self.columns_to_keep]
 
         self.logger.info(f"Excel Data from {self.file_url} loaded.")
-        return df
\ No newline at end of file
+        return df
+
+    # Internal function to detect the data region on the first rows of a sheet: returns the numbers of rows & columns to skip
+    @staticmethod
+    def _detect_data_region(sample):
+        return detect_skiprows(sample), detect_skipcolumns(sample)
+
+    # Internal function to read the data region of the first sheet with openpyxl in read-only mode (values only, no cell objects)
+    # The region is detected on the first rows, then only its rows & columns are read
+    def _read_data_region_openpyxl(self, body_file):
+        workbook = openpyxl.load_workbook(body_file, read_only=True, data_only=True, keep_links=False)
+        try:
+            sheet = workbook.worksheets[0]
+            skiprows, skipcols = self._detect_data_region(_rows_to_df(sheet.iter_rows(max_row=self.header_detection_rows, values_only=True)))
+            return _rows_to_df(sheet.iter_rows(min_row=skiprows + 1, min_col=skipcols + 1, values_only=True), skiprows, skipcols)
+        finally:
+            workbook.close()
+
+# Internal function to build the DataFrame of sheet rows, as pandas reads a sheet with header=None:
+# empty cells are NaN, integral numbers are integers, trailing empty rows are dropped
+# The rows & columns are labelled with their positions in the sheet (the rows of a data region starting at first_row)
+def _rows_to_df(rows, first_row=0, first_col=0):
+    rows = [[_convert_cell(cell) for cell in row] for row in rows]
+    while rows and all(cell is np.nan for cell in rows[-1]):
+        rows.pop()
+    df = pd.DataFrame(rows)
+    df.index += first_row
+    df.columns += first_col
+    return df
+
+# Internal function to convert a column to a dtype, missing values staying NaN for the str dtype (as read_excel does)
+def _astype_keep_na(column, dtype):
+    if dtype in (str, "str"):
+        return column.where(column.isna(), column.astype(str))
+    return column.astype(dtype)
+
+# Internal function to convert a cell value like pandas converts the cells read by openpyxl
+def _convert_cell(cell):
+    if cell is None or cell == "":
+        return np.nan
+    if isinstance(cell, float) and cell.is_integer():
+        return int(cell)
+    if type(cell) is datetime.date:
+        # python-calamine reads the dates without time as dates, openpyxl as datetimes
+        return datetime.datetime(cell.year, cell.month, cell.day)
+    return cell
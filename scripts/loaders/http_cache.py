@@ -0,0 +1,208 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from scripts.utils.config import get_project_base_path
+from .session_manager import SessionManager
+
+class HttpCache:
+    '''
+    Persistent on-disk cache for the HTTP responses downloaded by the loaders.
+    Bodies are stored once per content hash (content-addressed), an index maps each URL to its body and validators (ETag, Last-Modified).
+    A cached response is served without any request while its TTL is running, then revalidated with a conditional GET:
+    a 304 answer is served from disk, a 200 answer replaces the cached body.
+    The total size of the bodies is capped, least recently used entries are evicted first.
+    The access times of the cache hits are updated in memory, and written with the next change of the index or by flush()
+    (registered at exit), instead of rewriting the index at each hit.
+    '''
+    _instance = None
+
+    def __init__(self, cache_config):
+        self.logger = logging.getLogger(__name__)
+        self.cache_folder = Path(get_project_base_path()) / cache_config.get("path", "data/cache/http")
+        self.bodies_folder = self.cache_folder / "bodies"
+        self.bodies_folder.mkdir(parents=True, exist_ok=True)
+        self.index_file = self.cache_folder / "index.json"
+        self.max_size = int(cache_config.get("max_size_mb", 2048)) * 1024 * 1024
+        self.default_ttl = cache_config.get("default_ttl", 0)
+        self.ttl_overrides = cache_config.get("ttl") or {}
+        # The loaders can run in worker threads (DatafilesLoader), the index is protected by a lock
+        self.lock = threading.Lock()
+        self.index = self._read_index()
+        self.index_changed = False # Access times not written to the index file yet
+
+    # Configure the shared cache from the 'http_cache' config section (no section or enabled: False disables the cache)
+    @classmethod
+    def configure(cls, cache_config):
+        if cache_config and cache_config.get("enabled", True):
+            cls._instance = cls(cache_config)
+            atexit.register(cls._instance.flush)
+        else:
+            cls._instance = None
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        return cls._instance
+
+    # Function to get the response of a URL, from the cache when possible
+    # The cached body is opened under the lock, so that a concurrent eviction cannot remove it before it is served
+    # (an open body stays readable after its removal). The body file is closed with the response (response.close())
+    def get(self, url, **kwargs):
+        with self.lock:
+            entry = self.index.get(url)
+            body_file = self._open_body(entry) if entry is not None else None
+            if entry is not None and body_file is None:
+                del self.index[url]
+                self.index_changed = True
+                entry = None
+
+        # Fresh entry: no request at all
+        if entry is not None and time.time() - entry["fetched_at"] < self._get_ttl(url):
+            self.logger.info(f"Réponse servie depuis le cache pour l'URL : {url}")
+            return self._touch_and_build(url, entry, body_file, refresh=False)
+
+        # Stale or missing entry: (conditional) GET
+        try:
+            headers = dict(kwargs.pop("headers", None) or {})
+            if entry is not None:
+                if entry["headers"].get("ETag"):
+                    headers["If-None-Match"] = entry["headers"]["ETag"]
+                if entry["headers"].get("Last-Modified"):
+                    headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+            response = SessionManager.get(url, headers=headers, stream=True, **kwargs)
+        except Exception:
+            if body_file is not None:
+                body_file.close()
+            raise
+
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            self.logger.info(f"Réponse revalidée (304), servie depuis le cache pour l'URL : {url}")
+            return self._touch_and_build(url, entry, body_file, refresh=True)
+        if body_file is not None:
+            body_file.close()
+        if response.status_code != 200:
+            return response
+
+        try:
+            body, size = self._store_body(response)
+        finally:
+            response.close()
+        entry = {
+            "body": body,
+            "size": size,
+            "headers": {key: response.headers[key] for key in ("Content-Type", "ETag", "Last-Modified") if key in response.headers},
+            "fetched_at": time.time(),
+            "last_access": time.time(),
+        }
+        with self.lock:
+            previous_entry = self.index.get(url)
+            self.index[url] = entry
+            if previous_entry is not None:
+                self._remove_unreferenced_body(previous_entry["body"])
+            self._evict(keep_url=url)
+            self._write_index()
+            body_file = self._open_body(entry)
+        return self._build_response(url, entry, body_file)
+
+    # Internal function to get the TTL of a URL: the longest matching prefix in the ttl overrides, else the default TTL
+    def _get_ttl(self, url):
+        matching_prefixes = [prefix for prefix in self.ttl_overrides if url.startswith(prefix)]
+        if matching_prefixes:
+            return self.ttl_overrides[max(matching_prefixes, key=len)]
+        return self.default_ttl
+
+    # Internal function to stream a response body to disk, stored under its SHA-256
+    def _store_body(self, response):
+        sha256 = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=self.bodies_folder, delete=False) as tmp_file:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                sha256.update(chunk)
+                tmp_file.write(chunk)
+                size += len(chunk)
+        body = sha256.hexdigest()
+        os.replace(tmp_file.name, self.bodies_folder / body)
+        return body, size
+
+    # Function to write the access times of the cache hits to the index file
+    def flush(self):
+        with self.lock:
+            if self.index_changed:
+                self._write_index()
+
+    # Internal function to record the access to an entry: a revalidated entry (refresh) is written at once, a cache hit with the next write
+    def _touch_and_build(self, url, entry, body_file, refresh):
+        with self.lock:
+            entry["last_access"] = time.time()
+            if refresh:
+                entry["fetched_at"] = entry["last_access"]
+                self._write_index()
+            else:
+                self.index_changed = True
+        return self._build_response(url, entry, body_file)
+
+    # Internal function to open the body file of an entry, returns None if it was removed (to be called with the lock held)
+    def _open_body(self, entry):
+        try:
+            return open(self.bodies_folder / entry["body"], "rb")
+        except FileNotFoundError:
+            return None
+
+    # Internal function to build a requests.Response reading its body from the (open) cached body file
+    # The loaders read the body file in place (body_file, see BaseLoader.get_body_file), it is also the raw body of the response
+    def _build_response(self, url, entry, body_file):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.raw = body_file
+        response.body_file = body_file
+        return response
+
+    # Internal function to evict the least recently used entries until the bodies fit in max_size
+    def _evict(self, keep_url=None):
+        bodies_size = {entry["body"]: entry["size"] for entry in self.index.values()}
+        total_size = sum(bodies_size.values())
+        for url, entry in sorted(self.index.items(), key=lambda item: item[1]["last_access"]):
+            if total_size <= self.max_size:
+                break
+            if url == keep_url:
+                continue
+            del self.index[url]
+            if self._remove_unreferenced_body(entry["body"]):
+                total_size -= bodies_size[entry["body"]]
+            self.logger.info(f"Entrée du cache supprimée pour l'URL : {url}")
+
+    # Internal function to remove a body file: a body can be shared by several URLs, it is only removed when not referenced anymore
+    def _remove_unreferenced_body(self, body):
+        if any(entry["body"] == body for entry in self.index.values()):
+            return False
+        (self.bodies_folder / body).unlink(missing_ok=True)
+        return True
+
+    def _read_index(self):
+        if self.index_file.exists():
+            try:
+                with open(self.index_file, "r") as f:
+                    return json.load(f)
+            except json.JSONDecodeError:
+                self.logger.warning(f"Index du cache illisible, il est réinitialisé : {self.index_file}")
+        return {}
+
+    def _write_index(self):
+        tmp_file = self.index_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_file, self.index_file)
+        self.index_changed = False
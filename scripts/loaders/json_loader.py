@@ -1,20 +1,28 @@
+import json
 import pandas as pd
 import logging
 
 from .base_loader import BaseLoader
+from scripts.utils.json_operation import iter_json_array
 
 class JSONLoader(BaseLoader):
     '''
     Loader for JSON files.
+    With stream=True, process_data returns an iterator over the items of the 'key' array (or of the top level array),
+    parsed incrementally from the body on disk instead of building the whole JSON tree.
     '''
-    
-    def __init__(self, file_url, key=None, normalize=False, **kwargs):
+
+    def __init__(self, file_url, key=None, normalize=False, stream=False, **kwargs):
         super().__init__(file_url, **kwargs)
         self.key = key
         self.normalize = normalize
+        self.stream = stream
 
     def process_data(self, response):
-        data = response.json()
+        if self.stream:
+            return self._iter_items(response)
+
+        data = json.load(self.get_body_file(response))
 
         if self.key is not None:
             data = data.get(self.key, {})
@@ -24,3 +32,8 @@ class JSONLoader(BaseLoader):
             return pd.json_normalize(data)
         else:
             return pd.DataFrame(data)
+
+    # Internal generator yielding the items one by one, the response (and its body file) is kept alive until the last item
+    def _iter_items(self, response):
+        yield from iter_json_array(self.get_body_file(response), self.key)
+        self.logger.info(f"JSON Data from {self.file_url} streamed.")
@@ -0,0 +1,34 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+class RateLimiter:
+    '''
+    RateLimiter spaces out the requests sent by several threads: at most requests_per_second in total,
+    and at most requests_per_second_per_host to each host.
+    Call wait(url) before each request, it blocks until the request can be sent.
+    '''
+
+    def __init__(self, requests_per_second=None, requests_per_second_per_host=None):
+        self._global_interval = 1 / requests_per_second if requests_per_second else 0
+        self._host_interval = 1 / requests_per_second_per_host if requests_per_second_per_host else 0
+        self._lock = threading.Lock()
+        self._global_next_slot = 0
+        self._host_next_slots = {}
+
+    # Function to wait for the next free slot of the global and host limits, the slot is reserved before sleeping
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._global_next_slot, self._host_next_slots.get(host, 0))
+            self._global_next_slot = slot + self._global_interval
+            self._host_next_slots[host] = slot + self._host_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    # Function to push back the next slots of a host, e.g. when the server answers with a Retry-After header
+    def delay(self, url, seconds):
+        host = urlparse(url).netloc
+        with self._lock:
+            self._host_next_slots[host] = max(self._host_next_slots.get(host, 0), time.monotonic() + seconds)
@@ -0,0 +1,79 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+class SessionManager:
+    '''
+    SessionManager shares one pooled requests.Session per host between all the HTTP clients of the project
+    (loaders, HTTP cache, GeoLocator, DataGouvSearcher), so that connections (and TLS handshakes) are reused across requests.
+    '''
+    _sessions = {}
+    _lock = threading.Lock()
+    pool_maxsize = 16 # Should be at least the number of threads requesting the same host (see datafile_loader & datagouv api max_workers)
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    @classmethod
+    def get_session(cls, url):
+        host = urlparse(url).netloc
+        with cls._lock:
+            if host not in cls._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_maxsize=cls.pool_maxsize)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                cls._sessions[host] = session
+            return cls._sessions[host]
+
+    # Function to send a GET request with the session of the URL host
+    @classmethod
+    def get(cls, url, **kwargs):
+        return cls.get_session(url).get(url, **kwargs)
+
+    # Function to send a POST request with the session of the URL host
+    @classmethod
+    def post(cls, url, **kwargs):
+        return cls.get_session(url).post(url, **kwargs)
+
+    # Function to send a GET request, spaced out by an optional RateLimiter, and retried (with exponential backoff) on
+    # connection errors & transient statuses. The Retry-After header of 429/503 responses is honored.
+    # Returns the last response, or raises the last connection error
+    @classmethod
+    def get_with_retries(cls, url, rate_limiter=None, max_retries=5, backoff=1, **kwargs):
+        for attempt in range(max_retries + 1):
+            if rate_limiter is not None:
+                rate_limiter.wait(url)
+            try:
+                response = cls.get(url, **kwargs)
+            except requests.ConnectionError:
+                if attempt == max_retries:
+                    raise
+                time.sleep(backoff * 2 ** attempt)
+                continue
+            if response.status_code not in cls.retry_statuses or attempt == max_retries:
+                return response
+            # The response is retried: release its connection to the pool
+            response.close()
+            retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            delay = retry_after if retry_after is not None else backoff * 2 ** attempt
+            if rate_limiter is not None:
+                # Hold back the other threads requesting the same host too
+                rate_limiter.delay(url, delay)
+            else:
+                time.sleep(delay)
+
+# Internal function to parse a Retry-After header (delay in seconds or HTTP date), returns None if absent or invalid
+def _parse_retry_after(value):
+    if value is None:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -5,5 +5,6 @@ class ArgumentParser:
     def parse_args(description):
         parser = argparse.ArgumentParser(description=description)
         parser.add_argument('filename')   
+        parser.add_argument('--resume', action='store_true', help="Reprend le workflow depuis les checkpoints : les étapes dont les entrées et la configuration n'ont pas changé ne sont pas relancées")
         args = parser.parse_args()
         return args
\ No newline at end of file
@@ -10,15 +10,48 @@ This script contains functions to manipulate DataFrames.
 5 - Detecting the first column index where the data starts
 '''
 
+# Date formats tried in this order on the unique values of a date column, before inferring the format value by value
+# French dates are day first (01/02/2022 is the 1st of February)
+DATE_FORMATS = [
+    'ISO8601',
+    '%Y-%m-%d%z',
+    '%d/%m/%Y',
+    '%d/%m/%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%d-%m-%Y',
+    '%d/%m/%y',
+]
+# String values of missing data, not parsed
+NULL_DATE_STRINGS = ['nan', 'NaN', 'NaT', 'None', '<NA>', '']
+
 # Function to merge duplicate columns in a DataFrame
+# Columns with exactly the same name (selected by position) are merged into the first one: non null values joined with ' / '
 def merge_duplicate_columns(df):
     df.columns = df.columns.astype(str)
-    duplicate_columns = df.columns[df.columns.duplicated(keep=False)]
-    for col in duplicate_columns.unique():
-        cols_to_merge = df.filter(like=col, axis=1)
-        df[col] = cols_to_merge.apply(lambda x: ' / '.join(x.dropna().astype(str)), axis=1)
-        df.drop(cols_to_merge.columns[1:], axis=1, inplace=True)
-    return df
+    if not df.columns.has_duplicates:
+        return df
+    positions_by_col = {}
+    for position, col in enumerate(df.columns):
+        positions_by_col.setdefault(col, []).append(position)
+
+    merged_df = df.iloc[:, [positions[0] for positions in positions_by_col.values()]].copy()
+    for col, positions in positions_by_col.items():
+        if len(positions) > 1:
+            merged_df[col] = join_columns([df.iloc[:, position] for position in positions], ' / ')
+    return merged_df
+
+# Function to join aligned columns as strings, column-wise: null values are skipped, rows without any value are empty strings
+def join_columns(columns, sep, index=None):
+    if not columns:
+        return pd.Series('', index=index, dtype=object)
+    joined = None
+    for col in columns:
+        values = col.astype(str).where(col.notna())
+        if joined is None:
+            joined = values
+        else:
+            joined = (joined + sep + values).fillna(joined).fillna(values)
+    return joined.fillna('').astype(object)
 
 # Function to rename columns in a DataFrame
 def safe_rename(df, schema_dict):
@@ -29,6 +62,7 @@ def safe_rename(df, schema_dict):
     df.rename(columns=schema_dict_copy, inplace=True)
 
 # Function to cast the data in a DataFrame based on a schema (a DataFrame with two columns: 'name' and 'type')
+# Returns the casted data and a coercion report: the values coerced to null, counted by column & value
 def cast_data(data, schema, name_tag, clean_column_name_for_comparison=None):
     logger = logging.getLogger(__name__)
     # Dict between schema types and pandas types
@@ -50,28 +84,34 @@ def cast_data(data, schema, name_tag, clean_column_name_for_comparison=None):
         # If no cleaning function is provided, use the exact same column names
         original_to_cleaned_names = {col: col for col in data.columns}
     
-    # Create a new dataframe with the same shape and columns as data
-    casted_data = pd.DataFrame(columns=data.columns)
-    
-    # Go through each column in the data to cast it
+    # Dict between schema names and schema types (the first occurrence of a name is kept)
+    schema_types = schema.drop_duplicates(subset=name_tag).set_index(name_tag)['type'].to_dict()
+
+    # Go through each column in the data to cast it, the casted data is built at once from the casted columns
+    casted_columns = {}
+    coercion_reports = []
     for original_name, cleaned_name in original_to_cleaned_names.items():
         # if column name is not in schema['name'].values, keep the exact same column
-        if cleaned_name not in schema[name_tag].values:
-            casted_data[original_name] = data[original_name]
+        if cleaned_name not in schema_types:
+            casted_columns[original_name] = data[original_name]
         # if column name is in schema['name'].values, cast the column with the paired schema['type'] value
         else:
-            # get the schema type for the column
-            schema_type = schema.loc[schema[name_tag] == cleaned_name, 'type'].values[0]
             # translate the schema type to pandas type using type_dict
-            pandas_type = type_dict[schema_type]
+            pandas_type = type_dict[schema_types[cleaned_name]]
             # clean & cast the column to the pandas type, based on internal function
-            casted_data[original_name] = _clean_and_cast_col(data[original_name], pandas_type)
+            casted_columns[original_name], coerced_values = _clean_and_cast_col(data[original_name], pandas_type)
             logger.info(f"Column '{original_name}' has been casted to '{pandas_type}'")
-    return casted_data
+            if not coerced_values.empty:
+                logger.error(f"{coerced_values.sum()} values of column '{original_name}' supposed to be a '{pandas_type}' were coerced to null ({len(coerced_values)} distinct values)")
+                coercion_reports.append(pd.DataFrame({'column': original_name, 'value': coerced_values.index, 'count': coerced_values.values}))
+
+    casted_data = pd.DataFrame(casted_columns, index=data.index, columns=data.columns)
+    coercion_report = pd.concat(coercion_reports, ignore_index=True) if coercion_reports else pd.DataFrame(columns=['column', 'value', 'count'])
+    return casted_data, coercion_report
 
 # Internal function to clean and cast a column based on its schema type
+# Returns the casted column and the counts of the values coerced to null (indexed by value)
 def _clean_and_cast_col(col, pandas_type):
-    logger = logging.getLogger(__name__)
     # Make a copy of the orginal column
     col_original = col.copy()
 
@@ -81,8 +121,7 @@ def _clean_and_cast_col(col, pandas_type):
         col = pd.to_numeric(col, errors='coerce')  # Coerce errors will be set to NaN
     elif pandas_type == 'datetime64[ns]':
         # Convert to datetime, with utc=true, errors will be coerced to NaT
-        col = col.astype(str)
-        col = col.apply(_parse_date)
+        col = _parse_dates(col.astype(str))
         # Check if the data is timezone-aware
         if col.dt.tz is not None:
             col = col.dt.tz_localize(None)
@@ -91,26 +130,53 @@ def _clean_and_cast_col(col, pandas_type):
         col = col.str.strip()
         col = col.astype(str)
     elif pandas_type == 'Int64':
-        # Arrondir les valeurs flottantes
-        col = col.apply(lambda x: round(x) if not pd.isna(x) and isinstance(x, float) else x)
-        # Convert to integer, note that 'Int64' can handle NaN values
+        # Convert to integer (floating values are rounded), note that 'Int64' can handle NaN values
         col = pd.to_numeric(col, errors='coerce').round().astype('Int64')
     elif pandas_type == 'boolean':            
         col = col.str.replace(r"\s+","", regex=True).str.lower()
         # Convert to boolean, True for 'oui', False for 'non', case insensitive
         col = col.str.lower().map({'oui': True, 'non': False, 'false':False,'true':True})
 
-    # Compare the original column with the copy to identify coerced values
-    coerced_indices = col_original.index[(col_original.notnull())&(col_original != col)]
-    coerced_values = col_original.loc[coerced_indices]
+    # Compare the original column with the casted one to identify the values coerced to null
+    original_strings = col_original.astype(str)
+    coerced_mask = col_original.notnull() & col.isna() & ~original_strings.str.contains('nan', regex=False)
+    coerced_values = original_strings[coerced_mask].value_counts()
+
+    return col.astype(pandas_type), coerced_values  # Convert to specified pandas type
+
+# Internal function to parse a column of date strings: the unique values are parsed with the DATE_FORMATS (vectorized),
+# the format of the remaining ones is inferred value by value. The share of the values parsed by each format is logged
+def _parse_dates(col):
+    logger = logging.getLogger(__name__)
+    unique_values = pd.Series(col.unique())
+    parsed = pd.Series(pd.NaT, index=unique_values.index, dtype='datetime64[ns, UTC]')
+    parsed_by = pd.Series('unparsed', index=unique_values.index)
+    parsed_by[unique_values.isin(NULL_DATE_STRINGS)] = 'null'
+    remaining = parsed_by == 'unparsed'
+
+    for date_format in DATE_FORMATS:
+        if not remaining.any():
+            break
+        attempt = pd.to_datetime(unique_values[remaining], format=date_format, utc=True, errors='coerce')
+        matched = attempt.index[attempt.notna()]
+        parsed[matched] = attempt[matched]
+        parsed_by[matched] = date_format
+        remaining[matched] = False
 
-    if not coerced_values.empty:
-        #Log the coerced values and relevant information
-        for index, value in coerced_values.items():
-            if ("nan" not in str(value))&(pd.isna(col.loc[index])):
-                logger.error(f"Value '{value}' supposed to be a '{pandas_type}' was coerced to {col[index]}")
+    # Leftovers: format inferred value by value (dateutil)
+    if remaining.any():
+        inferred = unique_values[remaining].apply(_parse_date)
+        matched = inferred.index[inferred.notna()]
+        parsed[matched] = pd.to_datetime(inferred[matched], utc=True)
+        parsed_by[matched] = 'inferred'
 
-    return col.astype(pandas_type)  # Convert to specified pandas type
+    # Map the parsed unique values back to the column, and log the parse rates (of the non null values) by format
+    parsed.index = unique_values.values
+    parsed_by.index = unique_values.values
+    rows_parsed_by = col.map(parsed_by)
+    rates = rows_parsed_by[rows_parsed_by != 'null'].value_counts(normalize=True) * 100
+    logger.info(f"Column '{col.name}' date parse rates: " + ", ".join(f"{date_format} {rate:.1f}%" for date_format, rate in rates.items()))
+    return col.map(parsed)
 
 # Internal function to parse a date string
 def _parse_date(date_str):
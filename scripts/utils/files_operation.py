@@ -9,7 +9,11 @@ def save_csv(df, file_folder, file_name, sep=",", index=False):
     if not os.path.exists(file_folder):
         os.makedirs(file_folder)
 
-    df.columns = [re.sub(r"[.-]", "_", col.lower()) for col in df.columns] # to adjust column for SQL format and ensure consistency
+    df.columns = normalize_column_names(df.columns) # to adjust column for SQL format and ensure consistency
     df.to_csv(file_folder / file_name, index=True, sep=sep)
 
-    logger.info(f"Le fichier {file_name} a été enregistré dans le répertoire {file_folder}")
\ No newline at end of file
+    logger.info(f"Le fichier {file_name} a été enregistré dans le répertoire {file_folder}")
+
+# Function to normalize column names: lower case, '.' & '-' replaced by '_'
+def normalize_column_names(columns):
+    return [re.sub(r"[.-]", "_", col.lower()) for col in columns]
@@ -0,0 +1,68 @@
+import logging
+import sqlite3
+import time
+from pathlib import Path
+
+import pandas as pd
+
+
+class GeocodeStore:
+    """
+    GeocodeStore is a persistent SQLite store of the geocoordinates resolved by GeoLocator, shared across runs.
+    Entries are keyed by (type, code), the code being the COG of regions, departments & communes, or the SIREN of EPCI.
+    Each entry records its source and timestamp. "Not found" results are stored too (negative caching),
+    they are considered resolved until their retry TTL expires.
+    """
+
+    def __init__(self, store_path, not_found_retry_ttl=7 * 24 * 3600):
+        self.logger = logging.getLogger(__name__)
+        self.store_path = Path(store_path)
+        self.store_path.parent.mkdir(parents=True, exist_ok=True)
+        self.not_found_retry_ttl = not_found_retry_ttl
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS geocodes (
+                    type TEXT NOT NULL,
+                    code TEXT NOT NULL,
+                    longitude REAL,
+                    latitude REAL,
+                    source TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (type, code)
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.store_path)
+
+    # Function to get the stored entries of a batch of keys, one row per key (in order)
+    # The 'resolved' column is False for the keys to (re)geocode: not stored yet, or "not found" with an expired retry TTL
+    def get(self, types, codes):
+        keys = pd.MultiIndex.from_arrays([pd.Series(types, dtype=object).values, pd.Series(codes, dtype=object).values], names=['type', 'code'])
+        with self._connect() as connection:
+            entries = pd.read_sql_query("SELECT type, code, longitude, latitude, source, updated_at FROM geocodes", connection)
+        entries = entries.set_index(['type', 'code']).reindex(keys).reset_index(drop=True)
+
+        is_not_found = entries['source'] == 'not_found'
+        is_expired = is_not_found & (entries['updated_at'] < time.time() - self.not_found_retry_ttl)
+        entries['resolved'] = entries['source'].notna() & ~is_expired
+        return entries
+
+    # Function to store a batch of entries (DataFrame with 'type', 'code', 'longitude', 'latitude' & 'source' columns)
+    # Entries without coordinates are stored as "not found"
+    def put(self, entries):
+        is_not_found = entries['longitude'].isna() | entries['latitude'].isna()
+        rows = pd.DataFrame({
+            'type': entries['type'].astype(str),
+            'code': entries['code'].astype(str),
+            'longitude': entries['longitude'].where(~is_not_found),
+            'latitude': entries['latitude'].where(~is_not_found),
+            'source': entries['source'].where(~is_not_found, 'not_found'),
+            'updated_at': time.time(),
+        }).astype(object).where(lambda df: df.notna(), None)
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO geocodes (type, code, longitude, latitude, source, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                rows.itertuples(index=False, name=None),
+            )
+        self.logger.info(f"{len(rows)} géocodages enregistrés dans {self.store_path} (dont {is_not_found.sum()} non trouvés)")
@@ -1,130 +1,256 @@
 import logging
-import requests
 from pathlib import Path
 import pandas as pd
 import numpy as np
 from io import StringIO
 import os
 import json 
+import requests
 
 from scripts.utils.config import get_project_base_path
 from scripts.loaders.csv_loader import CSVLoader
+from scripts.loaders.json_loader import JSONLoader
 from scripts.loaders.excel_loader import ExcelLoader
+from scripts.loaders.session_manager import SessionManager
+from scripts.utils.geocode_store import GeocodeStore
 
 
 class GeoLocator:
     """
     GeoLocator is a class that enriches a DataFrame containing regions, departments, EPCI, and communes with geocoordinates.
-    It uses the COG (INSEE code) to retrieve the coordinates of the regions, departments, and communes from various sources: CSV & API.
-    One external method is available to add geocoordinates to the DataFrame.
+    It uses the COG (INSEE code) to retrieve the coordinates of the regions, departments, and communes from local reference files
+    (centers of the regions & departments, centers of the communes), EPCI are located at their seat commune.
+    The reference tables are loaded on first use and indexed once: (type, cog) -> coordinates, cog -> coordinates,
+    EPCI SIREN -> seat commune SIREN, and commune SIREN -> nom, cog.
+    Only the communes missing from the reference files are geocoded remotely, in batches (api-adresse CSV endpoint).
+    The results are kept in a persistent GeocodeStore: the entities already resolved in a previous run are not geocoded again.
+    External methods: add_geocoordinates, and the batch lookups (arrays of keys in, one row per key out).
     """
+    geocoding_failed_source = "api-adresse-failed" # Source of the communes whose geocoding request failed (not stored, retried at the next run)
 
     def __init__(self, geo_config):
         self.logger = logging.getLogger(__name__)
-        # Load the data only once during the instance initialization
-        data_folder = Path(get_project_base_path()) / "data" / "communities" / "scrapped_data" / "geoloc"
-        reg_dep_geoloc_filename = "dep_reg_centers.csv" # TODO: To add to config
+        self.geo_config = geo_config
+        self.geocode_store = GeocodeStore(
+            Path(get_project_base_path()) / geo_config.get("geocode_store", "data/communities/geocode_store.sqlite"),
+            geo_config.get("not_found_retry_ttl", 7 * 24 * 3600),
+        )
+        self._reference_tables_loaded = False
+
+    # Internal function to load & index the reference tables, only once and only when a lookup needs them
+    def _load_reference_tables(self):
+        if self._reference_tables_loaded:
+            return
+        geo_config = self.geo_config
+        data_folder = Path(get_project_base_path()) / geo_config.get("geoloc_folder", "data/communities/scrapped_data/geoloc")
+        reg_dep_geoloc_filename = geo_config.get("reg_dep_centers_filename", "dep_reg_centers.csv")
         reg_dep_geoloc_df = pd.read_csv(data_folder / reg_dep_geoloc_filename, sep=';') # TODO: Use CSVLoader
         if reg_dep_geoloc_df.empty:
-            self.reg_dep_geoloc_df = None
+            self.reg_dep_index = None
         else:
             reg_dep_geoloc_df['cog'] = reg_dep_geoloc_df['cog'].astype(str)
-            self.reg_dep_geoloc_df = reg_dep_geoloc_df
-
-        epci_coord_loader = CSVLoader(geo_config["epci_coord_url"])
-        self.epci_coord_df = epci_coord_loader.load()
-
-        communes_coord_loader = CSVLoader(geo_config["communes_id_url"])
-        self.communes_df = communes_coord_loader.load()
-    
-    # Internal function to get the coordinates of a commune based on its name and COG
-    # TODO: Refactor using loader
-    def _get_commune_coordinates(self, city_name, city_code):
-        # Retrieve the coordinates via the API from https://adresse.data.gouv.fr/api-doc/adresse, using the INSEE code (COG)
-        formatted_city_name = city_name.replace(" ", "+")
-        url = f"https://api-adresse.data.gouv.fr/search/?q={formatted_city_name}code={city_code}&type=municipality"
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            if data['features']:
-                coordinates = data['features'][0]['geometry']['coordinates']
-                self.logger.info(f"Les coordonnées de {city_name} sont {coordinates[0]}, {coordinates[1]}")
-                return coordinates[0], coordinates[1] # longitude, latitude
-        self.logger.warning(f"Les coordonnées de {city_name} ne sont pas trouvées")
-        return None, None
-
-    # Internal function to get the coordinates of a region or department based on its COG and type
-    def _get_region_department_coordinates(self, cog, type):
-        if self.reg_dep_geoloc_df is not None:
-            reg_dep_geoloc = self.reg_dep_geoloc_df.copy()
-            # Convert cog to string
-            cog = str(cog)
-            
-            # Get latitude and longitude based on cog & type
-            reg_dep_geoloc = reg_dep_geoloc.loc[(reg_dep_geoloc['cog'] == cog) & (reg_dep_geoloc['type'] == type)]
-            if not reg_dep_geoloc.empty:
-                self.logger.info(f"Les coordonnées de {reg_dep_geoloc['nom'].values[0]} sont {reg_dep_geoloc['latitude'].values[0]}, {reg_dep_geoloc['longitude'].values[0]}")
-                return reg_dep_geoloc['longitude'].values[0], reg_dep_geoloc['latitude'].values[0]
-            else:
-                self.logger.warning(f"Les coordonnées de {cog} de type {type} ne sont pas trouvées")
-                return None, None
+            self.reg_dep_index = _build_coordinates_index(reg_dep_geoloc_df, ['type', 'cog'])
+
+        communes_geoloc_df = self._load_communes_centers(data_folder / geo_config.get("communes_centers_filename", "communes_centers.csv"))
+        self.communes_geoloc_index = _build_coordinates_index(communes_geoloc_df, 'cog')
+
+        # EPCI SIREN -> seat commune SIREN, via https://www.data.gouv.fr/fr/datasets/base-nationale-sur-les-intercommunalites/ (coordonnees-epci-fp-janv2023-last.xlsx)
+        epci_coord_df = CSVLoader(geo_config["epci_coord_url"]).load()
+        self.epci_seat_index = pd.Series(
+            epci_coord_df['Commune siège'].astype(str).str.extract(r'(\d+)', expand=False).values,
+            index=_normalize_code(epci_coord_df['N° SIREN']),
+        )
+        self.epci_seat_index = self.epci_seat_index[~self.epci_seat_index.index.duplicated()]
+
+        # Commune SIREN -> nom, cog, via https://www.data.gouv.fr/en/datasets/identifiants-des-collectivites-territoriales-et-leurs-etablissements/ (identifiants-communes-2022.csv)
+        communes_df = CSVLoader(geo_config["communes_id_url"]).load()
+        self.communes_siren_index = pd.DataFrame(
+            {'nom': communes_df['nom'].values, 'cog': _normalize_code(communes_df['COG'], 5).values},
+            index=_normalize_code(communes_df['SIREN']),
+        )
+        self.communes_siren_index = self.communes_siren_index[~self.communes_siren_index.index.duplicated()]
+        self._reference_tables_loaded = True
+
+    # Internal function to load the centers of the communes (same format as the regions & departments file: type;cog;nom;longitude;latitude)
+    # The file is built once from geo.api.gouv.fr when it does not exist yet
+    def _load_communes_centers(self, communes_centers_file):
+        if not communes_centers_file.exists():
+            communes_centers_url = self.geo_config.get("communes_centers_url")
+            communes = JSONLoader(communes_centers_url).load() if communes_centers_url else None
+            if communes is None or communes.empty:
+                self.logger.warning(f"Le fichier des centres des communes n'est pas trouvé : {communes_centers_file}, les communes seront géocodées via l'API")
+                return pd.DataFrame(columns=['type', 'cog', 'nom', 'longitude', 'latitude'])
+            centers = communes['centre'].map(lambda centre: centre['coordinates'] if isinstance(centre, dict) else [None, None])
+            communes_centers = pd.DataFrame({
+                'type': 'COM',
+                'cog': communes['code'],
+                'nom': communes['nom'],
+                'longitude': centers.str[0],
+                'latitude': centers.str[1],
+            })
+            communes_centers_file.parent.mkdir(parents=True, exist_ok=True)
+            communes_centers.to_csv(communes_centers_file, sep=';', index=False)
+            self.logger.info(f"Le fichier des centres des communes a été enregistré : {communes_centers_file}")
+
+        communes_centers = pd.read_csv(communes_centers_file, sep=';', dtype={'cog': str})
+        communes_centers['cog'] = _normalize_code(communes_centers['cog'], 5)
+        return communes_centers
+
+    # Internal function to geocode communes (DataFrame with 'nom' & 'cog' columns) in batches via https://adresse.data.gouv.fr/api-doc/adresse
+    # Returns the coordinates of the communes found, indexed by cog, and the cogs of the communes whose batch failed (not answered by the API)
+    def _geocode_communes(self, communes):
+        url = self.geo_config.get("geocoding_api_url", "https://api-adresse.data.gouv.fr/search/csv/")
+        batch_size = self.geo_config.get("geocoding_batch_size", 5000)
+        geocoded_batches = []
+        failed_cogs = []
+        for start in range(0, len(communes), batch_size):
+            batch = communes.iloc[start:start + batch_size][['nom', 'cog']]
+            try:
+                response = SessionManager.post(
+                    url,
+                    files={"data": ("communes.csv", batch.to_csv(index=False))},
+                    data={"columns": "nom", "citycode": "cog", "result_columns": ["longitude", "latitude", "result_type"]},
+                )
+            except requests.exceptions.RequestException as e:
+                self.logger.error(f"RequestException: {e}")
+                failed_cogs.extend(batch['cog'])
+                continue
+            if response.status_code != 200:
+                self.logger.error(f"Échec du géocodage de {len(batch)} communes via l'API : {response.status_code}")
+                failed_cogs.extend(batch['cog'])
+                continue
+            geocoded = pd.read_csv(StringIO(response.text), dtype=str)
+            geocoded = geocoded[geocoded['result_type'] == 'municipality']
+            geocoded_batches.append(geocoded[['cog', 'longitude', 'latitude']])
+        if geocoded_batches:
+            geocoded_index = _build_coordinates_index(pd.concat(geocoded_batches, ignore_index=True), 'cog')
         else:
+            geocoded_index = pd.DataFrame(columns=['longitude', 'latitude'], dtype=float)
+        self.logger.info(
+            f"{len(geocoded_index)} communes sur {len(communes)} géocodées via l'API en {-(-len(communes) // batch_size)} requêtes"
+            f" ({len(failed_cogs)} communes non géocodées suite à l'échec des requêtes)"
+        )
+        return geocoded_index, failed_cogs
+
+    # Batch lookup of the coordinates of regions & departments, based on their types & COG
+    # Returns the 'longitude', 'latitude' & 'source' of each key
+    def get_region_department_coordinates(self, types, cogs):
+        self._load_reference_tables()
+        keys = pd.MultiIndex.from_arrays([pd.Series(types, dtype=object).values, pd.Series(cogs).astype(str).values])
+        if self.reg_dep_index is None:
             self.logger.warning("Le fichier CSV des coordonnées des régions et départements n'est pas trouvé")
-            return None, None
-
-    # Internal function to get the coordinates of an EPCI based on its SIREN
-    def _get_epci_coordinates(self, siren):
-        # Coordinates are retrieved in 3 steps:
-        # 1. siren epci -> siren commune siège via https://www.data.gouv.fr/fr/datasets/base-nationale-sur-les-intercommunalites/ (coordonnees-epci-fp-janv2023-last.xlsx) 
-        commune_siege_siren = self.epci_coord_df[self.epci_coord_df['N° SIREN'] == siren]['Commune siège'].str.extract('(\d+)').iloc[0, 0]
-
-        # 2. siren commune-> nom, cog commune via https://www.data.gouv.fr/en/datasets/identifiants-des-collectivites-territoriales-et-leurs-etablissements/ (identifiants-communes-2022.csv)
-        communes_df = self.communes_df.copy()
-        
-        # Cast commune_siege_siren and communes_df 'SIREN' to string
-        commune_siege_siren = str(commune_siege_siren)
-        communes_df['SIREN'] = communes_df['SIREN'].astype(str)
-
-        # extract nom, cog commune safely
-        commune_info_df = communes_df[communes_df['SIREN'] == commune_siege_siren][['nom', 'COG']]
-        if commune_info_df.empty:
-            self.logger.warning(f"Les coordonnées pour l'EPCI {siren} de la commune siège {commune_siege_siren} ne sont pas trouvées")
-            return None, None
-        commune_info = communes_df[communes_df['SIREN'] == commune_siege_siren][['nom', 'COG']].iloc[0]
-
-        # 3. nom, cog commune -> commune coordinates via https://adresse.data.gouv.fr/api-doc/adresse using internal function _get_commune_coordinates
-        if not commune_info.empty:
-            coordinates = self._get_commune_coordinates(commune_info['nom'], commune_info['COG'])
-            if coordinates:
-                self.logger.info(f"Les coordonnées de l'EPCI {siren} sont celle de la commune siège {commune_siege_siren} : {coordinates[0]}, {coordinates[1]}")
-                return coordinates[0], coordinates[1] # longitude, latitude
-            else:
-                self.logger.warning(f"Les coordonnées de l'EPCI {siren} de la commune siège {commune_siege_siren} ne sont pas trouvées")
-                return None, None
-    
+            coordinates = pd.DataFrame(index=range(len(keys)), columns=['longitude', 'latitude'], dtype=float)
+        else:
+            coordinates = self.reg_dep_index.reindex(keys).reset_index(drop=True)
+        coordinates['source'] = np.where(coordinates['longitude'].notna(), 'reg_dep_centers', None)
+        return coordinates
+
+    # Batch lookup of the coordinates of communes, based on their COG
+    # With their names, the communes missing from the reference file are geocoded remotely
+    # Returns the 'longitude', 'latitude' & 'source' of each key (geocoding_failed_source for the communes whose geocoding request failed)
+    def get_commune_coordinates(self, cogs, noms=None):
+        self._load_reference_tables()
+        cogs = _normalize_code(pd.Series(cogs, dtype=object), 5)
+        coordinates = self.communes_geoloc_index.reindex(cogs.values).reset_index(drop=True)
+        coordinates['source'] = np.where(coordinates['longitude'].notna(), 'communes_centers', None)
+
+        is_missing = coordinates['longitude'].isna().values & cogs.notna().values
+        if noms is not None and is_missing.any():
+            missing_communes = pd.DataFrame({'nom': pd.Series(noms, dtype=object).values[is_missing], 'cog': cogs.values[is_missing]})
+            geocoded_index, failed_cogs = self._geocode_communes(missing_communes.drop_duplicates(subset='cog'))
+            geocoded = geocoded_index.reindex(missing_communes['cog'])
+            is_failed = missing_communes['cog'].isin(failed_cogs).values
+            coordinates.loc[is_missing, ['longitude', 'latitude']] = geocoded.values
+            coordinates.loc[is_missing, 'source'] = np.where(
+                geocoded['longitude'].notna(), 'api-adresse', np.where(is_failed, self.geocoding_failed_source, None)
+            )
+        return coordinates
+
+    # Batch lookup of the seat communes (nom, cog) of EPCI, based on their SIREN
+    def get_epci_seat_communes(self, sirens):
+        self._load_reference_tables()
+        seat_sirens = self.epci_seat_index.reindex(_normalize_code(pd.Series(sirens, dtype=object)).values)
+        return self.communes_siren_index.reindex(seat_sirens.values).reset_index(drop=True)
+
+    # Batch lookup of the coordinates of EPCI (coordinates of their seat commune), based on their SIREN
+    def get_epci_coordinates(self, sirens):
+        seat_communes = self.get_epci_seat_communes(sirens)
+        return self.get_commune_coordinates(seat_communes['cog'], seat_communes['nom'])
+
     # Function to add geocoordinates to a DataFrame containing regions, departments, EPCI, and communes
+    # The entities already resolved in the geocode store are not geocoded again, the others are resolved & stored
     def add_geocoordinates(self, data_frame):
-        # Loop through the DataFrame and enrich it with coordinates
-        # TODO: Refactor to process all regions and departments first, then all communes, then all EPCI (as they are copies of communes' coordinates)
-        for index, row in data_frame.iterrows():
-            if row['type'] in ['COM']:
-                coordinates = self._get_commune_coordinates(row['nom'], row['cog'])
-            elif row['type'] in ['REG', 'DEP', 'CTU']:
-                coordinates = self._get_region_department_coordinates(row['cog'], row['type'])
-            else:
-                if row['siren']:
-                    coordinates = self._get_epci_coordinates(row['siren'])
-                else:
-                    coordinates = None, None
-                    self.logger.warning(f"Le SIREN de l'EPCI {row['nom']} n'est pas trouvé")
-            
-            # Set the coordinates in the DataFrame
-            if coordinates:
-                data_frame.at[index, 'longitude'] = float(str(coordinates[0]).replace(',', '.').replace('None', '')) if coordinates[0] not in [None, 'None'] else None
-                data_frame.at[index, 'latitude'] = float(str(coordinates[1]).replace(',', '.').replace('None', '')) if coordinates[1] not in [None, 'None'] else None
-            else:
-                # If no coordinates are found, set the values to None
-                data_frame.at[index, 'longitude'] = None
-                data_frame.at[index, 'latitude'] = None
-
-        return data_frame
\ No newline at end of file
+        # Key of each entity in the geocode store: (type, SIREN) for EPCI, (type, COG) for the others
+        is_reg_dep = data_frame['type'].isin(['REG', 'DEP', 'CTU'])
+        is_com = data_frame['type'] == 'COM'
+        is_epci = ~(is_reg_dep | is_com)
+        has_siren = data_frame['siren'].notna() & (data_frame['siren'].astype(str) != '0')
+        for nom in data_frame.loc[is_epci & ~has_siren, 'nom']:
+            self.logger.warning(f"Le SIREN de l'EPCI {nom} n'est pas trouvé")
+        codes = data_frame['cog'].astype(str).where(data_frame['cog'].notna())
+        codes[is_com] = _normalize_code(data_frame.loc[is_com, 'cog'], 5)
+        codes[is_epci] = _normalize_code(data_frame.loc[is_epci, 'siren']).where(has_siren[is_epci])
+
+        stored = self.geocode_store.get(data_frame['type'], codes)
+        stored.index = data_frame.index
+        coordinates = stored[['longitude', 'latitude']].astype(float)
+
+        to_resolve = ~stored['resolved'] & codes.notna()
+        self.logger.info(f"{(~to_resolve).sum()} collectivités sur {len(data_frame)} déjà géocodées dans le cache, {to_resolve.sum()} à géocoder")
+        if to_resolve.any():
+            resolved = self._resolve_coordinates(data_frame.loc[to_resolve], is_reg_dep[to_resolve], is_com[to_resolve])
+            coordinates.loc[to_resolve] = resolved[['longitude', 'latitude']]
+            # The entities whose geocoding request failed are not stored (not even as "not found"): they are geocoded again at the next run
+            is_failed = resolved['source'] == self.geocoding_failed_source
+            if is_failed.any():
+                self.logger.warning(f"{is_failed.sum()} collectivités non géocodées suite à l'échec des requêtes, elles ne sont pas enregistrées")
+            entries = pd.DataFrame({'type': data_frame.loc[to_resolve, 'type'], 'code': codes[to_resolve]}).join(resolved)
+            self.geocode_store.put(entries[~is_failed])
+
+        not_found = coordinates['longitude'].isna() | coordinates['latitude'].isna()
+        self.logger.info(f"Coordonnées trouvées pour {(~not_found).sum()} collectivités sur {len(data_frame)}")
+        for _, row in data_frame.loc[not_found, ['nom', 'type']].iterrows():
+            self.logger.warning(f"Les coordonnées de {row['nom']} ({row['type']}) ne sont pas trouvées")
+
+        # Set the coordinates in the DataFrame
+        data_frame['longitude'] = coordinates['longitude']
+        data_frame['latitude'] = coordinates['latitude']
+        return data_frame
+
+    # Internal function to resolve the coordinates (& their source) of regions, departments, EPCI, and communes from the reference tables
+    def _resolve_coordinates(self, data_frame, is_reg_dep, is_com):
+        coordinates = pd.DataFrame(index=data_frame.index, columns=['longitude', 'latitude'], dtype=float)
+        coordinates['source'] = None
+
+        # Regions & departments: centers from the reference file, on (type, cog)
+        if is_reg_dep.any():
+            coordinates.loc[is_reg_dep] = self.get_region_department_coordinates(data_frame.loc[is_reg_dep, 'type'], data_frame.loc[is_reg_dep, 'cog']).values
+
+        # Communes & EPCI (located at their seat commune): centers of the communes, on cog
+        # EPCI seat communes are looked up first, so that all the communes missing from the reference file are geocoded together
+        is_epci = ~(is_reg_dep | is_com)
+        seat_communes = self.get_epci_seat_communes(data_frame.loc[is_epci, 'siren'])
+        is_com_or_epci = is_com | is_epci
+        if is_com_or_epci.any():
+            communes = pd.concat([
+                pd.DataFrame({'nom': data_frame.loc[is_com, 'nom'].values, 'cog': data_frame.loc[is_com, 'cog'].values}, index=data_frame.index[is_com]),
+                seat_communes.set_index(data_frame.index[is_epci]),
+            ]).loc[data_frame.index[is_com_or_epci]]
+            coordinates.loc[is_com_or_epci] = self.get_commune_coordinates(communes['cog'], communes['nom']).values
+        return coordinates.astype({'longitude': float, 'latitude': float})
+
+# Internal function to normalize codes (SIREN, COG) read as numbers or strings, optionally zero-padded to a width (missing codes stay NaN)
+def _normalize_code(codes, width=0):
+    normalized_codes = codes.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    if width:
+        normalized_codes = normalized_codes.str.zfill(width)
+    return normalized_codes.where(codes.notna())
+
+# Internal function to convert coordinates with French (',') or English ('.') decimal separators to float
+def _to_float(values):
+    return pd.to_numeric(values.astype(str).str.replace(',', '.'), errors='coerce')
+
+# Internal function to index the coordinates of a reference DataFrame on its keys (first occurrence of each key kept)
+def _build_coordinates_index(reference_df, keys):
+    coordinates_index = reference_df.set_index(keys)[['longitude', 'latitude']].apply(_to_float)
+    return coordinates_index[~coordinates_index.index.duplicated()]
@@ -1,3 +1,7 @@
+import io
+import json
+import itertools
+import numpy as np
 import pandas as pd
 import logging
 from tqdm import tqdm
@@ -16,6 +20,12 @@ This script contains functions to flatten JSON data and JSON schema.
     - The data can contain objects, arrays of objects, and simple properties.
     - The flattening process involves prefixing the keys with the parent keys and numbering the keys for arrays of objects.
     - The flattening can be recursive for nested objects and arrays of objects, until the data is fully flattened.
+    - The data can be any iterable of rows (e.g. streamed with iter_json_array), it is flattened by batches.
+    - A SchemaFlattener, compiled once from a flattened schema, fills the schema columns directly instead of building a dict per row.
+
+3 - Streaming JSON data overview:
+    - Iterate over the items of the root array of a JSON document, read incrementally from a file.
+    - Only the current item (and a bounded read buffer) is held in memory, not the whole JSON tree.
 
 '''
 
@@ -119,15 +129,227 @@ def _flatten_row(row, exclude_prefix=None):
             flattened_row[key] = value
     return flattened_row
 
+# Function to flatten JSON data by batches, yielding one DataFrame per batch of chunk_size rows
+# With a SchemaFlattener, only the schema columns are produced
+def iter_flattened_chunks(data, chunk_size=10000, flattener=None):
+    rows = iter(data)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        if flattener is not None:
+            yield flattener.flatten(chunk)
+        else:
+            processed_chunk = [_flatten_row(row) for row in tqdm(chunk) if row is not None]
+            yield pd.DataFrame(processed_chunk)
+
 # Function to flatten JSON data - can be used in the workflow
 def flatten_data(data, chunk_size=10000):
-    chunks = []
-    for i in range(0, len(data), chunk_size):
-        chunk = data[i:i + chunk_size]
-        processed_chunk = [_flatten_row(row) for row in tqdm(chunk) if row is not None]
-        df_chunk = pd.DataFrame(processed_chunk)
-        chunks.append(df_chunk)
-    print("in")
+    chunks = list(iter_flattened_chunks(data, chunk_size))
     flattened_data = pd.concat(chunks, ignore_index=True)
-    print("out")
     return flattened_data, pd.DataFrame()
+
+# Internal class used to represent a key of the schema tree compiled by SchemaFlattener
+class _SchemaNode:
+    __slots__ = ('segments', 'level', 'children', 'is_property')
+
+    def __init__(self, segments):
+        self.segments = segments # Keys from the root to this node
+        self.level = len(segments) - 1
+        self.children = {}
+        self.is_property = False
+
+# Marker of a key missing from a row (None is a valid JSON value)
+_MISSING = object()
+_EMPTY_OBJECT = {}
+
+class SchemaFlattener:
+    '''
+    Flattener compiled once from the output of flatten_json_schema.
+    The schema properties are arranged in a tree of keys, walked column by column over a whole batch of rows:
+    scalar properties and nested objects are extracted with one list comprehension per schema key,
+    only the keys holding arrays (or unexpected shapes) are walked row by row.
+    Values are appended to per-column lists, instead of building a flattened dict (and its key strings) per row.
+    The column names, numbered for arrays of objects (up to max_array_items items), are computed once per path and cached.
+    The output is the same as _flatten_row for the schema columns (values in arrays of objects are wrapped in a list per array level),
+    the columns outside of the schema are not produced.
+    '''
+
+    def __init__(self, flattened_schema, max_array_items=15):
+        self.max_array_items = max_array_items
+        self.root = _SchemaNode([])
+        self.column_names = {}
+        for flattened_property in flattened_schema:
+            node = self.root
+            for key in flattened_property['property'].split('.'):
+                if key not in node.children:
+                    node.children[key] = _SchemaNode(node.segments + [key])
+                node = node.children[key]
+            node.is_property = True
+
+    # Function to flatten a list of rows to a DataFrame with the schema columns
+    def flatten(self, rows):
+        rows = [row for row in rows if row is not None]
+        # columns: column key -> (None, values of every row) for dense columns, (row numbers, values) for sparse columns
+        # Column keys are the node for the properties outside of arrays of objects, (node, indices) otherwise
+        columns = {}
+        self._flatten_columns(self.root, rows, (), 0, columns)
+
+        # Missing values are NaN, then the columns are inferred like pd.DataFrame does from a list of dicts
+        flattened_columns = {}
+        for column_key, (row_numbers, values) in columns.items():
+            # np.fromiter keeps the (list) values as objects, where np.array would build nested arrays
+            column_values = np.fromiter(values, dtype=object, count=len(values))
+            if row_numbers is None:
+                column_values[np.fromiter((value is _MISSING for value in values), dtype=bool, count=len(values))] = np.nan
+            else:
+                column = np.full(len(rows), np.nan, dtype=object)
+                column[row_numbers] = column_values
+                column_values = column
+            flattened_columns[self._get_column_name(column_key)] = column_values
+        flattened_data = pd.DataFrame(flattened_columns, index=pd.RangeIndex(len(rows)), copy=False)
+        return flattened_data.infer_objects()
+
+    # Internal function to flatten the children of a node for a list of objects (one per row, empty if missing)
+    # indices are the (level, number) of the arrays of objects above the node, depth is the number of these arrays
+    def _flatten_columns(self, node, objects, indices, depth, columns):
+        for key, child in node.children.items():
+            values = [obj.get(key, _MISSING) for obj in objects]
+            value_types = set(map(type, values))
+            value_types.discard(object) # type of _MISSING
+            if not value_types:
+                continue
+            if value_types == {dict}:
+                # Nested object in every row
+                self._flatten_columns(child, [_EMPTY_OBJECT if value is _MISSING else value for value in values], indices, depth, columns)
+            elif dict not in value_types and list not in value_types:
+                # Scalar values (a scalar value for an object node is not a schema column)
+                if child.is_property:
+                    self._add_dense_column(child, values, indices, depth, columns)
+            elif value_types == {list}:
+                self._flatten_array_columns(child, values, indices, depth, columns)
+            else:
+                # Mixed shapes: walked row by row
+                for row_number, value in enumerate(values):
+                    if value is not _MISSING:
+                        self._flatten_value(child, value, indices, depth, row_number, columns)
+
+    # Internal function to flatten the list values of a node: arrays of objects are flattened item by item (up to max_array_items)
+    # and numbered, other lists are values of the node
+    def _flatten_array_columns(self, node, values, indices, depth, columns):
+        arrays = [value if (value is not _MISSING and value and isinstance(value[0], dict)) else None for value in values]
+        if node.is_property:
+            scalar_values = [_MISSING if array is not None else value for value, array in zip(values, arrays)]
+            if any(value is not _MISSING for value in scalar_values):
+                self._add_dense_column(node, scalar_values, indices, depth, columns)
+        max_items = min(self.max_array_items, max((len(array) for array in arrays if array is not None), default=0))
+        for i in range(max_items):
+            items = [array[i] if (array is not None and len(array) > i) else None for array in arrays]
+            items = [item if isinstance(item, dict) else _EMPTY_OBJECT for item in items]
+            self._flatten_columns(node, items, indices + ((node.level, i + 1),), depth + 1, columns)
+
+    # Internal function to add a column with a value (or _MISSING) per row, wrapped in a list per array level
+    def _add_dense_column(self, node, values, indices, depth, columns):
+        for _ in range(depth):
+            values = [value if value is _MISSING else [value] for value in values]
+        columns[(node, indices) if indices else node] = (None, values)
+
+    # Internal function to flatten one value of a row along its schema node
+    def _flatten_value(self, node, value, indices, depth, row_number, columns):
+        if isinstance(value, dict):
+            for key, child_value in value.items():
+                child = node.children.get(key)
+                if child is not None:
+                    self._flatten_value(child, child_value, indices, depth, row_number, columns)
+        elif isinstance(value, list) and value and isinstance(value[0], dict):
+            for i, obj in enumerate(value[:self.max_array_items], start=1):
+                if obj is not None:
+                    self._flatten_value(node, obj, indices + ((node.level, i),), depth + 1, row_number, columns)
+        elif node.is_property:
+            for _ in range(depth):
+                value = [value]
+            column_key = (node, indices) if indices else node
+            if column_key not in columns:
+                columns[column_key] = ([], [])
+            columns[column_key][0].append(row_number)
+            columns[column_key][1].append(value)
+
+    # Internal function to get the column name of a column key, numbered after the arrays of objects it belongs to
+    def _get_column_name(self, column_key):
+        node, indices = column_key if isinstance(column_key, tuple) else (column_key, ())
+        if column_key not in self.column_names:
+            segments = list(node.segments)
+            for level, i in reversed(indices):
+                segments.insert(level + 1, str(i))
+            self.column_names[column_key] = '.'.join(segments)
+        return self.column_names[column_key]
+
+# Internal class used to decode JSON values one by one from a text stream, refilling its buffer on demand
+class _JsonStreamReader:
+    def __init__(self, text_stream, read_size):
+        self.text_stream = text_stream
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    # Read more text, dropping the already consumed part of the buffer
+    def _fill(self):
+        text = self.text_stream.read(self.read_size)
+        if not text:
+            self.eof = True
+        self.buffer = self.buffer[self.position:] + text
+        self.position = 0
+
+    def peek(self):
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in " \t\r\n":
+                self.position += 1
+            if self.position < len(self.buffer) or self.eof:
+                return self.buffer[self.position] if self.position < len(self.buffer) else ""
+            self._fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Caractère '{char}' attendu à la position {self.position} du flux JSON")
+        self.position += 1
+
+    def decode_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # A string, object or array ends with its closing character, but a number (or literal) cut by the end of the buffer
+                # may be truncated (e.g. '1.' of '1.5'): it is only accepted once followed by a delimiter
+                if self.buffer[end - 1] in '"]}' or self.eof or (end < len(self.buffer) and self.buffer[end] in ",]} \t\r\n"):
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+# Function to iterate over the items of the 'root' array of a JSON object (or of a top level array if root is None)
+# json_file is a binary file, read by blocks of read_size characters: memory is bounded by the largest item, not by the document
+def iter_json_array(json_file, root=None, read_size=1024 * 1024):
+    reader = _JsonStreamReader(io.TextIOWrapper(json_file, encoding="utf-8-sig"), read_size)
+    if root is not None:
+        # Skip the top level keys until the root key
+        reader.expect("{")
+        while True:
+            if reader.peek() == "}":
+                return
+            key = reader.decode_value()
+            reader.expect(":")
+            if key == root:
+                break
+            reader.decode_value()
+            if reader.peek() == ",":
+                reader.expect(",")
+
+    reader.expect("[")
+    while reader.peek() != "]":
+        yield reader.decode_value()
+        if reader.peek() == ",":
+            reader.expect(",")
@@ -0,0 +1,72 @@
+import re
+
+import numpy as np
+import pandas as pd
+import unidecode
+
+# Transliteration of the Latin-1 & Latin Extended characters (accented letters), applied with str.translate
+_LATIN_TO_ASCII = str.maketrans({chr(code_point): unidecode.unidecode(chr(code_point)) for code_point in range(0x80, 0x250)})
+
+# Function to fold a text for keyword matching: accents removed (transliterated to ASCII) and lowercased
+# The accented letters are translated with a table, unidecode only handles the remaining non ASCII characters
+def fold_text(text):
+    if not text.isascii():
+        text = text.translate(_LATIN_TO_ASCII)
+        if not text.isascii():
+            text = unidecode.unidecode(text)
+    return text.lower()
+
+# Function to fold a regex pattern: accents removed only, as lowercasing would change its escapes (e.g. \S into \s)
+# The case is ignored by the compiled regex (re.IGNORECASE)
+def fold_pattern(pattern):
+    return pattern if pattern.isascii() else unidecode.unidecode(pattern)
+
+class KeywordMatcher:
+    '''
+    KeywordMatcher matches a set of keywords (literal words or regexes) against texts, accents and case being ignored.
+    The keywords are compiled once into a single regex: a text is scanned in one pass, whatever the number of keywords.
+    Keywords are given as a list of patterns or a single pattern, e.g. the 'title_filter' regex of a search config or its 'api' words lists.
+    Whole columns are matched by their unique values; single texts (e.g. streamed API results) with search().
+    '''
+
+    def __init__(self, keywords, regex=True):
+        if isinstance(keywords, str):
+            keywords = [keywords]
+        self.keywords = list(keywords)
+        patterns = [fold_pattern(pattern) if regex else re.escape(fold_text(pattern)) for pattern in self.keywords]
+        # An empty alternation would match everything: without keywords, nothing matches
+        self.combined_pattern = re.compile("|".join(f"(?:{pattern})" for pattern in patterns) or r"(?!)", re.IGNORECASE)
+        # Literal words are searched as substrings of the folded text, faster than the regex for a few words
+        self.literals = None if regex else [fold_text(keyword) for keyword in self.keywords]
+
+    # Function to check if a text matches any keyword (non string values never match)
+    def search(self, text):
+        if not isinstance(text, str):
+            return False
+        if self.literals is not None:
+            # The literals are ASCII: one found in the lowercased text is also in the folded text, which is only built
+            # for the non ASCII texts not matched yet (e.g. a keyword written with an accent in the text)
+            lowered_text = text.lower()
+            for literal in self.literals:
+                if literal in lowered_text:
+                    return True
+            if text.isascii():
+                return False
+            folded_text = fold_text(text)
+            for literal in self.literals:
+                if literal in folded_text:
+                    return True
+            return False
+        return self.combined_pattern.search(fold_text(text)) is not None
+
+    # Function to get the boolean mask of the values of a column matching any keyword
+    def mask(self, column):
+        codes, uniques = pd.factorize(column)
+        return pd.Series(_take(self._match_uniques(uniques), codes), index=column.index)
+
+    def _match_uniques(self, uniques):
+        return np.fromiter((self.search(value) for value in uniques), dtype=bool, count=len(uniques))
+
+# Internal function to map the results of the unique values back to the values, null values (code -1) never match
+def _take(unique_results, codes):
+    return np.append(unique_results, False)[codes]
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+class ParquetCache:
+    '''
+    Typed columnar cache of a processed DataFrame, stored as a Parquet file (read memory-mapped).
+    The file metadata records the source of the data (URLs, source files with their size & modification time, dtypes...)
+    and the dtypes of the columns: the cache is invalid, and has to be rebuilt, as soon as its source changes.
+    '''
+    metadata_key = b"localouvert"
+
+    def __init__(self, cache_file, source):
+        self.logger = logging.getLogger(__name__)
+        self.cache_file = Path(cache_file)
+        self.source = source
+        self.source_fingerprint = hashlib.sha256(json.dumps(source, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    # Function to load the cached DataFrame, returns None if there is no valid cache for the source
+    # filters (pyarrow filters, e.g. [("organization_id", "in", ids)]) are pushed down: row groups whose statistics exclude them are skipped
+    def load(self, filters=None):
+        metadata = self._read_metadata()
+        if metadata is None:
+            return None
+        if metadata.get("source_fingerprint") != self.source_fingerprint:
+            self.logger.info(f"La source du cache a changé, il sera reconstruit : {self.cache_file}")
+            return None
+        return pd.read_parquet(self.cache_file, memory_map=True, filters=filters)
+
+    # Function to get the source recorded in the cache, returns None if there is no readable cache
+    def stored_source(self):
+        metadata = self._read_metadata()
+        return None if metadata is None else metadata.get("source")
+
+    def _read_metadata(self):
+        if not self.cache_file.exists():
+            return None
+        try:
+            schema_metadata = pq.read_schema(self.cache_file).metadata or {}
+            return json.loads(schema_metadata.get(self.metadata_key, b"{}"))
+        except (pa.ArrowException, OSError, json.JSONDecodeError) as e:
+            self.logger.warning(f"Cache illisible, il sera reconstruit : {self.cache_file} ({e})")
+            return None
+
+    # Function to save a DataFrame to the cache, with the source & dtypes metadata
+    # Returns the DataFrame as stored, i.e. as it will be loaded from the cache
+    def save(self, df, row_group_size=None):
+        df = _to_arrow_compatible(df)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = {
+            "source": self.source,
+            "source_fingerprint": self.source_fingerprint,
+            "dtypes": {str(col): str(dtype) for col, dtype in df.dtypes.items()},
+            "saved_at": time.time(),
+        }
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), self.metadata_key: json.dumps(metadata, default=str)})
+
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.cache_file.with_suffix(".tmp")
+        pq.write_table(table, tmp_file, row_group_size=row_group_size)
+        os.replace(tmp_file, self.cache_file)
+        self.logger.info(f"Le cache {self.cache_file.name} a été enregistré dans le répertoire {self.cache_file.parent}")
+        return df
+
+    # Function to describe a source file for the cache metadata: its modification invalidates the cache
+    @staticmethod
+    def file_source(file_path):
+        file_path = Path(file_path)
+        if not file_path.exists():
+            return {"path": str(file_path)}
+        stat = file_path.stat()
+        return {"path": str(file_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+# Internal function to make the object columns storable by Arrow: columns mixing several types (e.g. codes read as int & str) are stored as strings
+def _to_arrow_compatible(df):
+    df = df.reset_index(drop=True)
+    for col in df.columns[df.dtypes == object]:
+        non_null_values = df[col].dropna()
+        if non_null_values.map(type).nunique() > 1:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
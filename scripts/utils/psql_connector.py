@@ -1,27 +1,50 @@
+import csv
+import io
 import logging
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, text
 import os
 from dotenv import load_dotenv
 
+from scripts.utils.files_operation import normalize_column_names
+
 load_dotenv()  # Charge les variables d'environnement à partir du fichier .env
 
 class PSQLConnector:
-    def __init__(self):
+    '''
+    PSQLConnector saves DataFrames to the PostgreSQL database defined by the DB_* environment variables.
+    save_dfs_bulk() is the bulk path: each DataFrame is streamed with COPY FROM STDIN (CSV, by chunks from an in-memory buffer)
+    into a staging table, swapped with the target table in the same transaction, several tables being loaded concurrently.
+    In incremental mode, tables with natural keys are upserted instead: rows are hashed, only the new or changed rows
+    are copied to a staging table and merged with INSERT ... ON CONFLICT, rows that disappeared are kept as tombstones (deleted_at).
+    save_df_to_sql() is the former to_sql path (multi-row INSERTs).
+    '''
+    copy_chunksize = 100000 # Number of rows serialized in the in-memory buffer per COPY
+    null_string = r'\N'
+    # Technical columns of the incrementally saved tables
+    key_column = "_row_key" # Hash of the natural key columns (primary key)
+    hash_column = "_row_hash" # Hash of the whole row, to detect changed rows
+    deleted_column = "_deleted_at" # Tombstone: set when the row disappeared from the data
+    updated_column = "_updated_at"
+
+    def __init__(self, pool_size=4):
         self.logger = logging.getLogger(__name__)
         self.dbname = os.getenv("DB_NAME")
         self.user = os.getenv("DB_USER")
         self.password = os.getenv("DB_PASSWORD")
         self.host = os.getenv("DB_HOST")
         self.port = os.getenv("DB_PORT")
+        self.pool_size = pool_size
 
     def connect(self):
-        self.engine = create_engine(f'postgresql://{self.user}:{self.password}@{self.host}:{self.port}/{self.dbname}')
+        self.engine = create_engine(f'postgresql://{self.user}:{self.password}@{self.host}:{self.port}/{self.dbname}', pool_size=self.pool_size)
 
     def drop_table_if_exists(self, table_name):
         try:
-            with self.engine.connect() as conn:
-                conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+            with self.engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE IF EXISTS {quote_identifier(table_name)}"))
                 self.logger.info(f"Table {table_name} dropped successfully.")
         except Exception as e:
             self.logger.error(f"An error occurred while dropping the table: {e}")
@@ -32,4 +55,157 @@ class PSQLConnector:
             df.to_sql(table_name, self.engine, if_exists=if_exists, index=index, chunksize=chunksize)
             self.logger.info("Dataframe saved successfully to the database "+table_name+'.')
         except Exception as e:
-            self.logger.error(f"An error occurred: {e}")
\ No newline at end of file
+            self.logger.error(f"An error occurred: {e}")
+
+    # Function to bulk save several DataFrames ({table_name: df}), concurrently over the pooled connections
+    # The tables with natural keys in incremental_keys ({table_name: [key columns]}) are upserted, the others are replaced
+    # All the tables are attempted, then a RuntimeError is raised if any of them failed (so that the save is not checkpointed as done)
+    def save_dfs_bulk(self, dfs, max_workers=None, incremental_keys=None):
+        incremental_keys = incremental_keys or {}
+        max_workers = min(max_workers or self.pool_size, self.pool_size)
+        def save(table_name, df):
+            if table_name in incremental_keys:
+                self.upsert_df(df, table_name, incremental_keys[table_name])
+            else:
+                self.bulk_save_df(df, table_name)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {table_name: executor.submit(save, table_name, df) for table_name, df in dfs.items()}
+        failed_tables = [table_name for table_name, future in futures.items() if future.exception() is not None]
+        if failed_tables:
+            raise RuntimeError(f"Failed to save the tables {failed_tables} to the database.") from futures[failed_tables[0]].exception()
+
+    # Function to bulk save a DataFrame: COPY into a staging table, then swap it with the table, in a single transaction
+    # Until the commit, readers see the previous table; on error, the previous table is kept
+    def bulk_save_df(self, df, table_name):
+        try:
+            with self.engine.begin() as conn:
+                self._replace_table(conn, df, table_name)
+            self.logger.info(f"Dataframe saved successfully to the database {table_name} ({len(df)} rows, COPY).")
+        except Exception as e:
+            self.logger.error(f"An error occurred while saving {table_name}: {e}")
+            raise
+
+    # Function to incrementally save a DataFrame, identified by its natural key columns (e.g. siren & id)
+    # Only the new or changed rows are written, the rows absent from the DataFrame are marked as deleted (tombstones)
+    # The table is fully rebuilt when it has no incremental columns yet, or when its columns changed
+    def upsert_df(self, df, table_name, key_columns):
+        try:
+            df = self._add_row_hashes(df, key_columns, table_name)
+            with self.engine.begin() as conn:
+                table_columns = self._get_table_columns(conn, table_name)
+                if table_columns != list(df.columns) + [self.deleted_column, self.updated_column]:
+                    self.logger.info(f"Table {table_name} (re)built for incremental saves.")
+                    self._replace_table(conn, df, table_name)
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {quote_identifier(table_name)} ADD PRIMARY KEY ({quote_identifier(self.key_column)}), "
+                        f"ADD COLUMN {quote_identifier(self.deleted_column)} TIMESTAMPTZ, "
+                        f"ADD COLUMN {quote_identifier(self.updated_column)} TIMESTAMPTZ NOT NULL DEFAULT now()"
+                    )
+                    self.logger.info(f"Dataframe saved successfully to the database {table_name} ({len(df)} rows, COPY).")
+                    return
+
+                # Compare the row hashes with the stored ones: new, changed & revived rows are upserted, missing rows are deleted
+                stored = pd.read_sql_query(
+                    f"SELECT {quote_identifier(self.key_column)}, {quote_identifier(self.hash_column)}, {quote_identifier(self.deleted_column)} IS NOT NULL AS deleted "
+                    f"FROM {quote_identifier(table_name)}", conn, index_col=self.key_column
+                )
+                # Position of each row in the stored rows (-1 for the new rows, which take the appended placeholder values)
+                positions = stored.index.get_indexer(df[self.key_column])
+                is_new = positions < 0
+                is_changed = np.append(stored[self.hash_column].values, 0)[positions] != df[self.hash_column].values
+                is_revived = np.append(stored["deleted"].values.astype(bool), False)[positions]
+                upserted_rows = df[is_new | is_changed | is_revived]
+                deleted_keys = stored.index[~stored["deleted"] & ~stored.index.isin(df[self.key_column])]
+
+                if len(upserted_rows):
+                    self._merge_rows(conn, upserted_rows, table_name)
+                if len(deleted_keys):
+                    conn.exec_driver_sql(
+                        f"UPDATE {quote_identifier(table_name)} SET {quote_identifier(self.deleted_column)} = now(), {quote_identifier(self.updated_column)} = now() "
+                        f"WHERE {quote_identifier(self.key_column)} = ANY(%s)", ([int(key) for key in deleted_keys],)
+                    )
+            self.logger.info(f"Dataframe saved incrementally to the database {table_name} ({len(upserted_rows)} rows upserted, {len(deleted_keys)} rows deleted, {len(df) - len(upserted_rows)} rows unchanged).")
+        except Exception as e:
+            self.logger.error(f"An error occurred while saving {table_name}: {e}")
+            raise
+
+    # Internal function to replace a table by the DataFrame, within the transaction of the connection: COPY into a staging table, then swap
+    def _replace_table(self, conn, df, table_name):
+        staging_table = f"{table_name}_staging"
+        # The staging table is created by pandas, with the same column types as the to_sql path
+        df.head(0).to_sql(staging_table, conn, if_exists='replace', index=False)
+        self._copy_df(conn, df, staging_table)
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {quote_identifier(table_name)}")
+        conn.exec_driver_sql(f"ALTER TABLE {quote_identifier(staging_table)} RENAME TO {quote_identifier(table_name)}")
+
+    # Internal function to merge rows into a table: COPY into a temporary staging table, then INSERT ... ON CONFLICT on the row key
+    def _merge_rows(self, conn, rows, table_name):
+        staging_table = f"{table_name}_upsert"
+        conn.exec_driver_sql(f"CREATE TEMPORARY TABLE {quote_identifier(staging_table)} (LIKE {quote_identifier(table_name)} INCLUDING DEFAULTS) ON COMMIT DROP")
+        self._copy_df(conn, rows, staging_table)
+        columns = [quote_identifier(str(col)) for col in rows.columns]
+        updates = [f"{col} = EXCLUDED.{col}" for col in columns if col != quote_identifier(self.key_column)]
+        updates += [f"{quote_identifier(self.deleted_column)} = NULL", f"{quote_identifier(self.updated_column)} = now()"]
+        conn.exec_driver_sql(
+            f"INSERT INTO {quote_identifier(table_name)} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {quote_identifier(staging_table)} "
+            f"ON CONFLICT ({quote_identifier(self.key_column)}) DO UPDATE SET {', '.join(updates)}"
+        )
+
+    # Internal function to get the columns of a table, in order (empty list if the table does not exist)
+    def _get_table_columns(self, conn, table_name):
+        columns = pd.read_sql_query(
+            "SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = %(table_name)s ORDER BY ordinal_position",
+            conn, params={"table_name": table_name}
+        )
+        return columns["column_name"].tolist()
+
+    # Internal function to add the row key & row hash columns (64 bits hashes, stored as signed BIGINT)
+    # The key columns are matched on their normalized names (lower case, '.' & '-' replaced by '_'), as the columns of the saved CSV files
+    # Rows sharing a natural key (e.g. communities without SIREN) are all kept: their key also hashes the content of the whole row
+    # (and the rank of the row among its identical copies), so that it does not depend on the other rows of the DataFrame
+    def _add_row_hashes(self, df, key_columns, table_name):
+        df_columns = dict(zip(normalize_column_names(df.columns.astype(str)), df.columns))
+        missing_columns = [col for col in normalize_column_names(key_columns) if col not in df_columns]
+        if missing_columns:
+            raise KeyError(f"The natural key columns {missing_columns} of {table_name} are not in the DataFrame.")
+        key_columns = [df_columns[col] for col in normalize_column_names(key_columns)]
+
+        df = df.copy()
+        row_hashes = pd.util.hash_pandas_object(df, index=False).values
+        row_keys = pd.util.hash_pandas_object(df[key_columns], index=False).values
+        is_shared = df.duplicated(key_columns, keep=False).values
+        if is_shared.any():
+            self.logger.warning(f"{is_shared.sum()} rows of {table_name} share their natural key {key_columns} with another row, they are keyed by their content.")
+            shared_rows = pd.DataFrame({"key": row_keys[is_shared], "hash": row_hashes[is_shared]})
+            shared_rows["copy"] = shared_rows.groupby(["key", "hash"], sort=False).cumcount()
+            row_keys[is_shared] = pd.util.hash_pandas_object(shared_rows, index=False).values
+        df[self.key_column] = row_keys.view('int64')
+        df[self.hash_column] = row_hashes.view('int64')
+        return df
+
+    # Internal function to stream a DataFrame to a table with COPY FROM STDIN, chunk by chunk through an in-memory CSV buffer
+    def _copy_df(self, conn, df, table_name):
+        null_string = self._get_null_string(df)
+        columns = ", ".join(quote_identifier(str(col)) for col in df.columns)
+        copy_sql = f"COPY {quote_identifier(table_name)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{null_string}')"
+        cursor = conn.connection.cursor()
+        try:
+            for start in range(0, len(df), self.copy_chunksize):
+                buffer = io.StringIO()
+                df.iloc[start:start + self.copy_chunksize].to_csv(buffer, index=False, header=False, na_rep=null_string, quoting=csv.QUOTE_MINIMAL)
+                buffer.seek(0)
+                cursor.copy_expert(copy_sql, buffer)
+        finally:
+            cursor.close()
+
+    # Internal function to get a NULL marker which is not a value of the text columns (a string '\N' must not be loaded as NULL)
+    def _get_null_string(self, df):
+        text_columns = df.select_dtypes(include=["object", "string"])
+        null_string = self.null_string
+        while (text_columns == null_string).any().any():
+            null_string += "N"
+        return null_string
+
+# Function to quote a PostgreSQL identifier (table or column name)
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import time
+from pathlib import Path
+
+from scripts.utils.config import get_project_base_path
+
+class CheckpointManager:
+    '''
+    CheckpointManager persists the output of each workflow stage, with a fingerprint of its inputs
+    (config sections and fingerprints of the upstream stages outputs).
+    In resume mode, a stage whose fingerprint is unchanged is not run again: its output is loaded from its checkpoint,
+    so a failed run restarts from the stage that failed.
+    Outputs are fingerprinted too (hash of the checkpoint), so that a recomputed upstream stage invalidates the downstream stages.
+    '''
+    output_format = 2 # Version of the checkpointed outputs, part of the fingerprints: the checkpoints of a former version are not resumed
+
+    def __init__(self, checkpoints_path, resume=False):
+        self.logger = logging.getLogger(__name__)
+        self.checkpoints_folder = Path(get_project_base_path()) / checkpoints_path
+        self.checkpoints_folder.mkdir(parents=True, exist_ok=True)
+        self.resume = resume
+
+    # Function to run a stage, or resume it from its checkpoint
+    # Returns the fingerprint of the stage output and a function returning the output (loaded from the checkpoint only when called)
+    def run(self, stage, inputs, compute):
+        fingerprint = self.fingerprint(inputs)
+        metadata = self._read_metadata(stage)
+        if self.resume and metadata is not None and metadata["fingerprint"] == fingerprint and self._checkpoint_file(stage).exists():
+            self.logger.info(f"Stage {stage} resumed from its checkpoint ({time.ctime(metadata['saved_at'])}).")
+            output_cache = []
+            def get_output():
+                if not output_cache:
+                    output_cache.append(self.load(stage))
+                return output_cache[0]
+            return metadata["output_fingerprint"], get_output
+
+        self.logger.info(f"Running stage {stage}.")
+        output = compute()
+        return self.save(stage, fingerprint, output), lambda: output
+
+    # Function to fingerprint the inputs of a stage (JSON serializable config sections & fingerprints)
+    @staticmethod
+    def fingerprint(inputs):
+        return hashlib.sha256(json.dumps([CheckpointManager.output_format, inputs], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    # Function to fingerprint the content of an input file (e.g. the dictionary of a topic), None if it does not exist
+    @staticmethod
+    def file_fingerprint(file_path):
+        if not os.path.exists(file_path):
+            return None
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    def load(self, stage):
+        with open(self._checkpoint_file(stage), "rb") as f:
+            return pickle.load(f)
+
+    # Function to save the output of a stage with its inputs fingerprint, returns the fingerprint of the output
+    def save(self, stage, fingerprint, output):
+        output_hash = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.checkpoints_folder, delete=False) as tmp_file:
+            pickle.dump(output, _HashingWriter(tmp_file, output_hash), protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file.name, self._checkpoint_file(stage))
+
+        metadata = {"fingerprint": fingerprint, "output_fingerprint": output_hash.hexdigest(), "saved_at": time.time()}
+        tmp_metadata_file = self._metadata_file(stage).with_suffix(".tmp")
+        with open(tmp_metadata_file, "w") as f:
+            json.dump(metadata, f)
+        os.replace(tmp_metadata_file, self._metadata_file(stage))
+        self.logger.info(f"Checkpoint of stage {stage} saved.")
+        return metadata["output_fingerprint"]
+
+    def _read_metadata(self, stage):
+        if not self._metadata_file(stage).exists():
+            return None
+        try:
+            with open(self._metadata_file(stage), "r") as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            self.logger.warning(f"Métadonnées du checkpoint illisibles, l'étape {stage} sera relancée")
+            return None
+
+    def _checkpoint_file(self, stage):
+        return self.checkpoints_folder / f"{stage}.pkl"
+
+    def _metadata_file(self, stage):
+        return self.checkpoints_folder / f"{stage}.json"
+
+# Internal file wrapper hashing the bytes written through it
+class _HashingWriter:
+    def __init__(self, file, hash_object):
+        self.file = file
+        self.hash_object = hash_object
+
+    def write(self, data):
+        self.hash_object.update(data)
+        return self.file.write(data)
@@ -8,83 +8,142 @@ from scripts.datasets.single_urls_builder import SingleUrlsBuilder
 from scripts.datasets.datafiles_loader import DatafilesLoader
 from scripts.datasets.datafile_loader import DatafileLoader
 from scripts.utils.psql_connector import PSQLConnector
+from scripts.workflow.checkpoint_manager import CheckpointManager
 from scripts.utils.config import get_project_base_path
 from scripts.utils.files_operation import save_csv
-from scripts.utils.constants import FILES_IN_SCOPE_FILENAME, NORMALIZED_DATA_FILENAME, DATAFILES_OUT_FILENAME, DATACOLUMNS_OUT_FILENAME, MODIFICATIONS_DATA_FILENAME
+from scripts.utils.constants import FILES_IN_SCOPE_FILENAME, NORMALIZED_DATA_FILENAME, DATAFILES_OUT_FILENAME, DATACOLUMNS_OUT_FILENAME, MODIFICATIONS_DATA_FILENAME, COERCION_REPORT_FILENAME
 
 class WorkflowManager:
+    '''
+    WorkflowManager runs the workflow stages: communities scope, then for each topic search, download & normalization, then DB save.
+    Each stage output is checkpointed with a fingerprint of its inputs and config section.
+    With the --resume argument, the stages whose fingerprint is unchanged are skipped (their output is loaded from their checkpoint).
+    '''
     def __init__(self, args, config):
         self.args = args
         self.config = config
         self.logger = logging.getLogger(__name__)
+        self.checkpoint_manager = CheckpointManager(
+            config["workflow"].get("checkpoints_path", "data/checkpoints"),
+            resume=getattr(args, "resume", False),
+        )
 
     def run_workflow(self):
         self.logger.info("Workflow started.")
-        # Create blank dict to store dataframes that will be saved to the DB
+        # Create blank dict to store dataframes that will be saved to the DB, and the fingerprints of the stages producing them
         df_to_save_to_db = {}
+        df_fingerprints = {}
 
         # Build communities scope, and add selected communities to df_to_save
-        communities_selector = self.initialize_communities_scope(df_to_save_to_db)
+        communities_fingerprint, communities_selector = self.initialize_communities_scope(df_to_save_to_db)
+        df_fingerprints["communities"] = communities_fingerprint
 
         # Loop through the topics defined in the config
         for topic, topic_config in self.config['search'].items():
-            # Process each topic to get files in scope and datafiles
-            topic_files_in_scope, topic_datafiles = self.process_topic(communities_selector, topic, topic_config)
+            # Process each topic to get files in scope and the topic outputs (normalized data, files & columns out...)
+            topic_fingerprint, topic_files_in_scope, topic_outputs = self.process_topic(communities_fingerprint, communities_selector, topic, topic_config)
                 
             # Save the topics outputs to csv
             self.save_output_to_csv(
                 topic, 
-                topic_datafiles.normalized_data, 
+                topic_outputs["normalized_data"], 
                 topic_files_in_scope, 
-                getattr(topic_datafiles, 'datacolumns_out', None),
-                getattr(topic_datafiles, 'datafiles_out', None),
-                getattr(topic_datafiles, 'modifications_data', None)
+                topic_outputs["datacolumns_out"],
+                topic_outputs["datafiles_out"],
+                topic_outputs["modifications_data"],
+                topic_outputs["coercion_report"]
             )
             # Add normalized data of the topic to df_to_save
-            df_to_save_to_db[topic+"_normalized"] = topic_datafiles.normalized_data
+            df_to_save_to_db[topic+"_normalized"] = topic_outputs["normalized_data"]
+            df_fingerprints[topic+"_normalized"] = topic_fingerprint
             
-        # Save data to the database if the config allows it
+        # Save data to the database if the config allows it (skipped when resuming with unchanged data)
+        # A failed save raises, so that the stage is not checkpointed and is run again at the next resume
         if self.config["workflow"]["save_to_db"]:
-            self.save_data_to_db(df_to_save_to_db)
+            self.checkpoint_manager.run(
+                "db_save",
+                [self.config["workflow"], df_fingerprints],
+                lambda: self.save_data_to_db(df_to_save_to_db),
+            )
         
         self.logger.info("Workflow completed.")
 
     def initialize_communities_scope(self, df_to_save_to_db):
         self.logger.info("Initializing communities scope.")
         # Initialize CommunitiesSelector with the config and select communities
-        communities_selector = CommunitiesSelector(self.config["communities"])
+        # Only the selected data is checkpointed: the next stages use the selector through it
+        communities_fingerprint, get_selected_data = self.checkpoint_manager.run(
+            "communities",
+            [self.config["communities"]],
+            lambda: CommunitiesSelector(self.config["communities"]).selected_data,
+        )
+        communities_selector = CommunitiesSelector.from_selected_data(get_selected_data())
         # Add selected communities data to df_to_save
         df_to_save_to_db["communities"] = communities_selector.selected_data
         self.logger.info("Communities scope initialized.")
-        return communities_selector
+        return communities_fingerprint, communities_selector
     
-    def process_topic(self, communities_selector, topic, topic_config):
+    # Function to process a topic through its stages, returns the fingerprint of the topic outputs, the files in scope and the topic outputs
+    def process_topic(self, communities_fingerprint, communities_selector, topic, topic_config):
         self.logger.info(f"Processing topic {topic}.")
-        topic_files_in_scope = None
+        get_topic_files_in_scope = lambda: None
         
         if topic_config['source'] == 'multiple':
-            # Find multiple datafiles from datagouv
-            datagouv_searcher = DataGouvSearcher(communities_selector, self.config["datagouv"])
-            datagouv_topic_files_in_scope = datagouv_searcher.get_datafiles(topic_config)
-    
-            # Find single datafiles from single urls (standalone datasources outside of datagouv)
-            single_urls_builder = SingleUrlsBuilder(communities_selector)
-            single_urls_topic_files_in_scope = single_urls_builder.get_datafiles(topic_config)
-            
-            # Concatenate both datafiles lists into one
-            topic_files_in_scope = pd.concat([datagouv_topic_files_in_scope, single_urls_topic_files_in_scope], ignore_index=True)
+            # Find the datafiles in scope (datagouv & single urls), the single urls file is part of the inputs
+            search_fingerprint, get_topic_files_in_scope = self.checkpoint_manager.run(
+                f"{topic}_search",
+                [self.config["datagouv"], topic_config, communities_fingerprint, CheckpointManager.file_fingerprint(SingleUrlsBuilder.get_source_file(topic_config))],
+                lambda: self.search_topic_files(communities_selector, topic_config),
+            )
 
-            # Process the datafiles list: download & normalize
-            topic_datafiles = DatafilesLoader(topic_files_in_scope, topic, topic_config, self.config["datafile_loader"])
+            # Process the datafiles list: download, then normalize
+            # The download stage checkpoints the downloaded data only (schema, corpus & files out), not the loader
+            download_fingerprint, get_downloaded_data = self.checkpoint_manager.run(
+                f"{topic}_download",
+                [self.config["datafile_loader"], topic_config, search_fingerprint],
+                lambda: DatafilesLoader(get_topic_files_in_scope(), topic, topic_config, self.config["datafile_loader"]).download().get_downloaded_data(),
+            )
+            # The schema dictionary file is part of the normalization inputs
+            topic_fingerprint, get_topic_outputs = self.checkpoint_manager.run(
+                f"{topic}_normalization",
+                [self.config["datafile_loader"], download_fingerprint, CheckpointManager.file_fingerprint(DatafilesLoader.get_schema_dict_file(topic, topic_config))],
+                lambda: self._get_topic_outputs(
+                    DatafilesLoader.from_downloaded_data(get_downloaded_data(), topic, topic_config, self.config["datafile_loader"]).normalize()
+                ),
+            )
         
         elif topic_config['source'] == 'single':
-            # Process the single datafile: download & normalize
-            topic_datafiles = DatafileLoader(communities_selector, topic_config)
+            # Process the single datafile: download & normalize (streamed together, so a single stage)
+            topic_fingerprint, get_topic_outputs = self.checkpoint_manager.run(
+                f"{topic}_normalization",
+                [topic_config, communities_fingerprint],
+                lambda: self._get_topic_outputs(DatafileLoader(communities_selector, topic_config)),
+            )
 
         self.logger.info(f"Topic {topic} processed.")
-        return topic_files_in_scope, topic_datafiles
+        return topic_fingerprint, get_topic_files_in_scope(), get_topic_outputs()
+
+    def search_topic_files(self, communities_selector, topic_config):
+        # Find multiple datafiles from datagouv
+        datagouv_searcher = DataGouvSearcher(communities_selector, self.config["datagouv"])
+        datagouv_topic_files_in_scope = datagouv_searcher.get_datafiles(topic_config)
+
+        # Find single datafiles from single urls (standalone datasources outside of datagouv)
+        single_urls_builder = SingleUrlsBuilder(communities_selector)
+        single_urls_topic_files_in_scope = single_urls_builder.get_datafiles(topic_config)
+        
+        # Concatenate both datafiles lists into one
+        return pd.concat([datagouv_topic_files_in_scope, single_urls_topic_files_in_scope], ignore_index=True)
+
+    # Internal function to keep the outputs of a topic loader (the checkpointed output of the normalization stage)
+    @staticmethod
+    def _get_topic_outputs(topic_datafiles):
+        return {
+            output_name: getattr(topic_datafiles, output_name, None)
+            for output_name in ["normalized_data", "datacolumns_out", "datafiles_out", "modifications_data", "coercion_report"]
+        }
 
-    def save_output_to_csv(self, topic, normalized_data, topic_files_in_scope=None, datacolumns_out=None, datafiles_out=None, modifications_data=None):
+    def save_output_to_csv(self, topic, normalized_data, topic_files_in_scope=None, datacolumns_out=None, datafiles_out=None, modifications_data=None, coercion_report=None):
         # Define the output folder path
         output_folder = Path(get_project_base_path()) / "data" / "datasets" / topic / "outputs"
 
@@ -99,12 +158,15 @@ class WorkflowManager:
             save_csv(datafiles_out, output_folder, DATAFILES_OUT_FILENAME, sep=";")
         if modifications_data is not None:
             save_csv(modifications_data, output_folder, MODIFICATIONS_DATA_FILENAME, sep=";")
+        if coercion_report is not None:
+            save_csv(coercion_report, output_folder, COERCION_REPORT_FILENAME, sep=";")
     
     def save_data_to_db(self, df_to_save_to_db):
         self.logger.info("Saving data to the database.")
-        # Initialize the database connector
-        connector = PSQLConnector()
+        # Initialize the database connector, with one pooled connection per table loaded concurrently
+        connector = PSQLConnector(pool_size=self.config["workflow"].get("db_max_workers", 4))
         connector.connect()
-        # Save each dataframe to the database
-        for df_name, df in df_to_save_to_db.items():
-            connector.save_df_to_sql(df, df_name)
\ No newline at end of file
+        # Bulk save each dataframe to the database (COPY into a staging table, swapped with the table)
+        # In incremental mode, the tables with natural keys are upserted (only new & changed rows written, deleted rows kept as tombstones)
+        incremental_keys = self.config["workflow"].get("db_keys") if self.config["workflow"].get("db_save_mode", "replace") == "incremental" else None
+        connector.save_dfs_bulk(df_to_save_to_db, incremental_keys=incremental_keys)
\ No newline at end of file
@@ -0,0 +1,94 @@
+import gzip
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+class DatafilesStub:
+    '''
+    Local stub of the servers publishing the datafiles (GET /files/<name>), used to test and benchmark
+    the concurrent downloads of DatafilesLoader without the network.
+    files: {name: body bytes}, the unknown names are answered 404.
+    latency: delay of each answer in seconds (a number, or a function of the file name).
+    Every request is recorded in requests_log: (time, name, status).
+    '''
+
+    def __init__(self, files, latency=0):
+        self.files = files
+        self.latency = latency
+        self.requests_log = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/files/{name}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = self.path.split("/files/", 1)[-1]
+                latency = stub.latency(name) if callable(stub.latency) else stub.latency
+                if latency:
+                    time.sleep(latency)
+                body = stub.files.get(name)
+                status = 200 if body is not None else 404
+                with stub._lock:
+                    stub.requests_log.append((time.monotonic(), name, status))
+                body = body if body is not None else b"Not found"
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+# Function to build the bodies of count datafiles: CSV (';' or ','), JSON & gzipped CSV files of subsidies, with a few rows each
+def build_datafiles(count, rows=50):
+    files = {}
+    for i in range(count):
+        df = pd.DataFrame({
+            "nomBeneficiaire": [f"Association {i}-{j}" for j in range(rows)],
+            "montant": [1000.0 * i + j for j in range(rows)],
+            "dateConvention": ["2023-01-31"] * rows,
+        })
+        if i % 4 == 0:
+            files[f"file{i}.json"] = json.dumps(df.to_dict("records")).encode("utf-8")
+        elif i % 4 == 1:
+            files[f"file{i}.csv.gz"] = gzip.compress(df.to_csv(index=False, sep=";").encode("utf-8"))
+        else:
+            files[f"file{i}.csv"] = df.to_csv(index=False, sep=";" if i % 2 else ",").encode("utf-8")
+    return files
+
+# Function to build the files_in_scope of the datafiles served by a stub, with a missing file and a file in an unreadable format
+def build_files_in_scope(stub):
+    names = list(stub.files) + ["missing.csv", "file.pdf"]
+    return pd.DataFrame({
+        "siren": [str(200000000 + i) for i in range(len(names))],
+        "title": [f"Subventions {name}" for name in names],
+        "url": [stub.url(name) for name in names],
+        "format": [name.split(".", 1)[1] for name in names],
+    })
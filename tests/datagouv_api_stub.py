@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+class DatagouvApiStub:
+    '''
+    Local stub of the data.gouv.fr datasets API (GET /api/1/datasets/?organization=...&page_size=...&page=...),
+    used to test and benchmark the bottom up crawl of DataGouvSearcher without the network.
+    Each organization publishes datasets_per_org datasets (deterministic titles, descriptions & resources), served by pages
+    with an absolute next_page link, as the real API does.
+    latency: delay of each answer in seconds (a number, or a function of the organization id).
+    failures: statuses answered to the first attempts of each page (e.g. [429, 503]), with a Retry-After header of retry_after seconds.
+    Every request is recorded in requests_log: (time, organization, page, status).
+    '''
+
+    def __init__(self, datasets_per_org=5, latency=0, failures=(), retry_after=0):
+        self.datasets_per_org = datasets_per_org
+        self.latency = latency
+        self.failures = list(failures)
+        self.retry_after = retry_after
+        self.requests_log = []
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api/1/datasets/"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # Function to build the datasets of an organization, as returned by the API
+    def datasets(self, organization_id):
+        datasets = []
+        for i in range(self.datasets_per_org):
+            # One dataset out of two is about subsidies, one out of three has a resource describing an amount column
+            title = f"Subventions aux associations {i}" if i % 2 == 0 else f"Budget primitif {i}"
+            datasets.append({
+                "id": f"{organization_id}-ds{i}",
+                "title": title,
+                "description": f"Jeu de données {i} de l'organisation {organization_id}",
+                "frequency": "annual",
+                "organization": {"id": organization_id, "name": f"Organisation {organization_id}"},
+                "resources": [
+                    {
+                        "description": "Colonnes : nom, montant" if i % 3 == 0 else None,
+                        "format": fmt,
+                        "url": f"https://example.org/{organization_id}/ds{i}.{fmt}",
+                        "created_at": "2023-01-01T00:00:00",
+                    }
+                    for fmt in ("csv", "json")
+                ],
+            })
+        return datasets
+
+    def _answer(self, query):
+        organization_id = query.get("organization", [""])[0]
+        page_size = int(query.get("page_size", ["20"])[0])
+        page = int(query.get("page", ["1"])[0])
+
+        with self._lock:
+            attempt = self._attempts.get((organization_id, page), 0)
+            self._attempts[(organization_id, page)] = attempt + 1
+        latency = self.latency(organization_id) if callable(self.latency) else self.latency
+        if latency:
+            time.sleep(latency)
+        if attempt < len(self.failures):
+            return self.failures[attempt], organization_id, page, {}
+
+        datasets = self.datasets(organization_id)
+        start = (page - 1) * page_size
+        next_page = None
+        if start + page_size < len(datasets):
+            next_page = self.url + "?" + urlencode({"organization": organization_id, "page_size": page_size, "page": page + 1})
+        return 200, organization_id, page, {"data": datasets[start:start + page_size], "next_page": next_page, "page": page, "total": len(datasets)}
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, organization_id, page, payload = stub._answer(parse_qs(urlparse(self.path).query))
+                with stub._lock:
+                    stub.requests_log.append((time.monotonic(), organization_id, page, status))
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status in (429, 503):
+                    self.send_header("Retry-After", str(stub.retry_after))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,62 @@
+import io
+import json
+import logging
+import unittest
+import zipfile
+
+import pandas as pd
+
+from scripts.loaders.archive_loader import ArchiveLoader
+from tests.datafiles_stub import DatafilesStub
+
+ROWS = pd.DataFrame({"montant": range(10), "objet": [f"subvention {i}" for i in range(10)]})
+
+# Function to build a zip archive from a {member name: bytes} dict
+def build_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+class TestArchiveLoader(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_json_array_member_is_streamed_by_batches(self):
+        files = {"data.zip": build_zip({"data.json": json.dumps(ROWS.to_dict("records"))})}
+        with DatafilesStub(files) as stub:
+            chunks = list(ArchiveLoader(stub.url("data.zip"), chunksize=4).load())
+            df = ArchiveLoader(stub.url("data.zip")).load()
+
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 2])
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), df)
+        pd.testing.assert_frame_equal(df.drop(columns="archive_member"), ROWS)
+        self.assertEqual(df["archive_member"].unique().tolist(), ["data.json"])
+
+    def test_json_object_member_is_loaded_whole(self):
+        files = {"data.zip": build_zip({"data.json": ROWS.to_json(orient="columns")})}
+        with DatafilesStub(files) as stub:
+            df = ArchiveLoader(stub.url("data.zip")).load()
+        pd.testing.assert_frame_equal(df.drop(columns="archive_member").reset_index(drop=True), ROWS)
+
+    def test_nested_archive_chunks_are_read_lazily(self):
+        inner = build_zip({"a.csv": ROWS.to_csv(index=False)})
+        files = {"outer.zip": build_zip({"inner.zip": inner, "b.csv": ROWS.to_csv(index=False)})}
+        with DatafilesStub(files) as stub:
+            chunks = ArchiveLoader(stub.url("outer.zip"), chunksize=3).load()
+            # The first chunk is read before the rest of the nested archive
+            first_chunk = next(chunks)
+            self.assertEqual(len(first_chunk), 3)
+            self.assertEqual(first_chunk["archive_member"].iloc[0], "inner.zip/a.csv")
+            remaining_chunks = list(chunks)
+
+        df = pd.concat([first_chunk] + remaining_chunks, ignore_index=True)
+        self.assertEqual(df.groupby("archive_member", sort=False).size().to_dict(), {"inner.zip/a.csv": 10, "b.csv": 10})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import logging
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from scripts.datasets.datafiles_loader import DatafilesLoader
+from tests.datafiles_stub import DatafilesStub, build_datafiles, build_files_in_scope
+
+DATAFILE_LOADER_CONFIG = {"file_info_columns": ["siren", "title", "url", "archive_member"]}
+
+# Function to download the datafiles of files_in_scope with max_workers concurrent downloads (the schema is not loaded)
+def download(files_in_scope, max_workers):
+    with mock.patch.object(DatafilesLoader, "_load_schema", return_value=pd.DataFrame(columns=["name", "type"])):
+        datafiles_loader = DatafilesLoader(files_in_scope, "subventions", {"schema": {}}, dict(DATAFILE_LOADER_CONFIG, max_workers=max_workers))
+    return datafiles_loader.download()
+
+class TestDatafilesLoaderDownload(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_concurrent_download_keeps_files_order_and_results(self):
+        files = build_datafiles(12)
+        names = list(files)
+        # The first files answer last: completion order is the reverse of the files order
+        latency = lambda name: 0.02 * (len(names) - names.index(name)) if name in names else 0
+        with DatafilesStub(files, latency=latency) as stub:
+            files_in_scope = build_files_in_scope(stub)
+            sequential = download(files_in_scope, max_workers=1)
+            concurrent = download(files_in_scope, max_workers=8)
+
+        self.assertEqual(len(sequential.corpus), len(files))
+        self.assertEqual(len(concurrent.corpus), len(files))
+        for sequential_df, concurrent_df in zip(sequential.corpus, concurrent.corpus):
+            pd.testing.assert_frame_equal(sequential_df, concurrent_df)
+        self.assertEqual([df["url"].iloc[0] for df in concurrent.corpus], [stub.url(name) for name in names])
+        # The missing file and the file in an unreadable format are out, in the same order
+        pd.testing.assert_frame_equal(sequential.datafiles_out, concurrent.datafiles_out)
+        self.assertEqual(concurrent.datafiles_out["url"].tolist(), [stub.url("file.pdf"), stub.url("missing.csv")])
+
+if __name__ == "__main__":
+    unittest.main()
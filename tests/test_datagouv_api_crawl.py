@@ -0,0 +1,105 @@
+import logging
+import time
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from scripts.datasets.datagouv_searcher import DataGouvSearcher
+from scripts.loaders.rate_limiter import RateLimiter
+from scripts.loaders.session_manager import SessionManager
+from tests.datagouv_api_stub import DatagouvApiStub
+
+ORGANIZATION_IDS = [f"org{i}" for i in range(8)]
+
+# Function to build a DataGouvSearcher over the organizations, without loading the catalogs (CatalogMirror is mocked)
+def make_searcher(api_config, organization_ids=ORGANIZATION_IDS):
+    scope = mock.Mock()
+    scope.get_datagouv_ids.return_value = pd.DataFrame({
+        "siren": [str(200000000 + i) for i in range(len(organization_ids))],
+        "id_datagouv": organization_ids,
+    })
+    with mock.patch("scripts.datasets.datagouv_searcher.CatalogMirror") as catalog_mirror:
+        catalog_mirror.return_value.load.return_value = pd.DataFrame(columns=["organization_id"])
+        return DataGouvSearcher(scope, {"api": api_config})
+
+# Function to run the bottom up search of the stub datasets
+def crawl(searcher, stub):
+    return searcher._get_datafiles_by_content(stub.url, ["subvention"], ["organisation"], ["montant"])
+
+class TestDatagouvApiCrawl(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_concurrent_crawl_keeps_organizations_order(self):
+        # The first organizations answer last: completion order is the reverse of the organizations order
+        latency = lambda organization_id: 0.02 * (len(ORGANIZATION_IDS) - ORGANIZATION_IDS.index(organization_id))
+        with DatagouvApiStub(datasets_per_org=7, latency=latency) as stub:
+            sequential = crawl(make_searcher({"max_workers": 1, "page_size": 2}), stub)
+            concurrent = crawl(make_searcher({"max_workers": 8, "page_size": 2}), stub)
+
+        self.assertFalse(sequential.empty)
+        pd.testing.assert_frame_equal(sequential, concurrent)
+        sirens = concurrent["siren"].drop_duplicates().tolist()
+        self.assertEqual(sirens, sorted(sirens))
+        # All the pages of each organization are crawled: 7 datasets by pages of 2
+        self.assertEqual(len(stub.requests_log), 2 * len(ORGANIZATION_IDS) * 4)
+
+    def test_crawl_retries_on_429_and_503(self):
+        with DatagouvApiStub(datasets_per_org=5) as stub:
+            expected = crawl(make_searcher({"max_workers": 4, "page_size": 2}), stub)
+        with DatagouvApiStub(datasets_per_org=5, failures=[429, 503], retry_after=0) as stub:
+            result = crawl(make_searcher({"max_workers": 4, "page_size": 2, "max_retries": 5}), stub)
+
+        pd.testing.assert_frame_equal(expected, result)
+        statuses = [status for _, _, _, status in stub.requests_log]
+        # Each page (3 per organization) is answered 429, then 503, then 200
+        self.assertEqual(statuses.count(429), 3 * len(ORGANIZATION_IDS))
+        self.assertEqual(statuses.count(503), 3 * len(ORGANIZATION_IDS))
+        self.assertEqual(statuses.count(200), 3 * len(ORGANIZATION_IDS))
+
+    def test_retry_after_is_honored(self):
+        with DatagouvApiStub(datasets_per_org=1, failures=[429], retry_after=1) as stub:
+            crawl(make_searcher({"max_workers": 1, "page_size": 2}, ["org0"]), stub)
+        (first_time, _, _, first_status), (second_time, _, _, second_status) = stub.requests_log
+        self.assertEqual((first_status, second_status), (429, 200))
+        self.assertGreaterEqual(second_time - first_time, 0.9)
+
+    def test_crawl_respects_rate_limit(self):
+        requests_per_second = 40
+        with DatagouvApiStub(datasets_per_org=3) as stub:
+            crawl(make_searcher({"max_workers": 8, "page_size": 1, "requests_per_second": requests_per_second}), stub)
+        times = sorted(request_time for request_time, _, _, _ in stub.requests_log)
+        self.assertEqual(len(times), 3 * len(ORGANIZATION_IDS))
+        # Requests are spaced out by the global interval (with some tolerance for the scheduling of the server threads)
+        self.assertGreaterEqual(times[-1] - times[0], 0.8 * (len(times) - 1) / requests_per_second)
+
+class TestSessionManagerRetries(unittest.TestCase):
+
+    def test_retries_5xx_with_backoff_then_succeeds(self):
+        with DatagouvApiStub(datasets_per_org=1, failures=[500, 502, 504]) as stub:
+            response = SessionManager.get_with_retries(stub.url, max_retries=3, backoff=0.01, params={"organization": "org0"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([status for _, _, _, status in stub.requests_log], [500, 502, 504, 200])
+
+    def test_returns_last_response_when_retries_are_exhausted(self):
+        with DatagouvApiStub(datasets_per_org=1, failures=[503] * 10) as stub:
+            response = SessionManager.get_with_retries(stub.url, max_retries=2, backoff=0.01, params={"organization": "org0"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(stub.requests_log), 3)
+
+    def test_retry_after_delays_the_host_in_the_rate_limiter(self):
+        rate_limiter = RateLimiter()
+        with DatagouvApiStub(datasets_per_org=1, failures=[503], retry_after=1) as stub:
+            start = time.monotonic()
+            response = SessionManager.get_with_retries(stub.url, rate_limiter=rate_limiter, params={"organization": "org0"})
+            elapsed = time.monotonic() - start
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(elapsed, 0.9)
+
+if __name__ == "__main__":
+    unittest.main()
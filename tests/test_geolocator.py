@@ -0,0 +1,153 @@
+import io
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from scripts.utils.geocode_store import GeocodeStore
+from scripts.utils.geolocator import GeoLocator
+from tests.datafiles_stub import DatafilesStub
+
+FIXTURES_FOLDER = Path(__file__).parent / "fixtures" / "geoloc"
+
+# Coordinates answered by the mocked api-adresse CSV endpoint, by cog (the other communes are not found)
+API_COORDINATES = {"01053": ("5.2256", "46.2052"), "01004": ("5.3608", "45.9609")}
+
+# Function mocking the api-adresse CSV endpoint: the posted communes are answered with the API_COORDINATES
+def post_geocoding_api(url, files, data):
+    communes = pd.read_csv(io.StringIO(files["data"][1]), dtype=str)
+    coordinates = communes["cog"].map(API_COORDINATES)
+    communes["longitude"] = coordinates.str[0]
+    communes["latitude"] = coordinates.str[1]
+    communes["result_type"] = np.where(coordinates.notna(), "municipality", None)
+    return mock.Mock(status_code=200, text=communes.to_csv(index=False))
+
+class TestGeoLocator(unittest.TestCase):
+    '''
+    GeoLocator on the reference files of tests/fixtures/geoloc: centers of the regions & departments and of the communes
+    read from the fixtures folder, EPCI seats & communes identifiers served by a local stub, api-adresse mocked.
+    '''
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.tmp_folder = tempfile.TemporaryDirectory()
+        self.stub = DatafilesStub({name: (FIXTURES_FOLDER / name).read_bytes() for name in ["epci_coord.csv", "communes_id.csv"]}).start()
+        self.geo_config = {
+            "epci_coord_url": self.stub.url("epci_coord.csv"),
+            "communes_id_url": self.stub.url("communes_id.csv"),
+            "geoloc_folder": str(FIXTURES_FOLDER),
+            "reg_dep_centers_filename": "dep_reg_centers.csv",
+            "communes_centers_filename": "communes_centers.csv",
+            "geocoding_batch_size": 2,
+            "geocode_store": str(Path(self.tmp_folder.name) / "geocode_store.sqlite"),
+            "not_found_retry_ttl": 3600,
+        }
+
+    def tearDown(self):
+        self.stub.stop()
+        self.tmp_folder.cleanup()
+        logging.disable(logging.NOTSET)
+
+    # Function to build the communities to geocode: regions, departments, communes & EPCI, in or out of the reference files
+    @staticmethod
+    def communities():
+        return pd.DataFrame([
+            {"nom": "Île-de-France", "type": "REG", "cog": 11, "siren": "237500079"},
+            {"nom": "Corse-du-Sud", "type": "DEP", "cog": "2A", "siren": "222000016"},
+            {"nom": "Haute-Garonne", "type": "DEP", "cog": 31, "siren": "223100017"},
+            {"nom": "Toulouse", "type": "COM", "cog": 31555, "siren": "213105554"},
+            {"nom": "L'Abergement-Clémenciat", "type": "COM", "cog": "01001", "siren": "210100012"},
+            {"nom": "Ambérieu-en-Bugey", "type": "COM", "cog": "1004", "siren": "210100046"},
+            {"nom": "Commune inconnue", "type": "COM", "cog": "99999", "siren": "219999999"},
+            {"nom": "Toulouse Métropole", "type": "MET69", "cog": None, "siren": "243100518"},
+            {"nom": "CA du Bassin de Bourg-en-Bresse", "type": "CA", "cog": None, "siren": "200042935"},
+            {"nom": "EPCI sans SIREN", "type": "CC", "cog": None, "siren": None},
+        ])
+
+    def test_region_department_coordinates(self):
+        geolocator = GeoLocator(self.geo_config)
+        coordinates = geolocator.get_region_department_coordinates(["REG", "DEP", "DEP", "REG"], ["11", "2A", 31, "99"])
+        np.testing.assert_allclose(coordinates["longitude"].values[:3], [2.504722, 8.988056, 1.172778])
+        np.testing.assert_allclose(coordinates["latitude"].values[:3], [48.709167, 41.863611, 43.358611])
+        self.assertEqual(coordinates["source"].tolist(), ["reg_dep_centers"] * 3 + [None])
+        self.assertTrue(np.isnan(coordinates.loc[3, "longitude"]))
+
+    def test_commune_and_epci_coordinates_from_the_reference_files(self):
+        geolocator = GeoLocator(self.geo_config)
+        communes = geolocator.get_commune_coordinates([31555, "1001", "75056"])
+        np.testing.assert_allclose(communes[["longitude", "latitude"]].values, [[1.4328, 43.6007], [4.9306, 46.1517], [2.347, 48.8589]])
+        self.assertEqual(communes["source"].tolist(), ["communes_centers"] * 3)
+
+        seats = geolocator.get_epci_seat_communes(["243100518", 200054781, "200000000"])
+        self.assertEqual(seats["cog"].tolist()[:2], ["31555", "75056"])
+        self.assertTrue(pd.isna(seats.loc[2, "cog"]))
+        np.testing.assert_allclose(geolocator.get_epci_coordinates(["243100518"])[["longitude", "latitude"]].values, [[1.4328, 43.6007]])
+
+    def test_missing_communes_are_geocoded_by_the_api_in_batches(self):
+        geolocator = GeoLocator(self.geo_config)
+        with mock.patch("scripts.utils.geolocator.SessionManager.post", side_effect=post_geocoding_api) as post:
+            data_frame = geolocator.add_geocoordinates(self.communities())
+
+        # The communes & EPCI seats missing from the centers file are geocoded together, by batches of 2
+        posted_cogs = [cog for call in post.call_args_list for cog in pd.read_csv(io.StringIO(call.kwargs["files"]["data"][1]), dtype=str)["cog"]]
+        self.assertEqual(sorted(posted_cogs), ["01004", "01053", "99999"])
+        self.assertEqual(post.call_count, 2)
+        expected = {
+            "Île-de-France": (2.504722, 48.709167), "Corse-du-Sud": (8.988056, 41.863611), "Haute-Garonne": (1.172778, 43.358611),
+            "Toulouse": (1.4328, 43.6007), "L'Abergement-Clémenciat": (4.9306, 46.1517), "Ambérieu-en-Bugey": (5.3608, 45.9609),
+            "Toulouse Métropole": (1.4328, 43.6007), "CA du Bassin de Bourg-en-Bresse": (5.2256, 46.2052),
+        }
+        coordinates = data_frame.set_index("nom")[["longitude", "latitude"]]
+        for nom, (longitude, latitude) in expected.items():
+            self.assertAlmostEqual(coordinates.loc[nom, "longitude"], longitude)
+            self.assertAlmostEqual(coordinates.loc[nom, "latitude"], latitude)
+        self.assertTrue(coordinates.loc[["Commune inconnue", "EPCI sans SIREN"]].isna().all().all())
+
+        # Second run: everything is served by the geocode store, "Commune inconnue" included (not found, retry TTL running)
+        with mock.patch("scripts.utils.geolocator.SessionManager.post", side_effect=post_geocoding_api) as post:
+            second_run = GeoLocator(self.geo_config).add_geocoordinates(self.communities())
+        post.assert_not_called()
+        pd.testing.assert_frame_equal(second_run, data_frame)
+
+    def test_communes_of_failed_batches_are_not_stored(self):
+        with mock.patch("scripts.utils.geolocator.SessionManager.post", return_value=mock.Mock(status_code=503, text="")):
+            data_frame = GeoLocator(self.geo_config).add_geocoordinates(self.communities())
+        self.assertTrue(np.isnan(data_frame.set_index("nom").loc["Ambérieu-en-Bugey", "longitude"]))
+
+        # The failed communes are geocoded again at the next run
+        with mock.patch("scripts.utils.geolocator.SessionManager.post", side_effect=post_geocoding_api) as post:
+            data_frame = GeoLocator(self.geo_config).add_geocoordinates(self.communities())
+        self.assertEqual(post.call_count, 2)
+        self.assertAlmostEqual(data_frame.set_index("nom").loc["Ambérieu-en-Bugey", "longitude"], 5.3608)
+
+class TestGeocodeStore(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.tmp_folder = tempfile.TemporaryDirectory()
+        self.store = GeocodeStore(Path(self.tmp_folder.name) / "geocode_store.sqlite", not_found_retry_ttl=3600)
+        self.store.put(pd.DataFrame({
+            "type": ["COM", "COM"], "code": ["31555", "99999"],
+            "longitude": [1.4328, np.nan], "latitude": [43.6007, np.nan], "source": ["communes_centers", "api-adresse"],
+        }))
+
+    def tearDown(self):
+        self.tmp_folder.cleanup()
+        logging.disable(logging.NOTSET)
+
+    def test_entries_are_resolved_until_the_not_found_ttl_expires(self):
+        entries = self.store.get(["COM", "COM", "DEP"], ["31555", "99999", "31"])
+        self.assertEqual(entries["resolved"].tolist(), [True, True, False])
+        self.assertEqual(entries["source"].tolist()[:2], ["communes_centers", "not_found"])
+
+        # After the retry TTL, the "not found" entry is to geocode again, the found one stays resolved
+        with mock.patch("scripts.utils.geocode_store.time.time", return_value=entries["updated_at"].max() + 3601):
+            expired = self.store.get(["COM", "COM"], ["31555", "99999"])
+        self.assertEqual(expired["resolved"].tolist(), [True, False])
+
+if __name__ == "__main__":
+    unittest.main()
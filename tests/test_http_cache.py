@@ -0,0 +1,83 @@
+import gc
+import json
+import logging
+import tempfile
+import unittest
+import warnings
+from pathlib import Path
+
+import pandas as pd
+
+from scripts.loaders.base_loader import BaseLoader
+from scripts.loaders.csv_loader import CSVLoader
+from scripts.loaders.http_cache import HttpCache
+from scripts.loaders.json_loader import JSONLoader
+from tests.datafiles_stub import DatafilesStub
+
+FILES = {
+    "data.csv": b"siren;montant\n213105554;1500.5\n217500016;20\n",
+    "data.json": json.dumps([{"siren": "213105554", "montant": 1500.5}, {"siren": "217500016", "montant": 20}]).encode("utf-8"),
+}
+
+class TestHttpCache(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.tmp_folder = tempfile.TemporaryDirectory()
+        self.stub = DatafilesStub(FILES).start()
+        # The shared cache is set directly (configure() would also register its flush at exit)
+        HttpCache._instance = self.cache = HttpCache({"path": self.tmp_folder.name, "default_ttl": 3600})
+
+    def tearDown(self):
+        HttpCache._instance = None
+        self.stub.stop()
+        self.tmp_folder.cleanup()
+        logging.disable(logging.NOTSET)
+
+    def read_index(self):
+        return json.loads((Path(self.tmp_folder.name) / "index.json").read_text())
+
+    def test_cached_responses_give_the_same_data(self):
+        for name, loader_class in [("data.csv", CSVLoader), ("data.json", JSONLoader)]:
+            downloaded = loader_class(self.stub.url(name)).load()
+            cached = loader_class(self.stub.url(name)).load()
+            pd.testing.assert_frame_equal(downloaded, cached)
+        self.assertEqual(len(self.stub.requests_log), 2)
+        self.assertEqual(cached["montant"].tolist(), [1500.5, 20])
+
+    def test_cache_hits_are_written_to_the_index_by_flush(self):
+        url = self.stub.url("data.csv")
+        CSVLoader(url).load()
+        stored_access = self.read_index()[url]["last_access"]
+        for _ in range(3):
+            CSVLoader(url).load()
+        self.assertEqual(len(self.stub.requests_log), 1)
+        # The hits only update the index in memory
+        self.assertEqual(self.read_index()[url]["last_access"], stored_access)
+        self.cache.flush()
+        self.assertEqual(self.read_index()[url]["last_access"], self.cache.index[url]["last_access"])
+        self.assertGreater(self.cache.index[url]["last_access"], stored_access)
+
+    def test_missing_body_is_a_cache_miss(self):
+        url = self.stub.url("data.csv")
+        CSVLoader(url).load()
+        for body_file in (Path(self.tmp_folder.name) / "bodies").iterdir():
+            body_file.unlink()
+        self.assertEqual(len(CSVLoader(url).load()), 2)
+        self.assertEqual(len(self.stub.requests_log), 2)
+
+    def test_body_files_are_closed(self):
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            warnings.simplefilter("always", ResourceWarning)
+            for _ in range(2):
+                CSVLoader(self.stub.url("data.csv")).load()
+                list(CSVLoader(self.stub.url("data.csv"), chunksize=1).load())
+                JSONLoader(self.stub.url("data.json")).load()
+                BaseLoader.loader_factory(self.stub.url("data.json")).load()
+            HttpCache._instance = None
+            CSVLoader(self.stub.url("data.csv")).load()
+            gc.collect()
+        self.assertEqual([w for w in caught_warnings if issubclass(w.category, ResourceWarning)], [])
+
+if __name__ == "__main__":
+    unittest.main()
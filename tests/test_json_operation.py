@@ -0,0 +1,55 @@
+import io
+import json
+import logging
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from scripts.utils.json_operation import iter_json_array
+
+# Documents with items of all the JSON shapes, numbers of all the forms, escapes & non ASCII characters
+DOCUMENTS = [
+    b'{"marches":[-1.5e3, 2]}',
+    b'{"version": 1.25, "meta": {"a": [1, 2]}, "marches": [0, -0.5, 1E+2, 3e-1, 12345678901234567890, 7.0]}',
+    '{"marches": [{"id": "1", "montant": 1.5e3, "titulaires": [{"nom": "Société \\"A\\""}]}, true, false, null, "\\u00e9t\\u00e9", "été", [], {}, [1.5, [2e2]]], "fin": 1}'.encode("utf-8"),
+    b'{ "marches" : [ 1 , 2.5 , -3e2 ] , "autre" : 4.5e1 }',
+    b'{"autre": -2.5E-3, "marches": []}',
+    b'{"marches": [1.5]}',
+]
+
+class TestIterJsonArray(unittest.TestCase):
+
+    def test_items_do_not_depend_on_the_read_size(self):
+        for document in DOCUMENTS:
+            expected = json.loads(document)["marches"]
+            for read_size in list(range(1, 41)) + [64, 4096]:
+                with self.subTest(document=document, read_size=read_size):
+                    self.assertEqual(list(iter_json_array(io.BytesIO(document), "marches", read_size=read_size)), expected)
+
+    def test_top_level_array(self):
+        document = b'[1.5e3, -2, {"a": 0.5}, 7]'
+        for read_size in range(1, 20):
+            self.assertEqual(list(iter_json_array(io.BytesIO(document), read_size=read_size)), json.loads(document))
+
+    def test_missing_root_key(self):
+        self.assertEqual(list(iter_json_array(io.BytesIO(b'{"autre": [1.5, 2]}'), "marches", read_size=3)), [])
+
+class TestDatafileLoaderEmptyStream(unittest.TestCase):
+
+    def test_empty_stream_gives_an_empty_selection(self):
+        from scripts.datasets.datafile_loader import DatafileLoader
+
+        loader = DatafileLoader.__new__(DatafileLoader)
+        loader.logger = logging.getLogger(__name__)
+        loader.schema = pd.DataFrame({"property": ["acheteur.id", "montant"], "type": ["string", "number"]})
+        loader.communities_ids = pd.DataFrame({"siren": ["213105554"], "type": ["COM"], "nom": ["Toulouse"]})
+        topic_config = {"unified_dataset": {"url": "https://example.org/marches.json", "root": "marches"}}
+        with mock.patch("scripts.datasets.datafile_loader.JSONLoader") as json_loader:
+            json_loader.return_value.load.return_value = iter([])
+            selected_data, _ = loader._load_data(topic_config)
+        self.assertTrue(selected_data.empty)
+        self.assertEqual(sorted(selected_data.columns), ["nom", "siren", "type"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from scripts.utils.keyword_matcher import KeywordMatcher
+
+class TestKeywordMatcher(unittest.TestCase):
+
+    def test_literal_search_ignores_accents_and_case(self):
+        matcher = KeywordMatcher(["subvention", "régional", "aide"], regex=False)
+        self.assertTrue(matcher.search("SUBVENTIONS versées"))
+        self.assertTrue(matcher.search("Conseil Regional"))
+        self.assertTrue(matcher.search("Conseil RÉGIONAL"))
+        self.assertTrue(matcher.search("Aïde aux écoles"))
+        self.assertFalse(matcher.search("Budget de la voirie"))
+        self.assertFalse(matcher.search("Écoles élémentaires"))
+        self.assertFalse(matcher.search(np.nan))
+
+    def test_literal_and_regex_matchers_agree(self):
+        words = ["association", "subvention", "région"]
+        texts = pd.Series(["Subventions aux associations", "Région Pays de la Loire", "REGION", "Budget", np.nan, "Subv. asso"])
+        literal_mask = KeywordMatcher(words, regex=False).mask(texts)
+        regex_mask = KeywordMatcher(words).mask(texts)
+        pd.testing.assert_series_equal(literal_mask, regex_mask)
+        self.assertEqual(literal_mask.tolist(), [True, True, True, False, False, False])
+
+    def test_no_keywords_match_nothing(self):
+        self.assertFalse(KeywordMatcher([]).search("subvention"))
+        self.assertFalse(KeywordMatcher([], regex=False).search("subvention"))
+
+if __name__ == "__main__":
+    unittest.main()
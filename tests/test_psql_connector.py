@@ -0,0 +1,132 @@
+import logging
+import os
+import unittest
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from scripts.utils.psql_connector import PSQLConnector
+
+# The database tests run against the (disposable) PostgreSQL database of TEST_DATABASE_URL, e.g. postgresql://postgres@localhost:5432/postgres
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+# Function to build a frame with the types & null values of the normalized data, and strings which are special for COPY
+def build_typed_frame(rows=1000):
+    rng = np.random.default_rng(0)
+    text = pd.Series(rng.choice(np.array(["Mairie", "a;b", 'guillemet "x"', "ligne\nsuivante", "", r"\N", r"\NN", None], dtype=object), rows))
+    return pd.DataFrame({
+        "siren": [f"{200000000 + i}" for i in range(rows)],
+        "nom": text,
+        "montant": np.where(rng.random(rows) < 0.2, np.nan, rng.random(rows) * 1e6),
+        "annee": pd.array(np.where(rng.random(rows) < 0.2, None, rng.integers(2015, 2024, rows)), dtype="Int64"),
+        "nb": rng.integers(0, 100, rows),
+        "actif": rng.random(rows) < 0.5,
+        "date": pd.to_datetime(np.where(rng.random(rows) < 0.2, None, "2023-01-31")),
+    })
+
+class TestRowHashes(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.connector = PSQLConnector()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    # Function to get the row keys of a DataFrame, by row label
+    def row_keys(self, df, key_columns=["siren"]):
+        return self.connector._add_row_hashes(df, key_columns, "communities")[PSQLConnector.key_column]
+
+    def test_rows_with_unique_keys_are_keyed_by_their_natural_key(self):
+        df = pd.DataFrame({"siren": ["1", "2"], "nom": ["A", "B"]})
+        changed = pd.DataFrame({"siren": ["1", "2"], "nom": ["A", "B modifié"]})
+        self.assertEqual(self.row_keys(df).tolist(), self.row_keys(changed).tolist())
+        self.assertNotEqual(
+            self.connector._add_row_hashes(df, ["siren"], "communities")[PSQLConnector.hash_column][1],
+            self.connector._add_row_hashes(changed, ["siren"], "communities")[PSQLConnector.hash_column][1],
+        )
+
+    def test_rows_sharing_a_key_are_all_kept_with_distinct_keys(self):
+        df = pd.DataFrame({"siren": ["0", "0", "0", "0", "1"], "nom": ["A", "B", "C", "C", "D"]})
+        keys = self.row_keys(df)
+        self.assertEqual(keys.nunique(), len(df))
+
+    def test_removing_a_duplicate_does_not_change_the_other_keys(self):
+        df = pd.DataFrame({"siren": ["0", "0", "0", "1"], "nom": ["A", "B", "C", "D"]})
+        keys = self.row_keys(df)
+        for dropped in range(3):
+            remaining = df.drop(index=dropped)
+            self.assertEqual(self.row_keys(remaining).to_dict(), keys.drop(index=dropped).to_dict())
+        # Reordering the rows does not change the keys either
+        self.assertEqual(self.row_keys(df.iloc[::-1]).to_dict(), keys.to_dict())
+
+    def test_key_columns_are_matched_on_their_normalized_names(self):
+        df = pd.DataFrame({"Acheteur.Id": ["1", "2"], "id": ["a", "b"]})
+        self.assertEqual(self.row_keys(df, ["acheteur_id", "id"]).nunique(), 2)
+        with self.assertRaises(KeyError):
+            self.row_keys(df, ["siren"])
+
+@unittest.skipUnless(TEST_DATABASE_URL, "TEST_DATABASE_URL is not set")
+class TestBulkSave(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.connector = PSQLConnector()
+        self.connector.engine = create_engine(TEST_DATABASE_URL)
+
+    def tearDown(self):
+        for table_name in ["test_copy", "test_to_sql", "test_upsert"]:
+            self.connector.drop_table_if_exists(table_name)
+        self.connector.engine.dispose()
+        logging.disable(logging.NOTSET)
+
+    def read_table(self, table_name):
+        return pd.read_sql_query(f'SELECT * FROM "{table_name}" ORDER BY siren', self.connector.engine)
+
+    def column_types(self, table_name):
+        return pd.read_sql_query(
+            "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = %(table_name)s ORDER BY ordinal_position",
+            self.connector.engine, params={"table_name": table_name}
+        ).values.tolist()
+
+    def test_copy_matches_to_sql(self):
+        df = build_typed_frame()
+        self.connector.bulk_save_df(df, "test_copy")
+        self.connector.save_df_to_sql(df, "test_to_sql")
+
+        copied = self.read_table("test_copy")
+        self.assertEqual(len(copied), len(df))
+        self.assertEqual(self.column_types("test_copy"), self.column_types("test_to_sql"))
+        pd.testing.assert_frame_equal(copied, self.read_table("test_to_sql"))
+        # NULL values are loaded as NULL, the strings '\N' & '' are kept as strings
+        self.assertEqual(copied["nom"].isna().sum(), df["nom"].isna().sum())
+        self.assertEqual((copied["nom"] == r"\N").sum(), (df["nom"] == r"\N").sum())
+        self.assertEqual((copied["nom"] == "").sum(), (df["nom"] == "").sum())
+        self.assertEqual(copied["montant"].isna().sum(), df["montant"].isna().sum())
+        self.assertEqual(copied["annee"].isna().sum(), df["annee"].isna().sum())
+        self.assertEqual(copied["date"].isna().sum(), df["date"].isna().sum())
+
+    def test_bulk_save_replaces_the_table(self):
+        df = build_typed_frame()
+        self.connector.bulk_save_df(df, "test_copy")
+        self.connector.bulk_save_df(df.head(10), "test_copy")
+        self.assertEqual(len(self.read_table("test_copy")), 10)
+
+    def test_upsert_writes_changed_rows_and_keeps_tombstones(self):
+        df = build_typed_frame(100)
+        self.connector.upsert_df(df, "test_upsert", ["siren"])
+        changed = df.drop(index=[0, 1]).copy()
+        changed.loc[2, "nom"] = r"\N"
+        self.connector.upsert_df(changed, "test_upsert", ["siren"])
+
+        stored = self.read_table("test_upsert")
+        self.assertEqual(len(stored), 100)
+        self.assertEqual(stored[PSQLConnector.deleted_column].notna().sum(), 2)
+        self.assertEqual(stored.loc[2, "nom"], r"\N")
+        live = stored[stored[PSQLConnector.deleted_column].isna()].drop(columns=[PSQLConnector.key_column, PSQLConnector.hash_column, PSQLConnector.deleted_column, PSQLConnector.updated_column])
+        self.connector.save_df_to_sql(changed, "test_to_sql")
+        pd.testing.assert_frame_equal(live.reset_index(drop=True), self.read_table("test_to_sql"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import logging
+import pickle
+import tempfile
+import types
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+
+from scripts.workflow.workflow_manager import WorkflowManager
+
+class TestTopicCheckpoints(unittest.TestCase):
+    '''
+    Stages of a 'multiple' topic (search, download, normalization) run with --resume, their computations being mocked:
+    the input files (single urls & schema dictionary) are in a temporary folder, as the checkpoints.
+    '''
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.tmp_folder = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmp_folder.name)
+        self.single_urls_file = self.folder / "single_urls.csv"
+        self.single_urls_file.write_text("siren;url\n213105554;https://example.org/a.csv\n")
+        self.schema_dict_file = self.folder / "dataset_dict.csv"
+        self.schema_dict_file.write_text("original_name;official_name\nmontant_vote;montant\n")
+        self.config = {
+            "workflow": {"checkpoints_path": str(self.folder / "checkpoints")},
+            "datagouv": {},
+            "datafile_loader": {"file_info_columns": ["siren"]},
+        }
+        self.topic_config = {"source": "multiple", "single_urls_file": "single_urls.csv", "schema_dict_file": "dataset_dict.csv", "schema": {}}
+
+    def tearDown(self):
+        self.tmp_folder.cleanup()
+        logging.disable(logging.NOTSET)
+
+    # Function to process the topic, returns the mocked search & DatafilesLoader, to count the stages computed
+    def process_topic(self, resume):
+        workflow_manager = WorkflowManager(types.SimpleNamespace(resume=resume), self.config)
+        files_in_scope = pd.DataFrame({"siren": ["213105554"], "url": ["https://example.org/a.csv"]})
+        downloaded_data = {"schema": pd.DataFrame({"name": ["montant"]}), "corpus": [pd.DataFrame({"montant": [1.5]})], "datafiles_out": pd.DataFrame()}
+        normalized = types.SimpleNamespace(normalized_data=pd.DataFrame({"montant": [1.5]}))
+        with mock.patch.object(WorkflowManager, "search_topic_files", return_value=files_in_scope) as search, \
+             mock.patch("scripts.workflow.workflow_manager.SingleUrlsBuilder.get_source_file", return_value=self.single_urls_file), \
+             mock.patch("scripts.workflow.workflow_manager.DatafilesLoader") as datafiles_loader:
+            datafiles_loader.get_schema_dict_file.return_value = self.schema_dict_file
+            datafiles_loader.return_value.download.return_value.get_downloaded_data.return_value = downloaded_data
+            datafiles_loader.from_downloaded_data.return_value.normalize.return_value = normalized
+            _, _, topic_outputs = workflow_manager.process_topic("communities", None, "subventions", self.topic_config)
+        self.assertEqual(topic_outputs["normalized_data"]["montant"].tolist(), [1.5])
+        return search, datafiles_loader
+
+    def test_resume_skips_unchanged_stages(self):
+        self.process_topic(resume=False)
+        search, datafiles_loader = self.process_topic(resume=True)
+        search.assert_not_called()
+        datafiles_loader.assert_not_called()
+        datafiles_loader.from_downloaded_data.assert_not_called()
+
+    def test_schema_dictionary_edit_reruns_the_normalization(self):
+        self.process_topic(resume=False)
+        self.schema_dict_file.write_text("original_name;official_name\nmontant_verse;montant\n")
+        search, datafiles_loader = self.process_topic(resume=True)
+        search.assert_not_called()
+        datafiles_loader.assert_not_called()
+        datafiles_loader.from_downloaded_data.assert_called_once()
+
+    def test_single_urls_edit_reruns_the_search(self):
+        self.process_topic(resume=False)
+        self.single_urls_file.write_text("siren;url\n213105554;https://example.org/b.csv\n")
+        search, datafiles_loader = self.process_topic(resume=True)
+        search.assert_called_once()
+        # Same files in scope: the download & normalization stages are still resumed
+        datafiles_loader.assert_not_called()
+
+    def test_download_checkpoint_holds_the_downloaded_data_only(self):
+        self.process_topic(resume=False)
+        with open(self.folder / "checkpoints" / "subventions_download.pkl", "rb") as f:
+            self.assertEqual(sorted(pickle.load(f)), ["corpus", "datafiles_out", "schema"])
+
+if __name__ == "__main__":
+    unittest.main()